@@ -212,6 +212,10 @@ generate_configuration() {
 	# Interval, in second, between each run of the process executing
 	# the probes. Default: 60
 	# scheduler_interval = 60
+	# Number of databases probed concurrently. Default: 4
+	# probe_workers = 4
+	# Maximum duration, in second, of a probe on a database. Default: 30
+	# probe_timeout = 30
 
 	[statements]
 	# DB name hosting pg_stat_statements view (the one where the extension has
@@ -11,6 +11,7 @@ try:
 except ImportError:
     hupper = None
 
+from .. import storage
 from ..core import workers
 from ..discover import Discover, inspect_versions
 from ..notification import NotificationMgmt
@@ -129,6 +130,7 @@ class TemboardAgentApplication(BaseApplication):
     def apply_config(self):
         self.postgres = Postgres(app=self, **self.config.postgresql)
         self.postgres.connection_lost_observers.append(self.discover.connection_lost)
+        storage.configure(self.config.temboard.sqlite_synchronous)
         return super().apply_config()
 
     def bootstrap_plugins(self):
@@ -269,6 +271,12 @@ def list_options_specs():
     yield OptionSpec(section, "hostname", default=getfqdn(), validator=v.fqdn)
     home = os.environ.get("HOME", "/var/lib/temboard-agent")
     yield OptionSpec(section, "home", default=home, validator=v.writeabledir)
+    yield OptionSpec(
+        section,
+        "sqlite_synchronous",
+        default="NORMAL",
+        validator=storage.synchronous_level,
+    )
 
 
 app = TemboardAgentApplication(specs=list_options_specs())
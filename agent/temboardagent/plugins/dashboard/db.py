@@ -1,8 +1,7 @@
 import json
-import os
-import sqlite3
 from textwrap import dedent
 
+from ... import storage
 from ...toolkit.utils import JSONEncoder
 
 
@@ -18,7 +17,7 @@ def bootstrap(path, dbname):
     default) and want it to act as a FIFO queue.
     """
 
-    with sqlite3.connect(os.path.join(path, dbname)) as conn:
+    with storage.connect(path, dbname) as conn:
         c = conn.cursor()
         c.execute("DROP TABLE IF EXISTS metrics")
         c.execute(
@@ -32,7 +31,7 @@ def bootstrap(path, dbname):
 
 
 def add_metric(path, dbname, time, data, keep_limit):
-    with sqlite3.connect(os.path.join(path, dbname)) as conn:
+    with storage.connect(path, dbname) as conn:
         c = conn.cursor()
         c.execute(
             "INSERT INTO metrics VALUES(?, ?)",
@@ -52,14 +51,14 @@ def add_metric(path, dbname, time, data, keep_limit):
 
 
 def get_last_metric(path, dbname):
-    with sqlite3.connect(os.path.join(path, dbname)) as conn:
+    with storage.connect(path, dbname) as conn:
         c = conn.cursor()
         c.execute("SELECT data FROM metrics ORDER BY time DESC LIMIT 1")
         return c.fetchone()
 
 
 def get_all_metrics(path, dbname):
-    with sqlite3.connect(os.path.join(path, dbname)) as conn:
+    with storage.connect(path, dbname) as conn:
         c = conn.cursor()
         c.execute("SELECT data FROM metrics ORDER BY time ASC")
         return c.fetchall()
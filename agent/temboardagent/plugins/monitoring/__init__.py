@@ -8,9 +8,10 @@ from bottle import HTTPError, default_app, request, response
 from ... import __version__ as __VERSION__
 from ...toolkit import taskmanager
 from ...toolkit.configuration import OptionSpec
+from ...toolkit.utils import JSONEncoder
 from ...toolkit.validators import commalist
 from ...tools import now, validate_parameters
-from ...web.app import CustomBottle
+from ...web.app import CustomBottle, stream_response
 from . import db
 from .inventory import host_info, instance_info
 from .openmetrics import format_open_metrics_lines, generate_samples
@@ -34,7 +35,6 @@ def get_metrics():
     if not rows:
         return "# EOF\n"
     ((_, data),) = rows
-    data = json.loads(data)
     db.use_current_for_delta_metrics(data)
     lines = format_open_metrics_lines(generate_samples(data))
     return "\n".join(lines)
@@ -75,15 +75,23 @@ def get_monitoring():
         validate_parameters(request.query, [("limit", T_LIMIT, False)])
         limit = int(request.query["limit"])
 
-    out = []
     h, n = app.config.temboard.home, "monitoring.db"
-    for _, metrics in db.get_metrics(h, n, limit, start_timestamp):
-        metrics = json.loads(metrics)
+    rows = db.iter_metrics(h, n, limit, start_timestamp)
+    response.set_header("X-TemBoard-Discover-ETag", app.discover.etag)
+    response.content_type = "application/json"
+    # Stream JSON array row by row to keep memory bounded by a single row.
+    return stream_response(generate_history(rows))
+
+
+def generate_history(rows):
+    yield b"["
+    for i, (_, metrics) in enumerate(rows):
         # Dropping current value, use /metrics to get them.
         db.drop_current_for_delta_metrics(metrics)
-        out.append(metrics)
-    response.set_header("X-TemBoard-Discover-ETag", app.discover.etag)
-    return out
+        if i:
+            yield b","
+        yield json.dumps(metrics, cls=JSONEncoder).encode("utf-8")
+    yield b"]"
 
 
 @bottle.get("/config")
@@ -107,11 +115,21 @@ def monitoring_collector_worker(app):
     discover = app.discover.ensure_latest()
     system_info = host_info(discover)
     logger.debug("Load the probes to run.")
-    probes = load_probes(config.monitoring, config.temboard.home)
+    store = db.LastMeasures(config.temboard.home, "monitoring.db").load()
+    probes = load_probes(config.monitoring, store)
 
     with app.postgres.dbpool() as pool:
         instance = instance_info(pool, app.config.monitoring.dbnames, discover)
-        data = run_probes(probes, pool, [instance])
+        data, durations = run_probes(
+            probes,
+            pool,
+            [instance],
+            workers=config.monitoring.probe_workers,
+            timeout=config.monitoring.probe_timeout,
+        )
+
+    logger.debug("Save last measures for next delta.")
+    store.flush()
 
     # Prepare and send output
     output = dict(
@@ -119,6 +137,7 @@ def monitoring_collector_worker(app):
         hostinfo=system_info,
         instances=remove_passwords([instance]),
         data=data,
+        probes_duration=durations,
         version=__VERSION__,
     )
     logger.debug("Add data to metrics table.")
@@ -129,6 +148,7 @@ def monitoring_collector_worker(app):
     try:
         logger.debug("temboard_agent_version=%s", __VERSION__)
         logger.debug("hostinfo=%s", system_info)
+        logger.debug("probes_duration=%s", durations)
         for record in iter_metrics_for_logfmt(data):
             # up=1 is a marker to grep logfmt lines
             logger.debug("up=1 %s", " ".join("%s=%s" % i for i in record.items()))
@@ -166,6 +186,8 @@ class MonitoringPlugin:
         OptionSpec(s, "dbnames", default="*", validator=commalist),
         OptionSpec(s, "scheduler_interval", default=60, validator=int),
         OptionSpec(s, "probes", default="*", validator=commalist),
+        OptionSpec(s, "probe_workers", default=4, validator=int),
+        OptionSpec(s, "probe_timeout", default=30, validator=int),
     ]
     del s
 
@@ -1,9 +1,11 @@
+import hashlib
 import json
-import os
-import sqlite3
+import threading
+import zlib
 from textwrap import dedent
 from time import time as current_time
 
+from ... import storage
 from ...toolkit.utils import JSONEncoder
 
 
@@ -16,10 +18,11 @@ def bootstrap(path, dbname):
     delta values with potentially old data resulting with outliers.
 
     metrics table is used to queued collected data before they are pushed to
-    temboard server.
+    temboard server. documents table stores data shared by many metrics rows,
+    like host informations.
     """
 
-    with sqlite3.connect(os.path.join(path, dbname)) as conn:
+    with storage.connect(path, dbname) as conn:
         c = conn.cursor()
         c.execute("DROP TABLE IF EXISTS last_measures")
         c.execute(
@@ -39,28 +42,111 @@ def bootstrap(path, dbname):
                 )
             """)
         )
+        c.execute(
+            dedent("""
+                CREATE TABLE IF NOT EXISTS documents (
+                    digest TEXT PRIMARY KEY,
+                    time REAL,
+                    data TEXT
+                )
+            """)
+        )
 
 
 def add_metric(path, dbname, time, data):
-    with sqlite3.connect(os.path.join(path, dbname)) as conn:
+    with storage.connect(path, dbname) as conn:
         c = conn.cursor()
         c.execute(
-            "INSERT INTO metrics VALUES(?, ?)",
-            (time, json.dumps(data, cls=JSONEncoder)),
+            "INSERT INTO metrics VALUES(?, ?)", (time, encode_metric(c, time, data))
         )
         # When data are pulled from temboard server, we need to keep 6 hours of
         # data history for recovery.
         time_limit = current_time() - (60 * 60 * 6)
         c.execute("DELETE FROM metrics WHERE time < ?", (time_limit,))
+        # Documents time is updated on each reference. Thus, a document older
+        # than the oldest metric is not referenced anymore.
+        c.execute("DELETE FROM documents WHERE time < ?", (time_limit,))
+
+
+# Keys of metrics stored in documents table.
+DOCUMENTS = ("hostinfo", "instances")
+
+
+def encode_metric(c, time, data):
+    # Encode collected data as compressed JSON blob.
+    #
+    # Samples of each probe are stored column-oriented. Consecutive samples
+    # with the same keys share a list of columns. Host informations and
+    # instances are stored once in documents table and referenced by digest.
+    data = dict(data)
+    for key in DOCUMENTS:
+        if key in data:
+            data[key] = {"$document": upsert_document(c, time, data[key])}
+
+    data["data"] = {
+        probe: encode_samples(samples) for probe, samples in data["data"].items()
+    }
+    return zlib.compress(json.dumps(data, cls=JSONEncoder).encode("utf-8"))
+
+
+def encode_samples(samples):
+    groups = []
+    group = None
+    for sample in samples:
+        columns = list(sample.keys())
+        if group is None or group["columns"] != columns:
+            group = dict(columns=columns, rows=[])
+            groups.append(group)
+        group["rows"].append([sample[k] for k in columns])
+    return groups
+
+
+def upsert_document(c, time, document):
+    document = json.dumps(document, cls=JSONEncoder, sort_keys=True)
+    digest = hashlib.sha1(document.encode("utf-8")).hexdigest()
+    c.execute("UPDATE documents SET time = ? WHERE digest = ?", (time, digest))
+    if 0 == c.rowcount:
+        c.execute("INSERT INTO documents VALUES(?, ?, ?)", (digest, time, document))
+    return digest
+
+
+def decode_metric(c, raw, documents=None):
+    # Decode metrics data as stored by add_metric. documents is a cache of
+    # documents shared between calls.
+    if isinstance(raw, str):  # Metrics stored as JSON text by previous versions.
+        return json.loads(raw)
+
+    documents = {} if documents is None else documents
+    data = json.loads(zlib.decompress(raw).decode("utf-8"))
+    for key in DOCUMENTS:
+        if key not in data:
+            continue
+        digest = data[key]["$document"]
+        if digest not in documents:
+            c.execute("SELECT data FROM documents WHERE digest = ?", (digest,))
+            (document,) = c.fetchone()
+            documents[digest] = document
+        data[key] = json.loads(documents[digest])
+
+    data["data"] = {
+        probe: [
+            dict(zip(group["columns"], row))
+            for group in groups
+            for row in group["rows"]
+        ]
+        for probe, groups in data["data"].items()
+    }
+    return data
 
 
 def delete_metric(path, dbname, time):
-    with sqlite3.connect(os.path.join(path, dbname)) as conn:
+    with storage.connect(path, dbname) as conn:
         c = conn.cursor()
         c.execute("DELETE FROM metrics WHERE time = ?", (time,))
 
 
-def get_metrics(path, dbname, limit=50, start_timestamp=None):
+def iter_metrics(path, dbname, limit=50, start_timestamp=None):
+    # Generate decoded metrics one by one, reading the cursor incrementally.
     query = "SELECT time, data FROM metrics"
     args = ()
     if start_timestamp:
@@ -78,31 +164,69 @@ def get_metrics(path, dbname, limit=50, start_timestamp=None):
         query += " LIMIT ?"
         args += (limit,)
 
-    with sqlite3.connect(os.path.join(path, dbname)) as conn:
+    with storage.connect(path, dbname) as conn:
         c = conn.cursor()
         c.execute(query, args)
-        return c.fetchall()
+        # Use a dedicated cursor to fetch documents while iterating metrics.
+        dc = conn.cursor()
+        documents = {}
+        for time, data in c:
+            yield time, decode_metric(dc, data, documents)
 
 
-def get_last_measure(path, dbname, key):
-    with sqlite3.connect(os.path.join(path, dbname)) as conn:
-        c = conn.cursor()
-        c.execute("SELECT time, data FROM last_measures WHERE key = ?", (key,))
-        return c.fetchone()
+def get_metrics(path, dbname, limit=50, start_timestamp=None):
+    return list(iter_metrics(path, dbname, limit, start_timestamp))
+
+
+class LastMeasures:
+    # In-memory copy of last_measures table, used to compute delta.
+    #
+    # Load all measures at the beginning of a collect, update them in memory
+    # and write back updated measures in a single transaction with flush().
+    # Since each collect loads measures from SQLite, a collect recovers the
+    # measures flushed by the previous one, even if it crashed.
+
+    def __init__(self, path, dbname):
+        self.path = path
+        self.dbname = dbname
+        self.measures = dict()
+        self.updated = set()
+        self.lock = threading.Lock()
+
+    def load(self):
+        with storage.connect(self.path, self.dbname) as conn:
+            c = conn.cursor()
+            c.execute("SELECT key, time, data FROM last_measures")
+            for key, time, data in c.fetchall():
+                self.measures[key] = dict(time=time, data=json.loads(data))
+        return self
+
+    def get(self, key):
+        return self.measures.get(key)
+
+    def set(self, time, key, data):
+        with self.lock:
+            self.measures[key] = dict(time=time, data=data)
+            self.updated.add(key)
+
+    def flush(self):
+        with self.lock:
+            rows = [
+                (
+                    self.measures[key]["time"],
+                    key,
+                    json.dumps(self.measures[key]["data"], cls=JSONEncoder),
+                )
+                for key in self.updated
+            ]
+            self.updated.clear()
 
+        if not rows:
+            return
 
-def upsert_last_measure(path, dbname, time, key, data):
-    with sqlite3.connect(os.path.join(path, dbname)) as conn:
-        c = conn.cursor()
-        try:
-            c.execute(
-                "INSERT INTO last_measures VALUES(?, ?, ?)",
-                (time, key, json.dumps(data, cls=JSONEncoder)),
-            )
-        except sqlite3.IntegrityError:
-            c.execute(
-                "UPDATE last_measures SET time = ?, data = ? " "WHERE key = ?",
-                (time, json.dumps(data, cls=JSONEncoder), key),
+        with storage.connect(self.path, self.dbname) as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO last_measures VALUES(?, ?, ?)", rows
             )
 
 
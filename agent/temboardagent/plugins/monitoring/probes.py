@@ -1,8 +1,8 @@
-import json
 import logging
 import os
 import re
 import time
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import closing
 
 import psycopg2
@@ -12,13 +12,15 @@ from psycopg2.extras import PhysicalReplicationConnection
 from ...inventory import SysInfo
 from ...plugins.maintenance.functions import INDEX_BTREE_BLOAT_SQL
 from ...toolkit.utils import utcnow
-from . import db
 
 logger = logging.getLogger(__package__)
 
 
-def load_probes(options, home):
-    """Give a list of probe objects, ready to run."""
+def load_probes(options, store):
+    """Give a list of probe objects, ready to run.
+
+    store is a db.LastMeasures used to compute delta.
+    """
 
     # All probes classes names start with "probe_", search for
     # classes and get an object
@@ -32,24 +34,36 @@ def load_probes(options, home):
             and (m.group(1) in options["probes"] or "*" in options["probes"])
         ):
             o = eval(c + "(options)")
-            o.set_home(home)
+            o.set_store(store)
             probes.append(o)
             logger.debug("Loaded probe: %s.", o.get_name())
 
     return probes
 
 
-def run_probes(probes, pool, instances, delta=True):
-    """Execute the probes."""
+def run_probes(probes, pool, instances, delta=True, workers=1, timeout=None):
+    """Execute the probes.
+
+    SQL probes are grouped by database. Each database is probed in turn by one
+    of a bounded set of threads, on its own pooled connection. timeout is the
+    default deadline in seconds of a probe on a database, enforced with
+    statement_timeout.
+
+    Returns a tuple of the output and the duration of each probe in seconds.
+    """
 
     now = utcnow()
     logger.debug("Running probes at %s.", now.isoformat())
     # Output is a mapping of probe names with lists. Each probe returns
     # a list of dicts(metric -> value).
     output = {}
+    durations = {}
+    # Mapping of dbname -> list of (probe, conninfo) to run on this database.
+    jobs = {}
+    # Ordered list of (probe, dbnames) to reassemble output in a stable order.
+    sql_probes = []
 
     for p in probes:
-        out = []
         if delta is False:
             p.delta_key = None
             p.delta_columns = None
@@ -58,47 +72,105 @@ def run_probes(probes, pool, instances, delta=True):
             if not p.check():
                 continue
             logger.debug("Running host probe %s.", p.get_name())
+            start = time.monotonic()
             try:
                 out = p.run()
             except Exception as e:
                 logger.error("Probe failure: %s", e)
                 continue
+            durations[p.get_name()] = time.monotonic() - start
+            for record in out:
+                record["datetime"] = now
+            output[p.get_name()] = out
+            continue
 
-        else:
-            if p.level not in ("instance", "database"):
-                raise Exception("Unknown probe level: %s", p.level)
+        if p.level not in ("instance", "database"):
+            raise Exception("Unknown probe level: %s", p.level)
 
-            (i,) = instances  # We are now mono-instance
-            if not i["available"]:
-                continue
+        (i,) = instances  # We are now mono-instance
+        if not i["available"]:
+            continue
 
-            if not p.check(i["version_num"]):
-                logger.warning(
-                    "Unsupported PostgreSQL version for probe %s.", p.get_name()
-                )
-                continue
+        if not p.check(i["version_num"]):
+            logger.warning("Unsupported PostgreSQL version for probe %s.", p.get_name())
+            continue
 
-            logger.debug("Running %s probe %s.", p.level, p.get_name())
-            if p.level == "instance":
-                dbnames = [i["database"]]
-            else:
-                dbnames = [db["dbname"] for db in i["dbnames"]]
+        if p.level == "instance":
+            dbnames = [i["database"]]
+        else:
+            dbnames = [db["dbname"] for db in i["dbnames"]]
 
-            for dbname in dbnames:
-                conninfo = dict(i, dbname=dbname)
-                try:
-                    out += p.run(pool.getconn(dbname=dbname), conninfo)
-                except Exception as e:
-                    logger.error("Probe failure: %s", e)
-                    raise
-                    continue
+        sql_probes.append((p, dbnames))
+        for dbname in dbnames:
+            jobs.setdefault(dbname, []).append((p, dict(i, dbname=dbname)))
 
+    results = {}
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = [
+            executor.submit(run_database_probes, pool, dbname, dbjobs, timeout)
+            for dbname, dbjobs in jobs.items()
+        ]
+        for future in futures:
+            results.update(future.result())
+
+    for p, dbnames in sql_probes:
+        out = []
+        duration = 0.0
+        failed = []
+        for dbname in dbnames:
+            records, elapsed, error = results[p.get_name(), dbname]
+            out += records
+            duration += elapsed
+            if error:
+                failed.append(dbname)
         for record in out:
             record["datetime"] = now
         output[p.get_name()] = out
+        durations[p.get_name()] = duration
+        if failed:
+            durations[p.get_name() + "_failed"] = failed
 
     logger.debug("Finished probes run.")
-    return output
+    return output, durations
+
+
+def run_database_probes(pool, dbname, jobs, timeout=None):
+    # Run SQL probes sequentially on one database connection. Returns a
+    # mapping of (probe name, dbname) -> (records, duration, error). A failed
+    # probe, e.g. on statement timeout, has no records and does not prevent
+    # next probes.
+    results = {}
+    try:
+        conn = pool.getconn(dbname=dbname)
+    except Exception as e:
+        logger.error("Failed to connect to %s: %s", dbname, e)
+        for p, conninfo in jobs:
+            results[p.get_name(), dbname] = [], 0.0, str(e)
+        return results
+
+    for p, conninfo in jobs:
+        logger.debug("Running %s probe %s on %s.", p.level, p.get_name(), dbname)
+        deadline = p.timeout or timeout
+        start = time.monotonic()
+        error = None
+        try:
+            # Always set statement_timeout to reset previous probe deadline.
+            conn.execute("SET statement_timeout = '%ss';", (deadline or 0,))
+            out = p.run(conn, conninfo)
+        except Exception as e:
+            logger.error("Probe %s failure on %s: %s", p.get_name(), dbname, e)
+            out = []
+            error = str(e)
+        elapsed = time.monotonic() - start
+        if deadline and elapsed > deadline:
+            logger.warning(
+                "Probe %s on %s exceeded deadline of %ss.",
+                p.get_name(),
+                dbname,
+                deadline,
+            )
+        results[p.get_name(), dbname] = out, elapsed, error
+    return results
 
 
 def parse_primary_conninfo(pci):
@@ -193,9 +265,7 @@ class Probe:
     # Optionnal name of the probe
     name = None
     # Previous measures used for compute delta
-    last_measure = {}
-    last_measure_time = {}
-    home = None
+    store = None
 
     def __init__(self, options):
         pass
@@ -208,8 +278,8 @@ class Probe:
         """Returns the result."""
         pass
 
-    def set_home(self, home):
-        self.home = home
+    def set_store(self, store):
+        self.store = store
 
     def get_name(self):
         """Computes the name of the probe."""
@@ -226,12 +296,10 @@ class Probe:
         return None
 
     def get_last_measure(self, key):
-        row = db.get_last_measure(self.home, "monitoring.db", key)
-        if row:
-            return dict(time=row[0], data=json.loads(row[1]))
+        return self.store.get(key)
 
     def upsert_last_measure(self, time, key, data):
-        db.upsert_last_measure(self.home, "monitoring.db", time, key, data)
+        self.store.set(time, key, data)
 
     def delta(self, key, current_values):
         """
@@ -317,7 +385,8 @@ class SqlProbe(Probe):
     # compute delta on multiline output.
     delta_columns = None
     delta_key = None
-    timeout = False
+    # Deadline in seconds, overriding [monitoring] probe_timeout.
+    timeout = None
 
     def check(self, version=None):
         """Check if the plugin can run on the target version of PostgreSQL."""
@@ -343,9 +412,6 @@ class SqlProbe(Probe):
 
         output = []
         try:
-            if self.timeout:
-                conn.execute("SET statement_timeout = '%ss';", (self.timeout,))
-
             cluster_name = conninfo["instance"].replace("/", "")
             sql = f"-- probe {self}\n{sql}"
             for r in conn.query(sql):
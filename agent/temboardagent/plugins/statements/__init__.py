@@ -1,9 +1,10 @@
 import logging
+from time import time
 
-from bottle import HTTPError, default_app
+from bottle import HTTPError, default_app, request
 
 from ...toolkit.configuration import OptionSpec
-from ...tools import now
+from ...tools import now, validate_parameters
 from ...web.app import CustomBottle
 
 bottle = CustomBottle()
@@ -20,11 +21,31 @@ JOIN pg_authid ON pgss.userid = pg_authid.oid
 JOIN pg_database ON pgss.dbid = pg_database.oid
 """
 
+# calls counter of each statement, as of last snapshot sent to UI. seq
+# identifies this snapshot. UI requests statements changed since with
+# ?since=<seq>. texts holds the seq of snapshot which sent query text of each
+# statement.
+last_snapshot = dict(seq=None, calls=dict(), texts=dict())
+
+queries_query = """\
+SELECT DISTINCT queryid, dbid, userid, query
+FROM pg_stat_statements
+WHERE (queryid, dbid, userid) IN (
+  SELECT * FROM unnest(%s::bigint[], %s::oid[], %s::oid[])
+)
+"""
+
 
 @bottle.get("/")
 def get_statements(pgpool):
-    """Return a snapshot of latest statistics of executed SQL statements"""
+    """Return a snapshot of latest statistics of executed SQL statements
+
+    With ?since=<seq> parameter, returns only statements whose counters moved
+    since snapshot <seq>, if <seq> is the last snapshot. Otherwise, returns
+    a full snapshot.
+    """
     app = default_app().temboard
+    since = request.query.get("since")
     config = app.config
     dbname = config.statements.dbname
     snapshot_datetime = now()
@@ -46,7 +67,84 @@ def get_statements(pgpool):
         )
         raise HTTPError(500, e)
     else:
-        return {"snapshot_datetime": snapshot_datetime, "data": data}
+        snapshot = diff_snapshot(last_snapshot, data, since)
+        snapshot["snapshot_datetime"] = snapshot_datetime
+        return snapshot
+
+
+@bottle.post("/queries")
+def post_queries(pgpool):
+    """Return query texts of statements
+
+    Body is {"keys": [[queryid, dbid, userid], ...]}. Statements not in
+    pg_stat_statements anymore are ignored.
+    """
+    validate_parameters(request.json, [("keys", list, True)])
+    try:
+        keys = [
+            (int(queryid), int(dbid), int(userid))
+            for queryid, dbid, userid in request.json["keys"]
+        ]
+    except (TypeError, ValueError):
+        raise HTTPError(406, "Parameter 'keys' is malformed.")
+    queryids, dbids, userids = [list(column) for column in zip(*keys)] or [[], [], []]
+
+    dbname = default_app().temboard.config.statements.dbname
+    for connect in pgpool.auto_reconnect():
+        with connect(dbname) as conn:
+            data = list(conn.query(queries_query, (queryids, dbids, userids)))
+    return {"data": data}
+
+
+def diff_snapshot(last, data, since=None):
+    # Compare data with last snapshot and update it. Returns incremental
+    # snapshot if since is last snapshot seq, full snapshot otherwise.
+    #
+    # Since PostgreSQL 14, a statement may have a row per toplevel value.
+    # Statements are sent with all their rows.
+    #
+    # Requesting since=<seq> acknowledges snapshot <seq> and previous ones.
+    # Query text is sent once, until acknowledged.
+    keys = [(row["queryid"], row["dbid"], row["userid"]) for row in data]
+    calls = dict()
+    for key, row in zip(keys, data):
+        calls.setdefault(key, dict())[row.get("toplevel")] = row["calls"]
+    incremental = since is not None and str(last["seq"]) == since
+    # seq must not be reused after a restart.
+    seq = int(time() * 1000)
+    if last["seq"] is not None:
+        seq = max(seq, last["seq"] + 1)
+
+    removed = []
+    texts = dict()
+    if incremental:
+        removed = [list(key) for key in last["calls"] if key not in calls]
+        texts = {key: last["texts"][key] for key in calls if key in last["texts"]}
+        data = [
+            (key, row)
+            for key, row in zip(keys, data)
+            if last["calls"].get(key) != calls[key]
+        ]
+    else:
+        data = zip(keys, data)
+
+    rows = []
+    for key, row in data:
+        if texts.get(key, seq) < seq:
+            row = dict(row, query=None)
+        else:
+            texts[key] = seq
+        rows.append(row)
+
+    last["seq"] = seq
+    last["calls"] = calls
+    last["texts"] = texts
+    return {
+        "snapshot_seq": seq,
+        "incremental": incremental,
+        "data": rows,
+        "removed": removed,
+    }
 
 
 class StatementsPlugin:
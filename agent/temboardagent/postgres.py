@@ -9,6 +9,7 @@
 
 import logging
 import re
+import threading
 from contextlib import closing
 from time import sleep
 
@@ -218,20 +219,24 @@ class ConnectionPool(ThreadedConnectionPool):
 class DBConnectionPool:
     # Pool one connection per database.
     #
-    # Not thread-safe.
+    # Threads may get connections concurrently, as long as each connection is
+    # used by a single thread at a time.
 
     def __init__(self, postgres):
         self.postgres = postgres
         self.pool = dict()
+        self.lock = threading.Lock()
 
     def getconn(self, dbname=None):
         dbname = dbname or self.postgres.dbname
-        conn = self.pool.get(dbname)
+        with self.lock:
+            conn = self.pool.get(dbname)
         if not conn:
             logger.debug("Opening connection to db %s.", dbname)
             pqvars = self.postgres.pqvars(dbname=dbname)
             conn = retry_connect(connect, self.postgres.app, **pqvars)
-            self.pool[dbname] = conn
+            with self.lock:
+                self.pool[dbname] = conn
 
         return conn
 
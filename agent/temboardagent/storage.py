@@ -0,0 +1,62 @@
+#
+# SQLite storage of agent queues: monitoring and dashboard metrics.
+#
+# Each process and thread keeps a long-lived connection per database file.
+# sqlite3 module caches prepared statements per connection, reusing a
+# connection spares parsing queries again. Databases use WAL journal mode so
+# that web service reads queues while collectors write them.
+#
+
+import logging
+import os
+import sqlite3
+import threading
+
+logger = logging.getLogger(__name__)
+
+SYNCHRONOUS_LEVELS = ("OFF", "NORMAL", "FULL", "EXTRA")
+# Connections are keyed by pid, thread id and path. A forked worker must not
+# reuse connection opened by parent process.
+connections = dict()
+# NORMAL is safe from corruption in WAL mode. A power loss may rollback last
+# commits.
+synchronous = "NORMAL"
+
+
+def synchronous_level(raw):
+    # Validator for [temboard] sqlite_synchronous.
+    raw = raw.upper()
+    if raw not in SYNCHRONOUS_LEVELS:
+        raise ValueError("Must be one of %s" % ", ".join(SYNCHRONOUS_LEVELS))
+    return raw
+
+
+def configure(level):
+    global synchronous
+
+    if level != synchronous:
+        synchronous = level
+        # Apply new level on next connect.
+        closeall()
+
+
+def connect(path, dbname):
+    path = os.path.join(path, dbname)
+    key = os.getpid(), threading.get_ident(), path
+    conn = connections.get(key)
+    if conn is None:
+        logger.debug("Opening SQLite database %s.", path)
+        conn = sqlite3.connect(path)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = %s" % synchronous)
+        connections[key] = conn
+    return conn
+
+
+def closeall():
+    pid = os.getpid()
+    for key in list(connections):
+        conn = connections.pop(key)
+        # Don't close connection of parent process. Just forget it.
+        if key[0] == pid:
+            conn.close()
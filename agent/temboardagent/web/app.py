@@ -1,8 +1,10 @@
 import contextlib
 import functools
+import gzip
 import inspect
 import json
 import logging
+import zlib
 from datetime import timedelta
 
 from bottle import (
@@ -116,6 +118,10 @@ class PostgresPlugin:
 class JSONPlugin:
     # Bottle jsonify only dict. JSON Array was a security issue for some
     # browser.
+    #
+    # Compress body with gzip if client accepts it.
+    gzip_min_length = 1024
+
     def apply(self, callback, route):
         @functools.wraps(callback)
         def wrapper(*a, **kw):
@@ -128,15 +134,48 @@ class JSONPlugin:
             body = json.dumps(body, cls=JSONEncoder)
             if not isinstance(res, HTTPResponse):
                 res = response.copy(cls=HTTPResponse)
-            res.body = body
 
             res.headers["Content-Type"] = "application/json"
+            if len(body) >= self.gzip_min_length and accepts_gzip():
+                body = gzip.compress(body.encode("utf-8"), compresslevel=6)
+                res.headers["Content-Encoding"] = "gzip"
+                res.headers["Vary"] = "Accept-Encoding"
+            res.body = body
 
             return res
 
         return wrapper
 
 
+def stream_response(chunks):
+    # Stream bytes chunks, compressed if client accepts gzip.
+    if not accepts_gzip():
+        return chunks
+
+    response.set_header("Content-Encoding", "gzip")
+    response.set_header("Vary", "Accept-Encoding")
+    return gzip_stream(chunks)
+
+
+def gzip_stream(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        chunk = compressor.compress(chunk)
+        if chunk:
+            yield chunk
+    yield compressor.flush()
+
+
+def accepts_gzip():
+    # Whether client accepts gzip Content-Encoding.
+    for coding in request.headers.get("Accept-Encoding", "").split(","):
+        coding, _, params = coding.partition(";")
+        if "gzip" != coding.strip().lower():
+            continue
+        return params.replace(" ", "") not in ("q=0", "q=0.0")
+    return False
+
+
 class SignaturePlugin:
     name = "signature"
 
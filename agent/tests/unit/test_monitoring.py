@@ -402,3 +402,162 @@ def test_open_metrics_from_data():
     assert "node_procs_blocked 0\n" in text
     assert "node_procs_running 6\n" in text
     assert "xnode_procs_total 2500\n" in text
+
+
+def test_run_probes_by_database():
+    from temboardagent.plugins.monitoring.probes import SqlProbe, run_probes
+
+    class FakeConnection:
+        def __init__(self, dbname):
+            self.dbname = dbname
+            self.statements = []
+
+        def execute(self, sql, *args):
+            self.statements.append(sql % args[0])
+
+    class FakePool:
+        def __init__(self):
+            self.pool = dict()
+
+        def getconn(self, dbname):
+            return self.pool.setdefault(dbname, FakeConnection(dbname))
+
+    class probe_fake(SqlProbe):
+        level = "database"
+
+        def run(self, conn, conninfo):
+            return [dict(dbname=conn.dbname, value=1)]
+
+    class probe_slow(probe_fake):
+        level = "instance"
+        timeout = 300
+
+    instance = dict(
+        available=True,
+        version_num=150000,
+        database="postgres",
+        dbnames=[dict(dbname="postgres"), dict(dbname="db0"), dict(dbname="db1")],
+    )
+    pool = FakePool()
+    output, durations = run_probes(
+        [probe_fake({}), probe_slow({})], pool, [instance], workers=2, timeout=10
+    )
+
+    assert ["postgres", "db0", "db1"] == [r["dbname"] for r in output["fake"]]
+    assert ["postgres"] == [r["dbname"] for r in output["slow"]]
+    assert "datetime" in output["fake"][0]
+    assert sorted(durations) == ["fake", "slow"]
+    assert pool.pool["postgres"].statements == [
+        "SET statement_timeout = '10s';",
+        "SET statement_timeout = '300s';",
+    ]
+    assert pool.pool["db0"].statements == ["SET statement_timeout = '10s';"]
+
+
+def test_run_probes_database_failure():
+    from temboardagent.plugins.monitoring.probes import SqlProbe, run_probes
+
+    class FakeConnection:
+        def __init__(self, dbname):
+            self.dbname = dbname
+
+        def execute(self, sql, *args):
+            pass
+
+    class FakePool:
+        def getconn(self, dbname):
+            if "gone" == dbname:
+                raise Exception("database gone does not exist")
+            return FakeConnection(dbname)
+
+    class probe_fake(SqlProbe):
+        level = "database"
+
+        def run(self, conn, conninfo):
+            if "db1" == conn.dbname:
+                raise Exception("canceling statement due to statement timeout")
+            return [dict(dbname=conn.dbname, value=1)]
+
+    instance = dict(
+        available=True,
+        version_num=150000,
+        database="postgres",
+        dbnames=[
+            dict(dbname="postgres"),
+            dict(dbname="db1"),
+            dict(dbname="db2"),
+            dict(dbname="gone"),
+        ],
+    )
+    output, durations = run_probes(
+        [probe_fake({})], FakePool(), [instance], workers=2, timeout=10
+    )
+
+    assert ["postgres", "db2"] == [r["dbname"] for r in output["fake"]]
+    assert ["db1", "gone"] == durations["fake_failed"]
+    assert durations["fake"] >= 0
+
+
+def test_last_measures(tmp_path):
+    from temboardagent.plugins.monitoring import db
+    from temboardagent.plugins.monitoring.probes import probe_xacts
+
+    db.bootstrap(str(tmp_path), "monitoring.db")
+    store = db.LastMeasures(str(tmp_path), "monitoring.db").load()
+    probe = probe_xacts({})
+    probe.set_store(store)
+
+    delta = probe.delta("maindb0", dict(n_commit=10))
+    assert "measure_interval" not in delta
+    delta = probe.delta("maindb0", dict(n_commit=15))
+    assert 5 == delta["n_commit"]
+    store.flush()
+
+    # Next collect loads measures from previous one.
+    store = db.LastMeasures(str(tmp_path), "monitoring.db").load()
+    assert dict(n_commit=15) == store.get("xactsmaindb0")["data"]
+    probe.set_store(store)
+    delta = probe.delta("maindb0", dict(n_commit=20))
+    assert 5 == delta["n_commit"]
+
+
+def test_metrics_encoding(tmp_path):
+    from time import time
+
+    from temboardagent import storage
+    from temboardagent.plugins.monitoring import db
+
+    now = time()
+    db.bootstrap(str(tmp_path), "monitoring.db")
+    db.add_metric(str(tmp_path), "monitoring.db", now + 1, temboard_data)
+    db.add_metric(str(tmp_path), "monitoring.db", now + 2, temboard_data)
+
+    conn = storage.connect(str(tmp_path), "monitoring.db")
+    # Host informations are stored once.
+    assert 2 == conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+    # Previous versions stored JSON text.
+    conn.execute(
+        "INSERT INTO metrics VALUES (?, ?)", (now + 3, json.dumps(temboard_data))
+    )
+    conn.commit()
+
+    rows = db.get_metrics(str(tmp_path), "monitoring.db", start_timestamp=now)
+    assert [now + 1, now + 2, now + 3] == [t for t, _ in rows]
+    for _, data in rows:
+        assert temboard_data == data
+
+
+def test_generate_history():
+    import gzip
+
+    from temboardagent.plugins.monitoring import generate_history
+    from temboardagent.web.app import gzip_stream
+
+    rows = [(1.0, deepcopy(temboard_data)), (2.0, deepcopy(temboard_data))]
+    body = b"".join(gzip_stream(generate_history(iter(rows))))
+    history = json.loads(gzip.decompress(body).decode("utf-8"))
+
+    assert 2 == len(history)
+    assert "current" not in history[0]["data"]["xacts"][0]
+
+    assert [] == json.loads(b"".join(generate_history(iter([]))).decode("utf-8"))
@@ -0,0 +1,42 @@
+def test_diff_snapshot():
+    from temboardagent.plugins.statements import diff_snapshot
+
+    def row(queryid, calls, toplevel=None):
+        return dict(
+            queryid=queryid,
+            dbid=5,
+            userid=10,
+            calls=calls,
+            toplevel=toplevel,
+            query="SELECT %d" % queryid,
+        )
+
+    last = dict(seq=None, calls=dict(), texts=dict())
+    snapshot = diff_snapshot(last, [row(1, 1), row(2, 1)], since="1234")
+    # Unknown seq, full snapshot.
+    assert not snapshot["incremental"]
+    assert 2 == len(snapshot["data"])
+    seq = snapshot["snapshot_seq"]
+    assert seq == last["seq"]
+
+    snapshot = diff_snapshot(last, [row(1, 2), row(2, 1), row(3, 1)], str(seq))
+    assert snapshot["incremental"]
+    assert [1, 3] == [r["queryid"] for r in snapshot["data"]]
+    # Query text of 1 is acknowledged, not 3.
+    assert [None, "SELECT 3"] == [r["query"] for r in snapshot["data"]]
+    assert [] == snapshot["removed"]
+    assert snapshot["snapshot_seq"] > seq
+    seq = snapshot["snapshot_seq"]
+
+    # A statement is sent with all its rows.
+    data = [row(1, 2, True), row(1, 0, False), row(3, 1)]
+    snapshot = diff_snapshot(last, data, str(seq))
+    assert [1, 1] == [r["queryid"] for r in snapshot["data"]]
+    assert [None, None] == [r["query"] for r in snapshot["data"]]
+    assert [[2, 5, 10]] == snapshot["removed"]
+
+    # Without since, full snapshot.
+    snapshot = diff_snapshot(last, data)
+    assert not snapshot["incremental"]
+    assert 3 == len(snapshot["data"])
+    assert all(r["query"] for r in snapshot["data"])
@@ -0,0 +1,27 @@
+import pytest
+
+
+def test_connect(tmp_path):
+    from temboardagent import storage
+
+    conn = storage.connect(str(tmp_path), "test.db")
+    try:
+        assert conn is storage.connect(str(tmp_path), "test.db")
+        assert "wal" == conn.execute("PRAGMA journal_mode").fetchone()[0]
+        # NORMAL
+        assert 1 == conn.execute("PRAGMA synchronous").fetchone()[0]
+
+        storage.configure("FULL")
+        assert not storage.connections
+        conn = storage.connect(str(tmp_path), "test.db")
+        assert 2 == conn.execute("PRAGMA synchronous").fetchone()[0]
+    finally:
+        storage.configure("NORMAL")
+
+
+def test_synchronous_level():
+    from temboardagent.storage import synchronous_level
+
+    assert "OFF" == synchronous_level("off")
+    with pytest.raises(ValueError):
+        synchronous_level("toto")
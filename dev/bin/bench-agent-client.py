@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+#
+# Benchmark HTTP client connection pooling.
+#
+# Requests a local keep-alive HTTP/1.1 server with a new connection per
+# request, then with connections reused from pool. Documented in
+# docs/howto-temboard-performances.md
+#
+#     usage: bench-agent-client.py [REQUESTS] [CERTFILE KEYFILE]
+#
+# Server uses HTTPS when given a certificate and key.
+#
+
+import logging
+import ssl
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+from temboardui.toolkit.http import TemboardClient, configure_pool
+
+logger = logging.getLogger("bench-agent-client")
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately. Avoid delayed ACK stall.
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        body = b'{"hostname": "bench"}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *a):
+        pass
+
+
+def main(requests=1000, certfile=None, keyfile=None):
+    requests = int(requests)
+    server = Server(("127.0.0.1", 0), Handler)
+    scheme = "http"
+    if certfile:
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(certfile, keyfile)
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+        scheme = "https"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    try:
+        for name, max_per_host in (("connect", 0), ("pool", 4)):
+            configure_pool(max_per_host)
+            client = TemboardClient("127.0.0.1", server.server_port, scheme=scheme)
+            start = time.monotonic()
+            for _ in range(requests):
+                client.get("/").json()
+            duration = time.monotonic() - start
+            logger.info(
+                "%-7s %6d requests in %6.3fs: %8.0f requests/s.",
+                name,
+                requests,
+                duration,
+                requests / duration,
+            )
+    finally:
+        configure_pool(0)
+        server.shutdown()
+        server.server_close()
+
+
+logging.basicConfig(level=logging.INFO, format="%(levelname)1.1s: %(message)s")
+sys.exit(main(*sys.argv[1:]) or 0)
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+#
+# Benchmark pivot of per-database chart series.
+#
+# Pivots a synthetic db_size CSV with the former two-pass DictReader pivot
+# and with the single-pass pivot, then logs duration and peak memory of each.
+# Does not need a repository. Documented in docs/howto-temboard-performances.md
+#
+#     usage: bench-pivot.py [DATABASES] [TIMESTAMPS]
+#
+
+import csv
+import logging
+import operator
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from io import StringIO
+
+from temboardui.plugins.monitoring.pivot import drain, pivot_lines
+
+logger = logging.getLogger("bench-pivot")
+
+
+def main(databases=500, timestamps=1440):
+    databases = int(databases)
+    timestamps = int(timestamps)
+    data = generate_csv(databases, timestamps)
+    logger.info(
+        "Generated %d rows for %d databases, %.1f MiB.",
+        databases * timestamps,
+        databases,
+        len(data) / 1024 / 1024,
+    )
+
+    for name, pivot in (("legacy", legacy_pivot), ("single", single_pass_pivot)):
+        fd = StringIO(data)
+        start = time.monotonic()
+        out = pivot(fd)
+        duration = time.monotonic() - start
+
+        fd = StringIO(data)
+        tracemalloc.start()
+        pivot(fd)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        logger.info(
+            "%-6s %7.3fs, peak %6.1f MiB, output %6.1f MiB.",
+            name,
+            duration,
+            peak / 1024 / 1024,
+            len(out) / 1024 / 1024,
+        )
+
+
+def generate_csv(databases, timestamps):
+    fo = StringIO()
+    fo.write("date,dbname,size\n")
+    dt = datetime(2023, 1, 1, tzinfo=timezone.utc)
+    for i in range(timestamps):
+        date = (dt + timedelta(minutes=30 * i)).strftime("%Y-%m-%d %H:%M:%S+00")
+        for d in range(databases):
+            fo.write("%s,bench%d,%d\n" % (date, d, 8000000 + i * 1000 + d))
+    return fo.getvalue()
+
+
+def single_pass_pivot(fd):
+    # Like copy_metric_data_csv().
+    lines = pivot_lines(csv.reader(fd), index="date", key="dbname", value="size")
+    fd.close()
+    output = StringIO()
+    output.writelines(drain(lines))
+    return output.getvalue()
+
+
+def legacy_pivot(fd):
+    # Former pivot_timeserie() and get_metric_data_csv() buffers.
+    output = StringIO()
+    keys = {}
+    p = 1
+    for r in csv.DictReader(fd):
+        if r["dbname"] not in keys:
+            keys[r["dbname"]] = p
+            p += 1
+    sk = sorted(list(keys.items()), key=operator.itemgetter(1))
+    line = ["date"] + [x[0] for x in sk]
+    p_index = ""
+    fd.seek(0)
+    for r in csv.DictReader(fd):
+        if r["date"] != p_index:
+            output.write(",".join(line) + "\n")
+            line = [""] * (len(keys) + 1)
+            line[0] = r["date"]
+        line[keys[r["dbname"]]] = r["size"]
+        p_index = r["date"]
+    output.write(",".join(line) + "\n")
+    data = output.getvalue()
+    fd.close()
+    output.close()
+    return data
+
+
+logging.basicConfig(level=logging.INFO, format="%(levelname)1.1s: %(message)s")
+sys.exit(main(*sys.argv[1:]) or 0)
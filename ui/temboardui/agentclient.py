@@ -10,17 +10,26 @@ logger = logging.getLogger(__name__)
 
 class TemboardAgentClient(TemboardClient):
     @classmethod
-    def factory(cls, config, host, port, username="temboard"):
+    def factory(cls, config, host, port, username="temboard", timeout=30):
         return cls(
             config.signing_key,
             host,
             port,
             ca_cert_file=config.temboard.ssl_ca_cert_file,
             username=username,
+            timeout=timeout,
         )
 
-    def __init__(self, signing_key, host, port, ca_cert_file=None, username="temboard"):
-        super().__init__(host, port, ca_cert_file)
+    def __init__(
+        self,
+        signing_key,
+        host,
+        port,
+        ca_cert_file=None,
+        username="temboard",
+        timeout=30,
+    ):
+        super().__init__(host, port, ca_cert_file, timeout=timeout)
         self.signing_key = signing_key
         self.username = username
 
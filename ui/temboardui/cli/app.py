@@ -21,6 +21,7 @@ from ..toolkit import validators as v
 from ..toolkit.app import BaseApplication, define_core_arguments
 from ..toolkit.configuration import MergedConfiguration, OptionSpec
 from ..toolkit.errors import UserError
+from ..toolkit.http import configure_pool
 from ..toolkit.signing import load_private_key
 from ..toolkit.tasklist.sqlite3_engine import TaskListSQLite3Engine
 from ..version import __version__, format_version, inspect_versions
@@ -130,6 +131,7 @@ class TemboardApplication(BaseApplication):
             finalize_flask_app()  # Uses current_app thread local
 
         self.tornado_app.engine = configure_db_session(self.config.repository)
+        configure_pool(max_per_host=self.config.temboard.agent_keepalive_connections)
 
     def log_versions(self):
         versions = inspect_versions()
@@ -402,6 +404,8 @@ def list_options_specs():
     yield OptionSpec(s, "ssl_cert_file", default=None, validator=v.file_)
     yield OptionSpec(s, "ssl_key_file", default=None, validator=v.file_)
     yield OptionSpec(s, "ssl_ca_cert_file", validator=v.file_)
+    yield OptionSpec(s, "agent_keepalive_connections", default=4, validator=int)
+    yield OptionSpec(s, "worker_max_tasks", default=100, validator=int)
     yield OptionSpec(
         s, "signing_private_key", default="signing-private.pem", validator=v.path
     )
@@ -422,6 +426,10 @@ def list_options_specs():
     yield OptionSpec(s, "user", default="temboard")
     yield OptionSpec(s, "password", default="temboard")
     yield OptionSpec(s, "dbname", default="temboard")
+    yield OptionSpec(s, "pool_size", default=5, validator=int)
+    yield OptionSpec(s, "max_overflow", default=10, validator=int)
+    yield OptionSpec(s, "pool_recycle", default=3600, validator=int)
+    yield OptionSpec(s, "pool_pre_ping", default=True, validator=v.boolean)
 
     s = "notifications"
     yield OptionSpec(s, "smtp_host", default=None)
@@ -439,6 +447,7 @@ def list_options_specs():
 
     s = "statements"
     yield OptionSpec(s, "purge_after", default=7, validator=v.nday)
+    yield OptionSpec(s, "pull_concurrency", default=8, validator=int)
 
 
 app = TemboardApplication(specs=list_options_specs())
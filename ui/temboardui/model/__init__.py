@@ -1,4 +1,5 @@
 import logging
+import os
 import sys
 from time import sleep
 
@@ -8,11 +9,18 @@ from sqlalchemy.orm.session import sessionmaker
 
 from ..toolkit.queries import QueryFiler
 from .migrator import Migrator
+from .pool import InstrumentedQueuePool
 
 Session = sessionmaker(expire_on_commit=False)
 logger = logging.getLogger(__name__)
 # named queries, loaded with QUERIES.load() by temboardui.__main__.
 QUERIES = QueryFiler(__path__[0] + "/queries")
+# Worker engines by pid, DSN and options. A worker process executes several
+# tasks, reusing engine and its connection pool. Pool is configured from
+# [repository] section, except workers keep a single idle connection between
+# tasks. Tasks using a bigger pool dispose it on exit. See "Connection budget"
+# in docs/server_configure.md.
+_worker_engines = dict()
 
 
 def format_dsn(dsn):
@@ -24,12 +32,25 @@ def format_dsn(dsn):
     return fmt.format(**dsn)
 
 
+def engine_options(dbconf):
+    # Returns create_engine() pool options from [repository] section.
+    return dict(
+        poolclass=InstrumentedQueuePool,
+        pool_size=dbconf.get("pool_size", 5),
+        max_overflow=dbconf.get("max_overflow", 10),
+        pool_recycle=dbconf.get("pool_recycle", 3600),
+        pool_pre_ping=dbconf.get("pool_pre_ping", True),
+    )
+
+
 def configure(dsn, **kwargs):
+    options = dict()
     if hasattr(dsn, "items"):
+        options = engine_options(dsn)
         dsn = format_dsn(dsn)
 
     try:
-        engine = create_engine(dsn)
+        engine = create_engine(dsn, **options)
     except Exception as e:
         logger.warning("Connection to the database failed: %s", e)
         logger.warning("Please check your configuration.")
@@ -66,11 +87,22 @@ def check_connectivity(engine):
         raise Exception(msg % pgversion)
 
 
-def worker_engine(dbconf):
-    """Create a new stand-alone SQLAlchemy engine to be instantiated in worker
-    context.
+def worker_engine(dbconf, **kw):
+    """Get a stand-alone SQLAlchemy engine to be used in worker context. kw
+    override pool options from configuration. Engine is created once per
+    process and keeps its connections between tasks. Caller of infrequent
+    task overriding pool_size should dispose engine at end of task.
     """
-    return create_engine(format_dsn(dbconf))
+    dsn = format_dsn(dbconf)
+    options = engine_options(dbconf)
+    options["pool_size"] = 1
+    options.update(kw)
+    key = os.getpid(), dsn, tuple(sorted(options.items(), key=str))
+    engine = _worker_engines.get(key)
+    if engine is None:
+        logger.debug("Creating repository engine for worker process.")
+        engine = _worker_engines[key] = create_engine(dsn, **options)
+    return engine
 
 
 def check_schema():
@@ -0,0 +1,84 @@
+# Instrumented connection pool for repository engines.
+#
+# Each process logs statistics of its repository connection pools once per
+# minute in logfmt: connections opened per minute, checkouts and time spent
+# waiting for a connection. Sum connections of each process to size
+# max_connections of repository against the fleet.
+
+import logging
+import os
+import threading
+from time import monotonic
+
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+
+from ..toolkit import logfmt
+
+logger = logging.getLogger(__name__)
+
+
+class PoolStats:
+    interval = 60
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.start = monotonic()
+        self.connects = 0
+        self.checkouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def count_connect(self, *_):
+        # Listener of connect pool event: a new DBAPI connection is opened.
+        with self.lock:
+            self.connects += 1
+
+    def count_checkout(self, wait):
+        with self.lock:
+            self.checkouts += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+            elapsed = monotonic() - self.start
+            if elapsed < self.interval:
+                return
+            record = self.format(elapsed)
+            self.reset()
+        logger.debug("%s", record)
+
+    def format(self, elapsed):
+        return logfmt.format(
+            pid=os.getpid(),
+            pool_connects=self.connects,
+            pool_connects_per_minute="%.1f" % (self.connects * 60 / elapsed),
+            pool_checkouts=self.checkouts,
+            pool_wait_avg="%.4f" % (self.wait_total / (self.checkouts or 1)),
+            pool_wait_max="%.4f" % self.wait_max,
+        )
+
+
+class InstrumentedQueuePool(QueuePool):
+    # QueuePool accounting connections opened and checkout wait time. Wait
+    # time includes opening a new connection and pre-ping.
+
+    def __init__(self, *a, **kw):
+        recreated = "_dispatch" in kw
+        super().__init__(*a, **kw)
+        self.stats = PoolStats()
+        if not recreated:
+            # Recreated pool inherits listeners.
+            event.listen(self, "connect", self.stats.count_connect)
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+    def connect(self):
+        start = monotonic()
+        conn = super().connect()
+        self.stats.count_checkout(monotonic() - start)
+        return conn
@@ -0,0 +1,431 @@
+-- Partition monitoring metric tables by time.
+--
+-- Metric tables are partitioned by range on datetime, or on lower bound of
+-- history_range for _history tables. _current tables have daily partitions.
+-- _history and aggregate tables have monthly partitions. Existing table is
+-- kept as a _legacy partition holding rows until the end of current period.
+--
+-- Purge drops expired partitions instead of deleting rows. Partitions are
+-- created ahead of time by partitions_worker.
+--
+-- Partitioning requires PostgreSQL 11. With older PostgreSQL, tables are left
+-- untouched and purge keeps deleting rows.
+
+CREATE OR REPLACE FUNCTION monitoring.partition_unit(i_tablename TEXT) RETURNS TEXT
+LANGUAGE plpgsql IMMUTABLE
+AS $$
+BEGIN
+  IF i_tablename ~ '_(30m|6h)_current$' OR i_tablename ~ '_history$' THEN
+    RETURN 'month';
+  END IF;
+  RETURN 'day';
+END;
+$$;
+
+
+CREATE OR REPLACE FUNCTION monitoring.partition_key(i_tablename TEXT) RETURNS TEXT
+LANGUAGE plpgsql IMMUTABLE
+AS $$
+BEGIN
+  IF i_tablename ~ '_history$' THEN
+    -- History ranges span at most one day, see archive_current_metrics().
+    RETURN 'lower(history_range)';
+  END IF;
+  RETURN 'datetime';
+END;
+$$;
+
+
+CREATE OR REPLACE FUNCTION monitoring.partition_upper_bound(i_partition OID) RETURNS TIMESTAMPTZ
+LANGUAGE plpgsql STABLE
+AS $$
+DECLARE
+  v_bound TEXT;
+BEGIN
+  -- Parse FOR VALUES FROM (...) TO ('...').
+  SELECT pg_get_expr(relpartbound, oid) INTO v_bound
+  FROM pg_catalog.pg_class WHERE oid = i_partition;
+  RETURN substring(v_bound FROM 'TO \(''([^'']+)''\)')::TIMESTAMPTZ;
+END;
+$$;
+
+
+CREATE OR REPLACE FUNCTION monitoring.partition_table(i_tablename TEXT) RETURNS VOID
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_legacy TEXT := i_tablename || '_legacy';
+  v_unit TEXT := monitoring.partition_unit(i_tablename);
+  v_until TIMESTAMPTZ;
+  r RECORD;
+BEGIN
+  IF current_setting('server_version_num')::INTEGER < 110000 THEN
+    RAISE NOTICE 'Partitioning % requires PostgreSQL 11.', i_tablename;
+    RETURN;
+  END IF;
+
+  PERFORM 1 FROM pg_catalog.pg_class AS c
+  JOIN pg_catalog.pg_namespace AS n ON n.oid = c.relnamespace
+  WHERE n.nspname = 'monitoring' AND c.relname = i_tablename AND c.relkind = 'p';
+  IF FOUND THEN
+    RETURN;
+  END IF;
+
+  EXECUTE format('ALTER TABLE monitoring.%I RENAME TO %I', i_tablename, v_legacy);
+  -- Free index names for the partitioned table. Truncated names of long
+  -- indexes collide, suffix them with a hash of the full name.
+  FOR r IN
+    SELECT c.relname FROM pg_catalog.pg_index AS i
+    JOIN pg_catalog.pg_class AS c ON c.oid = i.indexrelid
+    WHERE i.indrelid = format('monitoring.%I', v_legacy)::REGCLASS
+  LOOP
+    EXECUTE format('ALTER INDEX monitoring.%I RENAME TO %I', r.relname, left(r.relname, 48) || '_' || left(md5(r.relname), 7) || '_legacy');
+  END LOOP;
+
+  EXECUTE format(
+    'CREATE TABLE monitoring.%I (LIKE monitoring.%I INCLUDING DEFAULTS) PARTITION BY RANGE (%s)',
+    i_tablename, v_legacy, monitoring.partition_key(i_tablename)
+  );
+
+  -- Copy unique and foreign key constraints and indexes of legacy table.
+  -- LIKE does not copy foreign keys.
+  FOR r IN
+    SELECT pg_get_constraintdef(oid) AS def FROM pg_catalog.pg_constraint
+    WHERE conrelid = format('monitoring.%I', v_legacy)::REGCLASS AND contype IN ('u', 'f')
+  LOOP
+    EXECUTE format('ALTER TABLE monitoring.%I ADD %s', i_tablename, r.def);
+  END LOOP;
+  FOR r IN
+    SELECT substring(pg_get_indexdef(i.indexrelid) FROM ' USING .*$') AS def
+    FROM pg_catalog.pg_index AS i
+    WHERE i.indrelid = format('monitoring.%I', v_legacy)::REGCLASS
+      AND NOT EXISTS (SELECT 1 FROM pg_catalog.pg_constraint WHERE conindid = i.indexrelid)
+  LOOP
+    EXECUTE format('CREATE INDEX ON monitoring.%I %s', i_tablename, r.def);
+  END LOOP;
+
+  IF i_tablename ~ '_history$' AND i_tablename !~ '_columnar_history$' THEN
+    -- Range of a single record is empty, without lower bound to route the
+    -- row. Include upper bound.
+    EXECUTE format(
+      'UPDATE monitoring.%I AS h SET history_range = ('
+      'SELECT tstzrange(min(r.datetime), max(r.datetime), ''[]'') FROM unnest(h.records) AS r'
+      ') WHERE isempty(history_range)',
+      v_legacy
+    );
+  END IF;
+
+  -- Legacy partition holds rows until the end of current period.
+  v_until := date_trunc(v_unit, NOW()) + ('1 ' || v_unit)::INTERVAL;
+  EXECUTE format(
+    'ALTER TABLE monitoring.%I ATTACH PARTITION monitoring.%I FOR VALUES FROM (MINVALUE) TO (%L)',
+    i_tablename, v_legacy, v_until
+  );
+END;
+$$;
+
+
+CREATE OR REPLACE FUNCTION monitoring.create_partitions(i_tablename TEXT, i_until TIMESTAMPTZ)
+RETURNS SETOF TEXT
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_unit TEXT := monitoring.partition_unit(i_tablename);
+  v_start TIMESTAMPTZ;
+  v_end TIMESTAMPTZ;
+  v_partition TEXT;
+BEGIN
+  -- Create partitions following the last one, until i_until.
+  SELECT max(monitoring.partition_upper_bound(inhrelid)) INTO v_start
+  FROM pg_catalog.pg_inherits
+  WHERE inhparent = format('monitoring.%I', i_tablename)::REGCLASS;
+  v_start := COALESCE(v_start, date_trunc(v_unit, NOW()));
+
+  WHILE v_start < i_until LOOP
+    v_end := v_start + ('1 ' || v_unit)::INTERVAL;
+    v_partition := i_tablename || '_p' || to_char(v_start, 'YYYYMMDD');
+    EXECUTE format(
+      'CREATE TABLE monitoring.%I PARTITION OF monitoring.%I FOR VALUES FROM (%L) TO (%L)',
+      v_partition, i_tablename, v_start, v_end
+    );
+    RETURN NEXT v_partition;
+    v_start := v_end;
+  END LOOP;
+END;
+$$;
+
+
+CREATE OR REPLACE FUNCTION monitoring.drop_partitions(i_tablename TEXT, i_before TIMESTAMPTZ)
+RETURNS SETOF TEXT
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_partition TEXT;
+BEGIN
+  -- Drop partitions holding only rows older than i_before.
+  FOR v_partition IN
+    SELECT c.relname FROM pg_catalog.pg_inherits AS i
+    JOIN pg_catalog.pg_class AS c ON c.oid = i.inhrelid
+    WHERE i.inhparent = format('monitoring.%I', i_tablename)::REGCLASS
+      AND monitoring.partition_upper_bound(c.oid) <= i_before
+    ORDER BY 1
+  LOOP
+    EXECUTE format('DROP TABLE monitoring.%I', v_partition);
+    RETURN NEXT v_partition;
+  END LOOP;
+END;
+$$;
+
+
+CREATE OR REPLACE FUNCTION monitoring.range_pruning(i_key TEXT, i_range TSTZRANGE, i_margin INTERVAL)
+RETURNS TEXT
+LANGUAGE plpgsql IMMUTABLE
+AS $$
+DECLARE
+  v_where TEXT := '';
+BEGIN
+  -- Returns redundant btree conditions on partition key, allowing the
+  -- planner to prune partitions. Range operators do not prune partitions.
+  IF isempty(i_range) THEN
+    RETURN v_where;
+  END IF;
+  IF NOT lower_inf(i_range) THEN
+    v_where := v_where || ' AND ' || i_key || ' >= ' || quote_literal(lower(i_range) - i_margin) || '::TIMESTAMPTZ';
+  END IF;
+  IF NOT upper_inf(i_range) THEN
+    v_where := v_where || ' AND ' || i_key || ' <= ' || quote_literal(upper(i_range)) || '::TIMESTAMPTZ';
+  END IF;
+  RETURN v_where;
+END;
+$$;
+
+
+CREATE OR REPLACE FUNCTION monitoring.archive_current_metrics(table_name TEXT, record_type TEXT, query TEXT)
+RETURNS TABLE(tblname TEXT, nb_rows INTEGER)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_table_current TEXT;
+  v_table_history TEXT;
+  v_query TEXT;
+  i INTEGER;
+BEGIN
+  v_table_current := table_name || '_current';
+  v_table_history := table_name || '_history';
+  -- Lock _current table to prevent concurrent updates
+  EXECUTE 'LOCK TABLE ' || v_table_current || ' IN SHARE MODE';
+  v_query := replace(query, '#history_table#', v_table_history);
+  v_query := replace(v_query, '#current_table#', v_table_current);
+  v_query := replace(v_query, '#record_type#', record_type);
+  -- Include upper bound so that range of a single record is not empty.
+  -- Partition key of _history is the lower bound of the range.
+  v_query := replace(v_query, 'tstzrange(min(datetime), max(datetime))', 'tstzrange(min(datetime), max(datetime), ''[]'')');
+  -- Move data into _history table
+  EXECUTE v_query;
+  GET DIAGNOSTICS i = ROW_COUNT;
+  -- Truncate _current table
+  EXECUTE 'TRUNCATE '||v_table_current;
+  -- Return each history table name and the number of rows inserted
+  RETURN QUERY SELECT v_table_history, i;
+END;
+$$;
+
+
+CREATE OR REPLACE FUNCTION monitoring.create_tables() RETURNS TABLE(tblname TEXT)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  t JSON;
+  c JSON;
+  v_agg_periods TEXT[] := array['30m', '6h'];
+  v_create_tbl_cols_cur TEXT;
+  v_create_idx_cols_cur TEXT;
+  v_create_tbl_cols_hist TEXT;
+  v_create_idx_cols_hist TEXT;
+  v_tablename TEXT;
+  v_like_tablename TEXT;
+  v_create_tbl_stmt TEXT;
+  v_create_idx_stmt TEXT;
+  i_period TEXT;
+BEGIN
+  -- Tables creation if they do not exist
+  FOR t IN SELECT metric_tables_config()->json_object_keys(metric_tables_config()) LOOP
+    v_create_tbl_cols_cur := 'datetime TIMESTAMPTZ NOT NULL';
+    v_create_idx_cols_cur := 'datetime';
+    FOR c IN SELECT json_array_elements(t->'columns') LOOP
+      v_create_tbl_cols_cur := v_create_tbl_cols_cur||', '||trim((c->'name')::TEXT, '"')||' '||trim((c->'data_type')::TEXT, '"');
+      v_create_idx_cols_cur := v_create_idx_cols_cur||', '||trim((c->'name')::TEXT, '"');
+    END LOOP;
+
+  -- Creation of current table.
+    v_tablename := trim((t->'name')::TEXT, '"')||'_current';
+    PERFORM 1 FROM pg_tables WHERE tablename = v_tablename AND schemaname = current_schema();
+    IF NOT FOUND THEN
+      EXECUTE 'CREATE TABLE '||v_tablename||' ('||v_create_tbl_cols_cur||', record '||trim((t->'record_type')::TEXT, '"')||')';
+      EXECUTE 'CREATE INDEX idx_'||v_tablename||' ON '||v_tablename||' ('||v_create_idx_cols_cur||')';
+      PERFORM monitoring.partition_table(v_tablename);
+      RETURN QUERY SELECT v_tablename;
+    END IF;
+
+    -- Creation of history table.
+    v_create_tbl_cols_hist := 'history_range TSTZRANGE NOT NULL';
+    v_create_idx_cols_hist := 'history_range';
+    FOR c IN SELECT json_array_elements(t->'columns') LOOP
+      v_create_tbl_cols_hist := v_create_tbl_cols_hist||', '||trim((c->'name')::TEXT, '"')||' '||trim((c->'data_type')::TEXT, '"');
+      v_create_idx_cols_hist := v_create_idx_cols_hist||', '||trim((c->'name')::TEXT, '"');
+    END LOOP;
+
+    v_tablename := trim((t->'name')::TEXT, '"')||'_history';
+    PERFORM 1 FROM pg_tables WHERE tablename = v_tablename AND schemaname = current_schema();
+    IF NOT FOUND THEN
+      EXECUTE 'CREATE TABLE '||v_tablename||' ('||v_create_tbl_cols_hist||', records '||trim((t->'record_type')::TEXT, '"')||'[])';
+      EXECUTE 'CREATE INDEX idx_'||v_tablename||' ON '||v_tablename||' ('||v_create_idx_cols_hist||')';
+      PERFORM monitoring.partition_table(v_tablename);
+      RETURN QUERY SELECT v_tablename;
+    END IF;
+
+    -- Aggregate tables creation.
+    FOREACH i_period IN ARRAY v_agg_periods LOOP
+      v_tablename := trim((t->'name')::TEXT, '"')||'_'||i_period||'_current';
+      v_like_tablename := trim((t->'name')::TEXT, '"')||'_current';
+      PERFORM 1 FROM pg_tables WHERE tablename = v_tablename AND schemaname = current_schema();
+      IF NOT FOUND THEN
+        EXECUTE 'CREATE TABLE '||v_tablename||' (LIKE '||v_like_tablename||')';
+        -- Weight: number of record aggregated
+        EXECUTE 'ALTER TABLE '||v_tablename||' ADD COLUMN w INTEGER DEFAULT 1';
+        EXECUTE 'ALTER TABLE '||v_tablename||' ADD UNIQUE ('||v_create_idx_cols_cur||')';
+        PERFORM monitoring.partition_table(v_tablename);
+        RETURN QUERY SELECT v_tablename;
+      END IF;
+    END LOOP;
+  END LOOP;
+END;
+$$;
+
+
+CREATE OR REPLACE FUNCTION monitoring.build_expand_data_query(i_name TEXT, i_range TSTZRANGE) RETURNS TEXT
+LANGUAGE plpgsql
+AS $$
+
+DECLARE
+  t JSON;
+  v_query TEXT;
+  v_table_current TEXT;
+  v_table_history TEXT;
+BEGIN
+  -- Build and execute 'expand' query
+  SELECT metric_tables_config()->i_name INTO t;
+  v_query := t->>'expand';
+  v_table_current := trim((t->'name')::TEXT, '"')||'_current';
+  v_table_history := trim((t->'name')::TEXT, '"')||'_history';
+  v_query := replace(v_query, '#history_table#', v_table_history);
+  v_query := replace(v_query, '#current_table#', v_table_current);
+  v_query := replace(v_query, '#record_type#', trim((t->'record_type')::TEXT, '"'));
+  v_query := replace(v_query, '#where_current#', 'datetime <@ '''||i_range::TEXT||'''::TSTZRANGE'||monitoring.range_pruning('datetime', i_range, '0'));
+  v_query := replace(v_query, '#where_history#', 'history_range && '''||i_range::TEXT||'''::TSTZRANGE'||monitoring.range_pruning('lower(history_range)', i_range, '1 day'));
+  v_query := replace(v_query, '#tstzrange#', ''''||i_range::TEXT||'''::TSTZRANGE');
+  RETURN v_query;
+END;
+
+$$;
+
+
+CREATE OR REPLACE FUNCTION monitoring.expand_data_by_host_id(i_name TEXT, i_range TSTZRANGE, host_id INTEGER) RETURNS SETOF RECORD
+LANGUAGE plpgsql
+AS $$
+
+DECLARE
+  t JSON;
+  v_query TEXT;
+  v_table_current TEXT;
+  v_table_history TEXT;
+BEGIN
+
+  -- Build and execute 'expand' query and filter results by host_id.
+  SELECT metric_tables_config()->i_name INTO t;
+  v_query := t->>'expand';
+  v_table_current := trim((t->'name')::TEXT, '"')||'_current';
+  v_table_history := trim((t->'name')::TEXT, '"')||'_history';
+  v_query := replace(v_query, '#history_table#', v_table_history);
+  v_query := replace(v_query, '#current_table#', v_table_current);
+  v_query := replace(v_query, '#record_type#', trim((t->'record_type')::TEXT, '"'));
+  v_query := replace(v_query, '#where_current#', 'host_id = '||host_id||' AND datetime <@ '''||i_range::TEXT||'''::TSTZRANGE'||monitoring.range_pruning('datetime', i_range, '0'));
+  v_query := replace(v_query, '#where_history#', 'host_id = '||host_id||' AND history_range && '''||i_range::TEXT||'''::TSTZRANGE'||monitoring.range_pruning('lower(history_range)', i_range, '1 day'));
+  v_query := replace(v_query, '#tstzrange#', ''''||i_range::TEXT||'''::TSTZRANGE');
+  RAISE NOTICE '%', v_query;
+  RETURN QUERY EXECUTE v_query;
+END;
+
+$$;
+
+CREATE OR REPLACE FUNCTION monitoring.expand_data_by_instance_id(i_name TEXT, i_range TSTZRANGE, instance_id INTEGER) RETURNS SETOF RECORD
+LANGUAGE plpgsql
+AS $$
+
+DECLARE
+  t JSON;
+  v_query TEXT;
+  v_table_current TEXT;
+  v_table_history TEXT;
+BEGIN
+
+  SELECT metric_tables_config()->i_name INTO t;
+  v_query := t->>'expand';
+  v_table_current := trim((t->'name')::TEXT, '"')||'_current';
+  v_table_history := trim((t->'name')::TEXT, '"')||'_history';
+  v_query := replace(v_query, '#history_table#', v_table_history);
+  v_query := replace(v_query, '#current_table#', v_table_current);
+  v_query := replace(v_query, '#record_type#', trim((t->'record_type')::TEXT, '"'));
+  v_query := replace(v_query, '#where_current#', 'instance_id = '||instance_id||' AND datetime <@ '''||i_range::TEXT||'''::TSTZRANGE'||monitoring.range_pruning('datetime', i_range, '0'));
+  v_query := replace(v_query, '#where_history#', 'instance_id = '||instance_id||' AND history_range && '''||i_range::TEXT||'''::TSTZRANGE'||monitoring.range_pruning('lower(history_range)', i_range, '1 day'));
+  v_query := replace(v_query, '#tstzrange#', ''''||i_range::TEXT||'''::TSTZRANGE');
+  RAISE NOTICE '%', v_query;
+  RETURN QUERY EXECUTE v_query;
+END;
+
+$$;
+
+
+CREATE OR REPLACE FUNCTION monitoring.expand_data_by_dbname(i_name TEXT, i_range TSTZRANGE, instance_id INTEGER, dbname TEXT) RETURNS SETOF RECORD
+LANGUAGE plpgsql
+AS $$
+
+DECLARE
+  t JSON;
+  v_query TEXT;
+  v_table_current TEXT;
+  v_table_history TEXT;
+BEGIN
+
+  SELECT metric_tables_config()->i_name INTO t;
+  v_query := t->>'expand';
+  v_table_current := trim((t->'name')::TEXT, '"')||'_current';
+  v_table_history := trim((t->'name')::TEXT, '"')||'_history';
+  v_query := replace(v_query, '#history_table#', v_table_history);
+  v_query := replace(v_query, '#current_table#', v_table_current);
+  v_query := replace(v_query, '#record_type#', trim((t->'record_type')::TEXT, '"'));
+  v_query := replace(v_query, '#where_current#', 'instance_id = '||instance_id||' AND dbname = '||quote_literal(dbname)||' AND datetime <@ '''||i_range::TEXT||'''::TSTZRANGE'||monitoring.range_pruning('datetime', i_range, '0'));
+  v_query := replace(v_query, '#where_history#', 'instance_id = '||instance_id||' AND dbname = '||quote_literal(dbname)||' AND history_range && '''||i_range::TEXT||'''::TSTZRANGE'||monitoring.range_pruning('lower(history_range)', i_range, '1 day'));
+  v_query := replace(v_query, '#tstzrange#', ''''||i_range::TEXT||'''::TSTZRANGE');
+  RAISE NOTICE '%', v_query;
+  RETURN QUERY EXECUTE v_query;
+END;
+
+$$;
+
+
+DO $$
+DECLARE
+  v_name TEXT;
+  v_suffix TEXT;
+BEGIN
+  FOR v_name IN SELECT json_object_keys(monitoring.metric_tables_config()) LOOP
+    FOREACH v_suffix IN ARRAY array['current', 'history', '30m_current', '6h_current'] LOOP
+      PERFORM monitoring.partition_table(v_name || '_' || v_suffix);
+    END LOOP;
+  END LOOP;
+END;
+$$;
+
+GRANT EXECUTE ON ALL FUNCTIONS IN SCHEMA monitoring TO temboard;
+GRANT ALL ON ALL TABLES IN SCHEMA monitoring TO temboard;
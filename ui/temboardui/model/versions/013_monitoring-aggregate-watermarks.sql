@@ -0,0 +1,168 @@
+-- Incremental aggregation of monitoring metrics.
+--
+-- metric_watermarks tracks for each metric the end of the last aggregated
+-- bucket of each period and the datetime of the last archived row. Each
+-- aggregation run reads only closed buckets since the watermark. When nothing
+-- newer than the watermark was archived, aggregation reads _current table
+-- without expanding _history.
+
+CREATE TABLE monitoring.metric_watermarks (
+  name TEXT NOT NULL,
+  -- 30m, 6h or archive.
+  kind TEXT NOT NULL,
+  datetime TIMESTAMPTZ NOT NULL,
+  PRIMARY KEY (name, kind)
+);
+
+
+CREATE OR REPLACE FUNCTION monitoring.aggregate_bounds(i_name TEXT, i_period TEXT)
+RETURNS TABLE(lower_bound TIMESTAMPTZ, upper_bound TIMESTAMPTZ, current_only BOOLEAN)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_archived TIMESTAMPTZ;
+BEGIN
+  SELECT datetime INTO lower_bound
+  FROM monitoring.metric_watermarks WHERE name = i_name AND kind = i_period;
+  SELECT datetime INTO v_archived
+  FROM monitoring.metric_watermarks WHERE name = i_name AND kind = 'archive';
+  -- Aggregate only closed buckets.
+  upper_bound := monitoring.truncate_time(NOW(), i_period::INTERVAL);
+  -- Rows since watermark are all in _current if no newer row was archived.
+  current_only := lower_bound IS NOT NULL AND v_archived IS NOT NULL AND v_archived < lower_bound;
+  RETURN NEXT;
+END;
+$$;
+
+
+CREATE OR REPLACE FUNCTION monitoring.aggregate_source(i_name TEXT, i_range TSTZRANGE, i_current_only BOOLEAN, i_owner_ids INTEGER[])
+RETURNS SETOF RECORD
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  t JSON;
+  v_filter TEXT := '';
+  v_where_current TEXT;
+  v_query TEXT;
+BEGIN
+  -- Like expand_data(), filtered by owners. Reads only _current table if
+  -- i_current_only is true.
+  t := monitoring.metric_tables_config()->i_name;
+  IF i_owner_ids IS NOT NULL THEN
+    v_filter := quote_ident(t->'columns'->0->>'name')||' = ANY('||quote_literal(i_owner_ids)||'::INTEGER[]) AND ';
+  END IF;
+  v_where_current := v_filter||'datetime <@ '||quote_literal(i_range)||'::TSTZRANGE'||monitoring.range_pruning('datetime', i_range, '0');
+
+  IF i_current_only THEN
+    v_query := 'SELECT * FROM monitoring.'||quote_ident((t->>'name')||'_current')||' WHERE '||v_where_current;
+  ELSE
+    v_query := t->>'expand';
+    v_query := replace(v_query, '#history_table#', (t->>'name')||'_history');
+    v_query := replace(v_query, '#current_table#', (t->>'name')||'_current');
+    v_query := replace(v_query, '#record_type#', t->>'record_type');
+    v_query := replace(v_query, '#where_current#', v_where_current);
+    v_query := replace(v_query, '#where_history#', v_filter||'history_range && '||quote_literal(i_range)||'::TSTZRANGE'||monitoring.range_pruning('lower(history_range)', i_range, '1 day'));
+    v_query := replace(v_query, '#tstzrange#', quote_literal(i_range)||'::TSTZRANGE');
+  END IF;
+  RETURN QUERY EXECUTE v_query;
+END;
+$$;
+
+
+CREATE OR REPLACE FUNCTION monitoring.aggregate_data_chunk(
+  i_name TEXT,
+  i_record_type TEXT,
+  i_query TEXT,
+  i_period TEXT,
+  i_range TSTZRANGE,
+  i_current_only BOOLEAN,
+  i_owner_ids INTEGER[]
+)
+RETURNS TABLE(tblname TEXT, nb_buckets BIGINT, nb_rows BIGINT)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_query TEXT;
+BEGIN
+  -- Run 'aggregate' query of metric for a period, a range of closed buckets
+  -- and a chunk of owners. Returns the number of buckets upserted and the
+  -- number of rows aggregated in these buckets.
+  tblname := i_name||'_'||i_period||'_current';
+  -- Aggregate queries read the whole range since last bucket with a limit.
+  -- Replace source with the incremental one.
+  v_query := replace(
+    i_query,
+    'expand_data_limit(''#name#'', (SELECT tstzrange(MAX(datetime), NOW()) FROM #agg_table#), 100000)',
+    format('monitoring.aggregate_source(%L, %L::TSTZRANGE, %L, %L::INTEGER[])', i_name, i_range, i_current_only, i_owner_ids)
+  );
+  v_query := replace(v_query, '#agg_table#', tblname);
+  v_query := replace(v_query, '#interval#', i_period);
+  v_query := replace(v_query, '#record_type#', i_record_type);
+  v_query := replace(v_query, '#name#', i_name);
+  v_query := 'WITH upserted AS ('||rtrim(v_query, E'; \n')||' RETURNING w) SELECT count(*), COALESCE(sum(w), 0) FROM upserted';
+  EXECUTE v_query INTO nb_buckets, nb_rows;
+  RETURN NEXT;
+END;
+$$;
+
+
+CREATE OR REPLACE FUNCTION monitoring.archive_current_metrics(table_name TEXT, record_type TEXT, query TEXT)
+RETURNS TABLE(tblname TEXT, nb_rows INTEGER)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_table_current TEXT;
+  v_table_history TEXT;
+  v_query TEXT;
+  v_archived TIMESTAMPTZ;
+  i INTEGER;
+BEGIN
+  v_table_current := table_name || '_current';
+  v_table_history := table_name || '_history';
+  -- Lock _current table to prevent concurrent updates
+  EXECUTE 'LOCK TABLE ' || v_table_current || ' IN SHARE MODE';
+  v_query := replace(query, '#history_table#', v_table_history);
+  v_query := replace(v_query, '#current_table#', v_table_current);
+  v_query := replace(v_query, '#record_type#', record_type);
+  -- Include upper bound so that range of a single record is not empty.
+  -- Partition key of _history is the lower bound of the range.
+  v_query := replace(v_query, 'tstzrange(min(datetime), max(datetime))', 'tstzrange(min(datetime), max(datetime), ''[]'')');
+  -- Track last archived row for incremental aggregation.
+  EXECUTE 'SELECT max(datetime) FROM ' || v_table_current INTO v_archived;
+  IF v_archived IS NOT NULL THEN
+    INSERT INTO monitoring.metric_watermarks AS w (name, kind, datetime)
+    VALUES (table_name, 'archive', v_archived)
+    ON CONFLICT (name, kind) DO UPDATE SET datetime = GREATEST(w.datetime, EXCLUDED.datetime);
+  END IF;
+  -- Move data into _history table
+  EXECUTE v_query;
+  GET DIAGNOSTICS i = ROW_COUNT;
+  -- Truncate _current table
+  EXECUTE 'TRUNCATE '||v_table_current;
+  -- Return each history table name and the number of rows inserted
+  RETURN QUERY SELECT v_table_history, i;
+END;
+$$;
+
+
+-- Resume aggregation from last aggregated bucket.
+DO $$
+DECLARE
+  v_name TEXT;
+  v_period TEXT;
+  v_last TIMESTAMPTZ;
+BEGIN
+  FOR v_name IN SELECT json_object_keys(monitoring.metric_tables_config()) LOOP
+    FOREACH v_period IN ARRAY array['30m', '6h'] LOOP
+      EXECUTE format('SELECT max(datetime) FROM monitoring.%I', v_name||'_'||v_period||'_current') INTO v_last;
+      IF v_last IS NOT NULL THEN
+        INSERT INTO monitoring.metric_watermarks (name, kind, datetime)
+        VALUES (v_name, v_period, v_last);
+      END IF;
+    END LOOP;
+  END LOOP;
+END;
+$$;
+
+GRANT EXECUTE ON ALL FUNCTIONS IN SCHEMA monitoring TO temboard;
+GRANT ALL ON ALL TABLES IN SCHEMA monitoring TO temboard;
@@ -0,0 +1,128 @@
+-- Static expand functions for charts.
+--
+-- expand_data_by_*() functions build expand query from metric_tables_config()
+-- templates on each call, then execute it unplanned. create_expand_functions()
+-- generates for each metric an expand_<metric>(range, owner_id) function
+-- with static query and bound parameters. PL/pgSQL caches plan of static
+-- queries. Call create_expand_functions() again when expand templates change.
+--
+-- Also, expand functions don't send query as NOTICE anymore.
+
+CREATE OR REPLACE FUNCTION monitoring.create_expand_functions()
+RETURNS VOID
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  t JSON;
+  v_owner TEXT;
+  v_query TEXT;
+BEGIN
+  FOR t IN SELECT value FROM json_each(monitoring.metric_tables_config()) LOOP
+    v_owner := t->'columns'->0->>'name';
+    v_query := t->>'expand';
+    v_query := replace(v_query, '#history_table#', 'monitoring.'||quote_ident((t->>'name')||'_history'));
+    v_query := replace(v_query, '#current_table#', 'monitoring.'||quote_ident((t->>'name')||'_current'));
+    v_query := replace(v_query, '#record_type#', 'monitoring.'||quote_ident(t->>'record_type'));
+    -- Redundant btree bounds allow runtime partition pruning, like
+    -- range_pruning().
+    v_query := replace(v_query, '#where_current#', format(
+      '%I = i_owner_id AND datetime <@ i_range'
+      ' AND datetime >= COALESCE(lower(i_range), ''-infinity'')'
+      ' AND datetime <= COALESCE(upper(i_range), ''infinity'')',
+      v_owner
+    ));
+    v_query := replace(v_query, '#where_history#', format(
+      '%I = i_owner_id AND history_range && i_range'
+      ' AND lower(history_range) >= COALESCE(lower(i_range), ''-infinity'') - INTERVAL ''1 day'''
+      ' AND lower(history_range) <= COALESCE(upper(i_range), ''infinity'')',
+      v_owner
+    ));
+    v_query := replace(v_query, '#tstzrange#', 'i_range');
+    EXECUTE format($f$
+      CREATE OR REPLACE FUNCTION monitoring.%I(i_range TSTZRANGE, i_owner_id INTEGER)
+      RETURNS SETOF RECORD
+      LANGUAGE plpgsql STABLE
+      AS $body$
+      BEGIN
+        RETURN QUERY %s;
+      END;
+      $body$;
+      $f$,
+      'expand_'||(t->>'name'), v_query
+    );
+  END LOOP;
+END;
+$$;
+
+SELECT monitoring.create_expand_functions();
+
+
+CREATE OR REPLACE FUNCTION monitoring.build_expand_data_query(i_name TEXT, i_range TSTZRANGE, i_filter TEXT) RETURNS TEXT
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  t JSON;
+  v_query TEXT;
+BEGIN
+  -- Build 'expand' query, with i_filter conditions prepended to where clauses.
+  t := monitoring.metric_tables_config()->i_name;
+  v_query := t->>'expand';
+  v_query := replace(v_query, '#history_table#', (t->>'name')||'_history');
+  v_query := replace(v_query, '#current_table#', (t->>'name')||'_current');
+  v_query := replace(v_query, '#record_type#', t->>'record_type');
+  v_query := replace(v_query, '#where_current#', i_filter||'datetime <@ '||quote_literal(i_range)||'::TSTZRANGE'||monitoring.range_pruning('datetime', i_range, '0'));
+  v_query := replace(v_query, '#where_history#', i_filter||'history_range && '||quote_literal(i_range)||'::TSTZRANGE'||monitoring.range_pruning('lower(history_range)', i_range, '1 day'));
+  v_query := replace(v_query, '#tstzrange#', quote_literal(i_range)||'::TSTZRANGE');
+  RETURN v_query;
+END;
+$$;
+
+
+CREATE OR REPLACE FUNCTION monitoring.expand_data(i_name TEXT, i_range TSTZRANGE) RETURNS SETOF RECORD
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  RETURN QUERY EXECUTE monitoring.build_expand_data_query(i_name, i_range, '');
+END;
+$$;
+
+
+CREATE OR REPLACE FUNCTION monitoring.expand_data_limit(i_name TEXT, i_range TSTZRANGE, i_limit INTEGER) RETURNS SETOF RECORD
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  RETURN QUERY EXECUTE monitoring.build_expand_data_query(i_name, i_range, '')||' LIMIT '||i_limit::TEXT;
+END;
+$$;
+
+
+CREATE OR REPLACE FUNCTION monitoring.expand_data_by_host_id(i_name TEXT, i_range TSTZRANGE, host_id INTEGER) RETURNS SETOF RECORD
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  RETURN QUERY EXECUTE monitoring.build_expand_data_query(i_name, i_range, 'host_id = '||host_id||' AND ');
+END;
+$$;
+
+
+CREATE OR REPLACE FUNCTION monitoring.expand_data_by_instance_id(i_name TEXT, i_range TSTZRANGE, instance_id INTEGER) RETURNS SETOF RECORD
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  RETURN QUERY EXECUTE monitoring.build_expand_data_query(i_name, i_range, 'instance_id = '||instance_id||' AND ');
+END;
+$$;
+
+
+CREATE OR REPLACE FUNCTION monitoring.expand_data_by_dbname(i_name TEXT, i_range TSTZRANGE, instance_id INTEGER, dbname TEXT) RETURNS SETOF RECORD
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  RETURN QUERY EXECUTE monitoring.build_expand_data_query(i_name, i_range, 'instance_id = '||instance_id||' AND dbname = '||quote_literal(dbname)||' AND ');
+END;
+$$;
+
+
+DROP FUNCTION monitoring.build_expand_data_query(TEXT, TSTZRANGE);
+
+GRANT EXECUTE ON ALL FUNCTIONS IN SCHEMA monitoring TO temboard;
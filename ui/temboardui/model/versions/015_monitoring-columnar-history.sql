@@ -0,0 +1,310 @@
+-- Columnar history of monitoring metrics.
+--
+-- _history tables store a day of records of an owner as an array of
+-- composite records. Each element carries a tuple header and every read
+-- unnests whole records. <metric>_columnar_history tables store instead an
+-- array per record attribute. Arrays of scalars are smaller and compress
+-- better. history_range summarizes the time block of each row.
+--
+-- Archiving fills columnar history. migrate_history_chunk() moves legacy
+-- _history rows to columnar history by small batches, each in a single
+-- statement, while reads expand both. Migration runs online, in background.
+
+CREATE OR REPLACE FUNCTION monitoring.record_attributes(i_record_type TEXT)
+RETURNS TABLE(attname TEXT, atttype TEXT, attnum SMALLINT)
+LANGUAGE sql STABLE
+AS $$
+  SELECT a.attname::TEXT, format_type(a.atttypid, a.atttypmod), a.attnum
+  FROM pg_catalog.pg_attribute AS a
+  JOIN pg_catalog.pg_type AS t ON t.typrelid = a.attrelid
+  JOIN pg_catalog.pg_namespace AS n ON n.oid = t.typnamespace
+  WHERE n.nspname = 'monitoring' AND t.typname = i_record_type
+    AND a.attnum > 0 AND NOT a.attisdropped;
+$$;
+
+
+CREATE OR REPLACE FUNCTION monitoring.format_columns(t JSON, i_format TEXT) RETURNS TEXT
+LANGUAGE sql STABLE
+AS $$
+  -- Format owner and key columns of metric, comma separated. %1$I is the
+  -- column name, %2$s the column definition.
+  SELECT string_agg(format(i_format, c->>'name', c->>'data_type'), ', ' ORDER BY n)
+  FROM json_array_elements(t->'columns') WITH ORDINALITY AS x(c, n);
+$$;
+
+
+CREATE OR REPLACE FUNCTION monitoring.format_attributes(t JSON, i_format TEXT) RETURNS TEXT
+LANGUAGE sql STABLE
+AS $$
+  -- Format record attributes of metric, comma separated. %1$I is the
+  -- attribute name, %2$s its type.
+  SELECT string_agg(format(i_format, attname, atttype), ', ' ORDER BY attnum)
+  FROM monitoring.record_attributes(t->>'record_type');
+$$;
+
+
+CREATE OR REPLACE FUNCTION monitoring.create_columnar_history(i_name TEXT) RETURNS VOID
+LANGUAGE plpgsql
+-- Column definitions reference tables without schema.
+SET search_path TO monitoring, pg_catalog
+AS $$
+DECLARE
+  t JSON := monitoring.metric_tables_config()->i_name;
+  v_table TEXT := i_name || '_columnar_history';
+BEGIN
+  PERFORM 1 FROM pg_catalog.pg_class AS c
+  JOIN pg_catalog.pg_namespace AS n ON n.oid = c.relnamespace
+  WHERE n.nspname = 'monitoring' AND c.relname = v_table;
+  IF FOUND THEN
+    RETURN;
+  END IF;
+
+  EXECUTE format(
+    'CREATE TABLE monitoring.%I (history_range TSTZRANGE NOT NULL, %s, %s)',
+    v_table,
+    monitoring.format_columns(t, '%1$I %2$s'),
+    monitoring.format_attributes(t, '%1$I %2$s[] NOT NULL')
+  );
+  EXECUTE format(
+    'CREATE INDEX ON monitoring.%I (%I, lower(history_range))',
+    v_table, t->'columns'->0->>'name'
+  );
+  PERFORM monitoring.partition_table(v_table);
+END;
+$$;
+
+
+CREATE OR REPLACE FUNCTION monitoring.columnar_archive_query(i_name TEXT) RETURNS TEXT
+LANGUAGE plpgsql STABLE
+AS $$
+DECLARE
+  t JSON := monitoring.metric_tables_config()->i_name;
+  v_columns TEXT := monitoring.format_columns(t, '%1$I');
+BEGIN
+  -- Archive a day of _current rows of each owner as a columnar history row.
+  -- datetime attribute of records is the datetime of rows.
+  RETURN format(
+    'INSERT INTO monitoring.%I (history_range, %s, %s) '
+    'SELECT tstzrange(min(datetime), max(datetime), ''[]''), %s, %s '
+    'FROM monitoring.%I GROUP BY date_trunc(''day'', datetime), %s',
+    i_name || '_columnar_history', v_columns, monitoring.format_attributes(t, '%1$I'),
+    v_columns,
+    replace(
+      monitoring.format_attributes(t, 'array_agg((record).%1$I ORDER BY datetime)'),
+      'array_agg((record).datetime ORDER BY datetime)',
+      'array_agg(datetime ORDER BY datetime)'
+    ),
+    i_name || '_current', v_columns
+  );
+END;
+$$;
+
+
+CREATE OR REPLACE FUNCTION monitoring.expand_template(t JSON) RETURNS TEXT
+LANGUAGE plpgsql STABLE
+AS $$
+DECLARE
+  v_columnar TEXT;
+BEGIN
+  -- Returns 'expand' query template of metric, expanding columnar history
+  -- too. Records are rebuilt from attribute arrays.
+  v_columnar := format(
+    'SELECT a.datetime, %s, ROW(%s)::monitoring.%I AS record '
+    'FROM monitoring.%I AS h, unnest(%s) AS a(%s) '
+    'WHERE #where_history#',
+    monitoring.format_columns(t, 'h.%1$I'),
+    monitoring.format_attributes(t, 'a.%1$I'),
+    t->>'record_type',
+    (t->>'name') || '_columnar_history',
+    monitoring.format_attributes(t, 'h.%1$I'),
+    monitoring.format_attributes(t, '%1$I')
+  );
+  RETURN replace(
+    t->>'expand',
+    ') SELECT * FROM expand WHERE',
+    ' UNION ' || v_columnar || ') SELECT * FROM expand WHERE'
+  );
+END;
+$$;
+
+
+CREATE OR REPLACE FUNCTION monitoring.migrate_history_chunk(i_name TEXT, i_limit INTEGER) RETURNS INTEGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  t JSON := monitoring.metric_tables_config()->i_name;
+  i INTEGER;
+BEGIN
+  -- Move up to i_limit legacy _history rows to columnar history, in a single
+  -- statement. Readers see each row either in legacy or in columnar history.
+  -- Rows locked by a concurrent migration are skipped.
+  EXECUTE format(
+    'WITH moved AS ('
+    ' DELETE FROM monitoring.%1$I WHERE (tableoid, ctid) IN ('
+    '  SELECT tableoid, ctid FROM monitoring.%1$I LIMIT %2$s FOR UPDATE SKIP LOCKED'
+    ' ) RETURNING *'
+    ') '
+    'INSERT INTO monitoring.%3$I (history_range, %4$s, %5$s) '
+    'SELECT m.history_range, %6$s, agg.* FROM moved AS m '
+    'CROSS JOIN LATERAL (SELECT %7$s FROM unnest(m.records) AS r) AS agg',
+    i_name || '_history', i_limit, i_name || '_columnar_history',
+    monitoring.format_columns(t, '%1$I'),
+    monitoring.format_attributes(t, '%1$I'),
+    monitoring.format_columns(t, 'm.%1$I'),
+    monitoring.format_attributes(t, 'array_agg(r.%1$I ORDER BY r.datetime)')
+  );
+  GET DIAGNOSTICS i = ROW_COUNT;
+  RETURN i;
+END;
+$$;
+
+
+CREATE OR REPLACE FUNCTION monitoring.archive_current_metrics(table_name TEXT, record_type TEXT, query TEXT)
+RETURNS TABLE(tblname TEXT, nb_rows INTEGER)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_table_current TEXT;
+  v_archived TIMESTAMPTZ;
+  i INTEGER;
+BEGIN
+  -- history query is ignored, archive to columnar history.
+  v_table_current := table_name || '_current';
+  -- Lock _current table to prevent concurrent updates
+  EXECUTE 'LOCK TABLE ' || v_table_current || ' IN SHARE MODE';
+  -- Track last archived row for incremental aggregation.
+  EXECUTE 'SELECT max(datetime) FROM ' || v_table_current INTO v_archived;
+  IF v_archived IS NOT NULL THEN
+    INSERT INTO monitoring.metric_watermarks AS w (name, kind, datetime)
+    VALUES (table_name, 'archive', v_archived)
+    ON CONFLICT (name, kind) DO UPDATE SET datetime = GREATEST(w.datetime, EXCLUDED.datetime);
+  END IF;
+  -- Move data into columnar history table
+  EXECUTE monitoring.columnar_archive_query(table_name);
+  GET DIAGNOSTICS i = ROW_COUNT;
+  -- Truncate _current table
+  EXECUTE 'TRUNCATE '||v_table_current;
+  -- Return each history table name and the number of rows inserted
+  RETURN QUERY SELECT table_name || '_columnar_history', i;
+END;
+$$;
+
+
+-- Expand columnar history too.
+
+CREATE OR REPLACE FUNCTION monitoring.build_expand_data_query(i_name TEXT, i_range TSTZRANGE, i_filter TEXT) RETURNS TEXT
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  t JSON;
+  v_query TEXT;
+BEGIN
+  -- Build 'expand' query, with i_filter conditions prepended to where clauses.
+  t := monitoring.metric_tables_config()->i_name;
+  v_query := monitoring.expand_template(t);
+  v_query := replace(v_query, '#history_table#', (t->>'name')||'_history');
+  v_query := replace(v_query, '#current_table#', (t->>'name')||'_current');
+  v_query := replace(v_query, '#record_type#', t->>'record_type');
+  v_query := replace(v_query, '#where_current#', i_filter||'datetime <@ '||quote_literal(i_range)||'::TSTZRANGE'||monitoring.range_pruning('datetime', i_range, '0'));
+  v_query := replace(v_query, '#where_history#', i_filter||'history_range && '||quote_literal(i_range)||'::TSTZRANGE'||monitoring.range_pruning('lower(history_range)', i_range, '1 day'));
+  v_query := replace(v_query, '#tstzrange#', quote_literal(i_range)||'::TSTZRANGE');
+  RETURN v_query;
+END;
+$$;
+
+
+CREATE OR REPLACE FUNCTION monitoring.aggregate_source(i_name TEXT, i_range TSTZRANGE, i_current_only BOOLEAN, i_owner_ids INTEGER[])
+RETURNS SETOF RECORD
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  t JSON;
+  v_filter TEXT := '';
+  v_where_current TEXT;
+  v_query TEXT;
+BEGIN
+  -- Like expand_data(), filtered by owners. Reads only _current table if
+  -- i_current_only is true.
+  t := monitoring.metric_tables_config()->i_name;
+  IF i_owner_ids IS NOT NULL THEN
+    v_filter := quote_ident(t->'columns'->0->>'name')||' = ANY('||quote_literal(i_owner_ids)||'::INTEGER[]) AND ';
+  END IF;
+  v_where_current := v_filter||'datetime <@ '||quote_literal(i_range)||'::TSTZRANGE'||monitoring.range_pruning('datetime', i_range, '0');
+
+  IF i_current_only THEN
+    v_query := 'SELECT * FROM monitoring.'||quote_ident((t->>'name')||'_current')||' WHERE '||v_where_current;
+  ELSE
+    v_query := monitoring.expand_template(t);
+    v_query := replace(v_query, '#history_table#', (t->>'name')||'_history');
+    v_query := replace(v_query, '#current_table#', (t->>'name')||'_current');
+    v_query := replace(v_query, '#record_type#', t->>'record_type');
+    v_query := replace(v_query, '#where_current#', v_where_current);
+    v_query := replace(v_query, '#where_history#', v_filter||'history_range && '||quote_literal(i_range)||'::TSTZRANGE'||monitoring.range_pruning('lower(history_range)', i_range, '1 day'));
+    v_query := replace(v_query, '#tstzrange#', quote_literal(i_range)||'::TSTZRANGE');
+  END IF;
+  RETURN QUERY EXECUTE v_query;
+END;
+$$;
+
+
+CREATE OR REPLACE FUNCTION monitoring.create_expand_functions()
+RETURNS VOID
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  t JSON;
+  v_owner TEXT;
+  v_query TEXT;
+BEGIN
+  FOR t IN SELECT value FROM json_each(monitoring.metric_tables_config()) LOOP
+    v_owner := t->'columns'->0->>'name';
+    v_query := monitoring.expand_template(t);
+    v_query := replace(v_query, '#history_table#', 'monitoring.'||quote_ident((t->>'name')||'_history'));
+    v_query := replace(v_query, '#current_table#', 'monitoring.'||quote_ident((t->>'name')||'_current'));
+    v_query := replace(v_query, '#record_type#', 'monitoring.'||quote_ident(t->>'record_type'));
+    -- Redundant btree bounds allow runtime partition pruning, like
+    -- range_pruning().
+    v_query := replace(v_query, '#where_current#', format(
+      '%I = i_owner_id AND datetime <@ i_range'
+      ' AND datetime >= COALESCE(lower(i_range), ''-infinity'')'
+      ' AND datetime <= COALESCE(upper(i_range), ''infinity'')',
+      v_owner
+    ));
+    v_query := replace(v_query, '#where_history#', format(
+      '%I = i_owner_id AND history_range && i_range'
+      ' AND lower(history_range) >= COALESCE(lower(i_range), ''-infinity'') - INTERVAL ''1 day'''
+      ' AND lower(history_range) <= COALESCE(upper(i_range), ''infinity'')',
+      v_owner
+    ));
+    v_query := replace(v_query, '#tstzrange#', 'i_range');
+    EXECUTE format($f$
+      CREATE OR REPLACE FUNCTION monitoring.%I(i_range TSTZRANGE, i_owner_id INTEGER)
+      RETURNS SETOF RECORD
+      LANGUAGE plpgsql STABLE
+      AS $body$
+      BEGIN
+        RETURN QUERY %s;
+      END;
+      $body$;
+      $f$,
+      'expand_'||(t->>'name'), v_query
+    );
+  END LOOP;
+END;
+$$;
+
+
+DO $$
+DECLARE
+  v_name TEXT;
+BEGIN
+  FOR v_name IN SELECT json_object_keys(monitoring.metric_tables_config()) LOOP
+    PERFORM monitoring.create_columnar_history(v_name);
+  END LOOP;
+END;
+$$;
+
+SELECT monitoring.create_expand_functions();
+
+GRANT EXECUTE ON ALL FUNCTIONS IN SCHEMA monitoring TO temboard;
+GRANT ALL ON ALL TABLES IN SCHEMA monitoring TO temboard;
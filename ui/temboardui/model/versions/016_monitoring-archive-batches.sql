@@ -0,0 +1,46 @@
+-- Archive _current tables by batches, without blocking collectors.
+--
+-- archive_current_metrics() locks _current table in SHARE mode until its
+-- rows are copied to history, then truncates it. Meanwhile, collectors wait
+-- to insert metrics and hit collect_max_duration. archive_current_batch()
+-- moves a batch of rows older than a cutoff to columnar history in a single
+-- DELETE ... RETURNING statement. It only locks the moved rows: collectors
+-- keep inserting while archiving runs. Rows inserted late, before cutoff, are
+-- archived on next run.
+
+CREATE OR REPLACE FUNCTION monitoring.archive_current_batch(i_name TEXT, i_until TIMESTAMPTZ, i_limit INTEGER)
+RETURNS TABLE(nb_rows BIGINT, nb_history_rows BIGINT)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_table_current TEXT := i_name || '_current';
+  v_archived TIMESTAMPTZ;
+BEGIN
+  -- Rows locked by a concurrent archiving are skipped. Insert moved rows
+  -- like a full archiving of _current table.
+  EXECUTE format(
+    'WITH moved AS ('
+    ' DELETE FROM monitoring.%1$I WHERE (tableoid, ctid) IN ('
+    '  SELECT tableoid, ctid FROM monitoring.%1$I WHERE datetime < %2$L'
+    '  LIMIT %3$s FOR UPDATE SKIP LOCKED'
+    ' ) RETURNING *'
+    '), inserted AS (%4$s RETURNING 1) '
+    'SELECT (SELECT count(*) FROM moved), (SELECT count(*) FROM inserted), (SELECT max(datetime) FROM moved)',
+    v_table_current, i_until, i_limit,
+    replace(
+      monitoring.columnar_archive_query(i_name),
+      'FROM monitoring.' || quote_ident(v_table_current), 'FROM moved'
+    )
+  ) INTO nb_rows, nb_history_rows, v_archived;
+
+  -- Track last archived row for incremental aggregation.
+  IF v_archived IS NOT NULL THEN
+    INSERT INTO monitoring.metric_watermarks AS w (name, kind, datetime)
+    VALUES (i_name, 'archive', v_archived)
+    ON CONFLICT (name, kind) DO UPDATE SET datetime = GREATEST(w.datetime, EXCLUDED.datetime);
+  END IF;
+  RETURN NEXT;
+END;
+$$;
+
+GRANT EXECUTE ON ALL FUNCTIONS IN SCHEMA monitoring TO temboard;
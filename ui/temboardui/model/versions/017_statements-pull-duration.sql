@@ -0,0 +1,6 @@
+-- Track duration of last statements pull of each agent, in seconds.
+--
+-- Agents are pulled concurrently. The slowest agent bounds the duration of a
+-- pull cycle.
+
+ALTER TABLE statements.metas ADD COLUMN pull_duration DOUBLE PRECISION;
@@ -0,0 +1,157 @@
+-- Incremental statements snapshots.
+--
+-- With ?since=<seq>, agent returns only statements whose counters moved since
+-- snapshot <seq>, and the keys of statements removed from
+-- pg_stat_statements. statements_last keeps the last known counters of each
+-- statement of an agent. process_statements_snapshot() merges an incremental
+-- snapshot in statements_last and computes per-database counters from it.
+--
+-- statements_history_current stores only statements that moved. Before a
+-- statement moves again after being idle, its counters are stored as of
+-- previous snapshot, so that diffs over a range starting while the
+-- statement was idle are right.
+
+ALTER TABLE statements.metas
+  ADD COLUMN snapshot_seq BIGINT,
+  ADD COLUMN snapshot_ts TIMESTAMPTZ;
+
+CREATE TABLE statements.statements_last (
+  agent_address TEXT NOT NULL,
+  agent_port INTEGER NOT NULL,
+  queryid BIGINT NOT NULL,
+  dbid OID NOT NULL,
+  datname TEXT NOT NULL,
+  userid OID NOT NULL,
+  record statements.statements_history_record NOT NULL,
+  FOREIGN KEY (agent_address, agent_port) REFERENCES application.instances (agent_address, agent_port) ON DELETE CASCADE ON UPDATE CASCADE
+);
+
+CREATE INDEX ON statements.statements_last (agent_address, agent_port, queryid, dbid, userid);
+
+
+CREATE OR REPLACE FUNCTION statements.process_statements_snapshot(
+  _address TEXT, _port INTEGER, _ts TIMESTAMPTZ, _seq BIGINT, _incremental BOOLEAN, _removed JSON
+) RETURNS VOID
+LANGUAGE plpgsql
+SET search_path TO statements, pg_catalog
+AS $$
+DECLARE
+  agg_seq BIGINT;
+  v_previous TIMESTAMPTZ;
+BEGIN
+  IF NOT _incremental THEN
+    -- Full snapshot replaces last known counters.
+    DELETE FROM statements_last WHERE agent_address = _address AND agent_port = _port;
+    INSERT INTO statements_last
+      SELECT _address, _port, queryid, dbid, datname, userid,
+      ROW(
+        ts, calls, total_exec_time, rows, shared_blks_hit, shared_blks_read,
+        shared_blks_dirtied, shared_blks_written, local_blks_hit, local_blks_read,
+        local_blks_dirtied, local_blks_written, temp_blks_read, temp_blks_written,
+        blk_read_time, blk_write_time, total_plan_time, wal_records, wal_fpi, wal_bytes
+      )::statements_history_record
+      FROM statements_src_tmp
+      WHERE agent_address = _address AND agent_port = _port;
+    PERFORM process_statements(_address, _port);
+
+    UPDATE metas SET snapshot_seq = _seq, snapshot_ts = _ts
+    WHERE agent_address = _address AND agent_port = _port;
+    RETURN;
+  END IF;
+
+  INSERT INTO metas (agent_address, agent_port) VALUES (_address, _port)
+  ON CONFLICT DO NOTHING;
+
+  PERFORM prevent_concurrent_snapshot(_address, _port);
+
+  UPDATE metas
+  SET coalesce_seq = coalesce_seq + 1,
+      snapts = now(),
+      error = NULL
+  WHERE agent_address = _address AND agent_port = _port
+  RETURNING coalesce_seq, snapshot_ts INTO agg_seq, v_previous;
+
+  INSERT INTO statements (agent_address, agent_port, queryid, query, dbid, datname, userid, rolname)
+    SELECT _address, _port, queryid, query, dbid, datname, userid, rolname
+    FROM statements_src_tmp
+    WHERE agent_address = _address AND agent_port = _port
+    ON CONFLICT DO NOTHING;
+
+  -- Counters of moved statements idle since before previous snapshot.
+  INSERT INTO statements_history_current
+    SELECT _address, _port, queryid, dbid, userid,
+    jsonb_populate_record(record, jsonb_build_object('ts', v_previous))
+    FROM statements_last
+    WHERE agent_address = _address AND agent_port = _port
+    AND (record).ts < v_previous
+    AND (queryid, dbid, userid) IN (
+      SELECT queryid, dbid, userid
+      FROM statements_src_tmp
+      WHERE agent_address = _address AND agent_port = _port
+    );
+
+  INSERT INTO statements_history_current
+    SELECT _address, _port, queryid, dbid, userid,
+    ROW(
+      ts, calls, total_exec_time, rows, shared_blks_hit, shared_blks_read,
+      shared_blks_dirtied, shared_blks_written, local_blks_hit, local_blks_read,
+      local_blks_dirtied, local_blks_written, temp_blks_read, temp_blks_written,
+      blk_read_time, blk_write_time, total_plan_time, wal_records, wal_fpi, wal_bytes
+    )::statements_history_record
+    FROM statements_src_tmp
+    WHERE agent_address = _address AND agent_port = _port;
+
+  -- Merge snapshot in last known counters.
+  DELETE FROM statements_last
+  WHERE agent_address = _address AND agent_port = _port
+  AND (
+    (queryid, dbid, userid) IN (
+      SELECT queryid, dbid, userid
+      FROM statements_src_tmp
+      WHERE agent_address = _address AND agent_port = _port
+    )
+    OR (queryid, dbid, userid) IN (
+      SELECT (r->>0)::BIGINT, (r->>1)::OID, (r->>2)::OID
+      FROM json_array_elements(_removed) AS r
+    )
+  );
+
+  INSERT INTO statements_last
+    SELECT _address, _port, queryid, dbid, datname, userid,
+    ROW(
+      ts, calls, total_exec_time, rows, shared_blks_hit, shared_blks_read,
+      shared_blks_dirtied, shared_blks_written, local_blks_hit, local_blks_read,
+      local_blks_dirtied, local_blks_written, temp_blks_read, temp_blks_written,
+      blk_read_time, blk_write_time, total_plan_time, wal_records, wal_fpi, wal_bytes
+    )::statements_history_record
+    FROM statements_src_tmp
+    WHERE agent_address = _address AND agent_port = _port;
+
+  -- Per-database counters of all statements, moved or not.
+  INSERT INTO statements_history_current_db
+    SELECT _address, _port, dbid, datname,
+    ROW(
+      _ts, sum((record).calls), sum((record).total_exec_time), sum((record).rows),
+      sum((record).shared_blks_hit), sum((record).shared_blks_read),
+      sum((record).shared_blks_dirtied), sum((record).shared_blks_written),
+      sum((record).local_blks_hit), sum((record).local_blks_read),
+      sum((record).local_blks_dirtied), sum((record).local_blks_written),
+      sum((record).temp_blks_read), sum((record).temp_blks_written),
+      sum((record).blk_read_time), sum((record).blk_write_time),
+      sum((record).total_plan_time), sum((record).wal_records), sum((record).wal_fpi),
+      sum((record).wal_bytes)
+    )::statements_history_record
+    FROM statements_last
+    WHERE agent_address = _address AND agent_port = _port
+    GROUP BY dbid, datname;
+
+  IF agg_seq % 100 = 0 THEN
+    PERFORM statements_aggregate(_address, _port);
+  END IF;
+
+  DELETE FROM statements_src_tmp WHERE agent_address = _address AND agent_port = _port;
+
+  UPDATE metas SET snapshot_seq = _seq, snapshot_ts = _ts
+  WHERE agent_address = _address AND agent_port = _port;
+END;
+$$;
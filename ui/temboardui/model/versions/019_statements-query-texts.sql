@@ -0,0 +1,5 @@
+-- Agent sends query text of a statement once, until UI acknowledges the
+-- snapshot. UI fills missing texts of statements_src_tmp before processing
+-- snapshot.
+
+ALTER TABLE statements.statements_src_tmp ALTER COLUMN query DROP NOT NULL;
@@ -0,0 +1,390 @@
+-- Hourly and daily rollups of statements deltas.
+--
+-- Diffing statements over a range unnests every history record overlapping
+-- the range. statements_aggregate() now rolls up deltas of each statement
+-- by hour and day buckets in statements_rollups before coalescing history.
+-- metas.rollupts is the datetime of last point rolled up. metas.rollup_since
+-- is the first complete hour rolled up, history before upgrade is not rolled
+-- up.
+-- statements_rollup_last keeps counters of last point rolled up of each
+-- statement, to compute delta of next point.
+--
+-- statements_deltas() sums complete buckets overlapping a range and diffs
+-- raw points only at range edges, and after last rollup.
+
+ALTER TABLE statements.metas
+  ADD COLUMN rollupts TIMESTAMPTZ,
+  ADD COLUMN rollup_since TIMESTAMPTZ;
+
+CREATE TABLE statements.statements_rollups (
+  agent_address TEXT NOT NULL,
+  agent_port INTEGER NOT NULL,
+  period TEXT NOT NULL CHECK (period IN ('hour', 'day')),
+  bucket TIMESTAMPTZ NOT NULL,
+  queryid BIGINT NOT NULL,
+  dbid OID NOT NULL,
+  userid OID NOT NULL,
+  calls BIGINT NOT NULL,
+  total_exec_time DOUBLE PRECISION NOT NULL,
+  rows BIGINT NOT NULL,
+  shared_blks_hit BIGINT NOT NULL,
+  shared_blks_read BIGINT NOT NULL,
+  shared_blks_dirtied BIGINT NOT NULL,
+  shared_blks_written BIGINT NOT NULL,
+  local_blks_hit BIGINT NOT NULL,
+  local_blks_read BIGINT NOT NULL,
+  local_blks_dirtied BIGINT NOT NULL,
+  local_blks_written BIGINT NOT NULL,
+  temp_blks_read BIGINT NOT NULL,
+  temp_blks_written BIGINT NOT NULL,
+  blk_read_time DOUBLE PRECISION NOT NULL,
+  blk_write_time DOUBLE PRECISION NOT NULL,
+  PRIMARY KEY (agent_address, agent_port, period, bucket, queryid, dbid, userid),
+  FOREIGN KEY (agent_address, agent_port, queryid, dbid, userid) REFERENCES statements.statements
+    ON DELETE CASCADE ON UPDATE CASCADE
+);
+
+-- For charts of a single statement.
+CREATE INDEX ON statements.statements_rollups (agent_address, agent_port, queryid, dbid, userid, period, bucket);
+
+CREATE TABLE statements.statements_rollup_last (
+  agent_address TEXT NOT NULL,
+  agent_port INTEGER NOT NULL,
+  queryid BIGINT NOT NULL,
+  dbid OID NOT NULL,
+  userid OID NOT NULL,
+  record statements.statements_history_record NOT NULL,
+  PRIMARY KEY (agent_address, agent_port, queryid, dbid, userid),
+  FOREIGN KEY (agent_address, agent_port, queryid, dbid, userid) REFERENCES statements.statements
+    ON DELETE CASCADE ON UPDATE CASCADE
+);
+
+
+CREATE OR REPLACE FUNCTION statements.statements_rollup(_address TEXT, _port INTEGER)
+RETURNS VOID
+LANGUAGE plpgsql
+SET search_path TO statements, pg_catalog
+AS $$
+BEGIN
+  -- Points of statements since last rollup. Rows of the same statement and
+  -- snapshot are summed, like toplevel and nested rows since PostgreSQL 14.
+  WITH points AS (
+    SELECT queryid, dbid, userid, (record).ts,
+      sum((record).calls) AS calls,
+      sum((record).total_exec_time) AS total_exec_time,
+      sum((record).rows) AS rows,
+      sum((record).shared_blks_hit) AS shared_blks_hit,
+      sum((record).shared_blks_read) AS shared_blks_read,
+      sum((record).shared_blks_dirtied) AS shared_blks_dirtied,
+      sum((record).shared_blks_written) AS shared_blks_written,
+      sum((record).local_blks_hit) AS local_blks_hit,
+      sum((record).local_blks_read) AS local_blks_read,
+      sum((record).local_blks_dirtied) AS local_blks_dirtied,
+      sum((record).local_blks_written) AS local_blks_written,
+      sum((record).temp_blks_read) AS temp_blks_read,
+      sum((record).temp_blks_written) AS temp_blks_written,
+      sum((record).blk_read_time) AS blk_read_time,
+      sum((record).blk_write_time) AS blk_write_time
+    FROM statements_history_current
+    WHERE agent_address = _address AND agent_port = _port
+    GROUP BY queryid, dbid, userid, (record).ts
+  ),
+
+  deltas AS (
+    SELECT queryid, dbid, userid, ts,
+      calls - lag(calls) OVER w AS calls,
+      total_exec_time - lag(total_exec_time) OVER w AS total_exec_time,
+      rows - lag(rows) OVER w AS rows,
+      shared_blks_hit - lag(shared_blks_hit) OVER w AS shared_blks_hit,
+      shared_blks_read - lag(shared_blks_read) OVER w AS shared_blks_read,
+      shared_blks_dirtied - lag(shared_blks_dirtied) OVER w AS shared_blks_dirtied,
+      shared_blks_written - lag(shared_blks_written) OVER w AS shared_blks_written,
+      local_blks_hit - lag(local_blks_hit) OVER w AS local_blks_hit,
+      local_blks_read - lag(local_blks_read) OVER w AS local_blks_read,
+      local_blks_dirtied - lag(local_blks_dirtied) OVER w AS local_blks_dirtied,
+      local_blks_written - lag(local_blks_written) OVER w AS local_blks_written,
+      temp_blks_read - lag(temp_blks_read) OVER w AS temp_blks_read,
+      temp_blks_written - lag(temp_blks_written) OVER w AS temp_blks_written,
+      blk_read_time - lag(blk_read_time) OVER w AS blk_read_time,
+      blk_write_time - lag(blk_write_time) OVER w AS blk_write_time
+    FROM (
+      SELECT * FROM points
+      UNION ALL
+      SELECT queryid, dbid, userid, (record).ts,
+        (record).calls, (record).total_exec_time, (record).rows,
+        (record).shared_blks_hit, (record).shared_blks_read,
+        (record).shared_blks_dirtied, (record).shared_blks_written,
+        (record).local_blks_hit, (record).local_blks_read,
+        (record).local_blks_dirtied, (record).local_blks_written,
+        (record).temp_blks_read, (record).temp_blks_written,
+        (record).blk_read_time, (record).blk_write_time
+      FROM statements_rollup_last
+      WHERE agent_address = _address AND agent_port = _port
+    ) AS p
+    WINDOW w AS (PARTITION BY queryid, dbid, userid ORDER BY ts)
+  ),
+
+  rollups AS (
+    INSERT INTO statements_rollups AS r
+      SELECT _address, _port, p.period, date_trunc(p.period, ts), queryid, dbid, userid,
+        sum(calls), sum(total_exec_time), sum(rows),
+        sum(shared_blks_hit), sum(shared_blks_read), sum(shared_blks_dirtied), sum(shared_blks_written),
+        sum(local_blks_hit), sum(local_blks_read), sum(local_blks_dirtied), sum(local_blks_written),
+        sum(temp_blks_read), sum(temp_blks_written), sum(blk_read_time), sum(blk_write_time)
+      FROM deltas
+      CROSS JOIN (VALUES ('hour'), ('day')) AS p(period)
+      -- Skip first point of statements and counters reset.
+      WHERE calls > 0
+      GROUP BY p.period, date_trunc(p.period, ts), queryid, dbid, userid
+    ON CONFLICT (agent_address, agent_port, period, bucket, queryid, dbid, userid) DO UPDATE
+    SET calls = r.calls + EXCLUDED.calls,
+        total_exec_time = r.total_exec_time + EXCLUDED.total_exec_time,
+        rows = r.rows + EXCLUDED.rows,
+        shared_blks_hit = r.shared_blks_hit + EXCLUDED.shared_blks_hit,
+        shared_blks_read = r.shared_blks_read + EXCLUDED.shared_blks_read,
+        shared_blks_dirtied = r.shared_blks_dirtied + EXCLUDED.shared_blks_dirtied,
+        shared_blks_written = r.shared_blks_written + EXCLUDED.shared_blks_written,
+        local_blks_hit = r.local_blks_hit + EXCLUDED.local_blks_hit,
+        local_blks_read = r.local_blks_read + EXCLUDED.local_blks_read,
+        local_blks_dirtied = r.local_blks_dirtied + EXCLUDED.local_blks_dirtied,
+        local_blks_written = r.local_blks_written + EXCLUDED.local_blks_written,
+        temp_blks_read = r.temp_blks_read + EXCLUDED.temp_blks_read,
+        temp_blks_written = r.temp_blks_written + EXCLUDED.temp_blks_written,
+        blk_read_time = r.blk_read_time + EXCLUDED.blk_read_time,
+        blk_write_time = r.blk_write_time + EXCLUDED.blk_write_time
+  )
+
+  INSERT INTO statements_rollup_last AS l
+    SELECT DISTINCT ON (queryid, dbid, userid) _address, _port, queryid, dbid, userid,
+      ROW(
+        ts, calls, total_exec_time, rows, shared_blks_hit, shared_blks_read,
+        shared_blks_dirtied, shared_blks_written, local_blks_hit, local_blks_read,
+        local_blks_dirtied, local_blks_written, temp_blks_read, temp_blks_written,
+        blk_read_time, blk_write_time, NULL, NULL, NULL, NULL
+      )::statements_history_record
+    FROM points
+    ORDER BY queryid, dbid, userid, ts DESC
+  ON CONFLICT (agent_address, agent_port, queryid, dbid, userid) DO UPDATE
+  SET record = EXCLUDED.record;
+
+  -- First point of first rollup has no delta, its hour is incomplete.
+  UPDATE metas
+  SET rollupts = greatest(metas.rollupts, p.until),
+      rollup_since = coalesce(metas.rollup_since, date_trunc('hour', p.since) + interval '1 hour')
+  FROM (
+    SELECT min((record).ts) AS since, max((record).ts) AS until
+    FROM statements_history_current
+    WHERE agent_address = _address AND agent_port = _port
+  ) AS p
+  WHERE agent_address = _address AND agent_port = _port;
+END;
+$$;
+
+
+-- Roll up statements before coalescing history.
+ALTER FUNCTION statements.statements_aggregate(TEXT, INTEGER) RENAME TO statements_aggregate_history;
+
+CREATE OR REPLACE FUNCTION statements.statements_aggregate(_address TEXT, _port INTEGER)
+RETURNS VOID
+LANGUAGE plpgsql
+SET search_path TO statements, pg_catalog
+AS $$
+BEGIN
+  PERFORM statements_rollup(_address, _port);
+  PERFORM statements_aggregate_history(_address, _port);
+END;
+$$;
+
+
+CREATE OR REPLACE FUNCTION statements.statements_raw_deltas(
+  _address TEXT, _port INTEGER, _range TSTZRANGE, _dbid OID, _queryid BIGINT, _userid OID
+) RETURNS TABLE(
+  queryid BIGINT, dbid OID, userid OID,
+  calls BIGINT, total_exec_time DOUBLE PRECISION, rows BIGINT,
+  shared_blks_hit BIGINT, shared_blks_read BIGINT, shared_blks_dirtied BIGINT, shared_blks_written BIGINT,
+  local_blks_hit BIGINT, local_blks_read BIGINT, local_blks_dirtied BIGINT, local_blks_written BIGINT,
+  temp_blks_read BIGINT, temp_blks_written BIGINT,
+  blk_read_time DOUBLE PRECISION, blk_write_time DOUBLE PRECISION
+)
+LANGUAGE sql STABLE
+SET search_path TO statements, pg_catalog
+AS $$
+  -- Deltas of statements from raw points in _range. Delta of first point in
+  -- range is computed from last point in the hour before range, if any.
+  WITH points AS (
+    SELECT queryid, dbid, userid, (r).ts, (r).ts <@ _range AS inside,
+      sum((r).calls) AS calls,
+      sum((r).total_exec_time) AS total_exec_time,
+      sum((r).rows) AS rows,
+      sum((r).shared_blks_hit) AS shared_blks_hit,
+      sum((r).shared_blks_read) AS shared_blks_read,
+      sum((r).shared_blks_dirtied) AS shared_blks_dirtied,
+      sum((r).shared_blks_written) AS shared_blks_written,
+      sum((r).local_blks_hit) AS local_blks_hit,
+      sum((r).local_blks_read) AS local_blks_read,
+      sum((r).local_blks_dirtied) AS local_blks_dirtied,
+      sum((r).local_blks_written) AS local_blks_written,
+      sum((r).temp_blks_read) AS temp_blks_read,
+      sum((r).temp_blks_written) AS temp_blks_written,
+      sum((r).blk_read_time) AS blk_read_time,
+      sum((r).blk_write_time) AS blk_write_time
+    FROM (
+      SELECT queryid, dbid, userid, unnest(records) AS r
+      FROM statements_history
+      WHERE agent_address = _address AND agent_port = _port
+      AND coalesce_range && tstzrange(lower(_range) - interval '1 hour', upper(_range), '[]')
+      AND (_dbid IS NULL OR dbid = _dbid)
+      AND (_queryid IS NULL OR queryid = _queryid)
+      AND (_userid IS NULL OR userid = _userid)
+      UNION ALL
+      SELECT queryid, dbid, userid, record
+      FROM statements_history_current
+      WHERE agent_address = _address AND agent_port = _port
+      AND (_dbid IS NULL OR dbid = _dbid)
+      AND (_queryid IS NULL OR queryid = _queryid)
+      AND (_userid IS NULL OR userid = _userid)
+    ) AS s
+    WHERE (r).ts >= lower(_range) - interval '1 hour'
+    AND ((r).ts <@ _range OR (r).ts < lower(_range))
+    GROUP BY queryid, dbid, userid, (r).ts
+  ),
+
+  last AS (
+    SELECT DISTINCT ON (queryid, dbid, userid) *
+    FROM points
+    WHERE inside
+    ORDER BY queryid, dbid, userid, ts DESC
+  ),
+
+  -- Last point before range, else first point in range.
+  base AS (
+    SELECT DISTINCT ON (queryid, dbid, userid) *
+    FROM points
+    ORDER BY queryid, dbid, userid, inside,
+      CASE WHEN inside THEN ts END ASC, ts DESC
+  )
+
+  SELECT l.queryid, l.dbid, l.userid,
+    (l.calls - b.calls)::BIGINT,
+    l.total_exec_time - b.total_exec_time,
+    (l.rows - b.rows)::BIGINT,
+    (l.shared_blks_hit - b.shared_blks_hit)::BIGINT,
+    (l.shared_blks_read - b.shared_blks_read)::BIGINT,
+    (l.shared_blks_dirtied - b.shared_blks_dirtied)::BIGINT,
+    (l.shared_blks_written - b.shared_blks_written)::BIGINT,
+    (l.local_blks_hit - b.local_blks_hit)::BIGINT,
+    (l.local_blks_read - b.local_blks_read)::BIGINT,
+    (l.local_blks_dirtied - b.local_blks_dirtied)::BIGINT,
+    (l.local_blks_written - b.local_blks_written)::BIGINT,
+    (l.temp_blks_read - b.temp_blks_read)::BIGINT,
+    (l.temp_blks_written - b.temp_blks_written)::BIGINT,
+    l.blk_read_time - b.blk_read_time,
+    l.blk_write_time - b.blk_write_time
+  FROM last AS l
+  JOIN base AS b USING (queryid, dbid, userid);
+$$;
+
+
+CREATE OR REPLACE FUNCTION statements.statements_deltas(
+  _address TEXT, _port INTEGER, _start TIMESTAMPTZ, _end TIMESTAMPTZ,
+  _dbid OID DEFAULT NULL, _queryid BIGINT DEFAULT NULL, _userid OID DEFAULT NULL
+) RETURNS TABLE(
+  queryid BIGINT, dbid OID, userid OID,
+  calls BIGINT, total_exec_time DOUBLE PRECISION, rows BIGINT,
+  shared_blks_hit BIGINT, shared_blks_read BIGINT, shared_blks_dirtied BIGINT, shared_blks_written BIGINT,
+  local_blks_hit BIGINT, local_blks_read BIGINT, local_blks_dirtied BIGINT, local_blks_written BIGINT,
+  temp_blks_read BIGINT, temp_blks_written BIGINT,
+  blk_read_time DOUBLE PRECISION, blk_write_time DOUBLE PRECISION
+)
+LANGUAGE sql STABLE
+SET search_path TO statements, pg_catalog
+AS $$
+  -- Deltas of statements between _start and _end. Complete rolled up
+  -- buckets are summed: days, then hours at both ends of days. Points
+  -- between _start and first bucket, and between last bucket and _end, are
+  -- diffed.
+  WITH hours AS (
+    SELECT s, e, r0, greatest(r0, date_trunc('hour', least(e, w))) AS r1
+    FROM (
+      SELECT s, e, w, greatest(
+          date_trunc('hour', s)
+          + CASE WHEN date_trunc('hour', s) < s THEN interval '1 hour' ELSE interval '0' END,
+          since
+        ) AS r0
+      FROM (
+        SELECT coalesce(_start, '-infinity') AS s, coalesce(_end, now()) AS e,
+          coalesce(m.rollupts, '-infinity') AS w,
+          coalesce(m.rollup_since, '-infinity') AS since
+        FROM (SELECT 1) AS one
+        LEFT OUTER JOIN metas AS m
+          ON m.agent_address = _address AND m.agent_port = _port
+      ) AS x
+    ) AS x
+  ),
+
+  bounds AS (
+    SELECT r0, r1,
+      CASE WHEN d0 < d1 THEN d0 ELSE r1 END AS d0,
+      CASE WHEN d0 < d1 THEN d1 ELSE r1 END AS d1,
+      CASE WHEN e < r0 THEN tstzrange(s, e, '[]') ELSE tstzrange(s, r0, '[)') END AS head,
+      CASE WHEN r1 <= e THEN tstzrange(r1, e, '[]') ELSE 'empty' END AS tail
+    FROM (
+      SELECT *,
+        date_trunc('day', r0)
+        + CASE WHEN date_trunc('day', r0) < r0 THEN interval '1 day' ELSE interval '0' END AS d0,
+        date_trunc('day', r1) AS d1
+      FROM hours
+    ) AS x
+  ),
+
+  parts AS (
+    SELECT d.* FROM bounds, statements_raw_deltas(_address, _port, head, _dbid, _queryid, _userid) AS d
+    UNION ALL
+    SELECT d.* FROM bounds, statements_raw_deltas(_address, _port, tail, _dbid, _queryid, _userid) AS d
+    UNION ALL
+    SELECT r.queryid, r.dbid, r.userid,
+      r.calls, r.total_exec_time, r.rows,
+      r.shared_blks_hit, r.shared_blks_read, r.shared_blks_dirtied, r.shared_blks_written,
+      r.local_blks_hit, r.local_blks_read, r.local_blks_dirtied, r.local_blks_written,
+      r.temp_blks_read, r.temp_blks_written, r.blk_read_time, r.blk_write_time
+    FROM statements_rollups AS r, bounds AS b
+    WHERE r.agent_address = _address AND r.agent_port = _port
+    AND (
+      (r.period = 'day' AND r.bucket >= b.d0 AND r.bucket < b.d1)
+      OR (r.period = 'hour' AND r.bucket >= b.r0 AND r.bucket < b.d0)
+      OR (r.period = 'hour' AND r.bucket >= b.d1 AND r.bucket < b.r1)
+    )
+    AND (_dbid IS NULL OR r.dbid = _dbid)
+    AND (_queryid IS NULL OR r.queryid = _queryid)
+    AND (_userid IS NULL OR r.userid = _userid)
+  )
+
+  SELECT queryid, dbid, userid,
+    sum(calls)::BIGINT, sum(total_exec_time), sum(rows)::BIGINT,
+    sum(shared_blks_hit)::BIGINT, sum(shared_blks_read)::BIGINT,
+    sum(shared_blks_dirtied)::BIGINT, sum(shared_blks_written)::BIGINT,
+    sum(local_blks_hit)::BIGINT, sum(local_blks_read)::BIGINT,
+    sum(local_blks_dirtied)::BIGINT, sum(local_blks_written)::BIGINT,
+    sum(temp_blks_read)::BIGINT, sum(temp_blks_written)::BIGINT,
+    sum(blk_read_time), sum(blk_write_time)
+  FROM parts
+  GROUP BY queryid, dbid, userid;
+$$;
+
+
+CREATE OR REPLACE FUNCTION statements.statements_purge(_ndays integer)
+RETURNS void AS $PROC$
+DECLARE
+    v_retention   interval := (_ndays || ' days')::interval;
+BEGIN
+    -- Delete obsolete datas.
+    DELETE FROM statements.statements_history
+    WHERE upper(coalesce_range)< (now() - v_retention);
+
+    DELETE FROM statements.statements_history_db
+    WHERE upper(coalesce_range)< (now() - v_retention);
+
+    DELETE FROM statements.statements_rollups
+    WHERE bucket < (now() - v_retention);
+END;
+$PROC$ LANGUAGE plpgsql; /* end of statements_purge */
@@ -0,0 +1,60 @@
+-- Re-aggregate buckets backfilled after aggregation.
+--
+-- After an agent or UI outage, collector inserts agent history in buckets
+-- already aggregated. Collector marks the oldest datetime inserted before the
+-- watermark of each period with backfill_30m and backfill_6h watermarks.
+-- aggregate_bounds() claims the mark and aggregates again from its bucket.
+-- Aggregation upserts whole buckets.
+
+CREATE OR REPLACE FUNCTION monitoring.mark_backfill(i_datetimes JSON)
+RETURNS VOID
+LANGUAGE sql
+AS $$
+  -- i_datetimes maps metric names to datetimes of inserted rows. Rows are
+  -- usually newer than watermarks: no row is locked.
+  INSERT INTO monitoring.metric_watermarks AS w (name, kind, datetime)
+  SELECT i.name, 'backfill_'||m.kind, i.datetime
+  FROM (
+    SELECT e.key AS name, min(d.value::TIMESTAMPTZ) AS datetime
+    FROM json_each(i_datetimes) AS e
+    CROSS JOIN json_array_elements_text(e.value) AS d(value)
+    GROUP BY e.key
+  ) AS i
+  JOIN monitoring.metric_watermarks AS m
+    ON m.name = i.name AND m.kind IN ('30m', '6h') AND i.datetime < m.datetime
+  ON CONFLICT (name, kind) DO UPDATE
+  SET datetime = LEAST(w.datetime, EXCLUDED.datetime)
+  WHERE EXCLUDED.datetime < w.datetime;
+$$;
+
+
+CREATE OR REPLACE FUNCTION monitoring.aggregate_bounds(i_name TEXT, i_period TEXT)
+RETURNS TABLE(lower_bound TIMESTAMPTZ, upper_bound TIMESTAMPTZ, current_only BOOLEAN)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_archived TIMESTAMPTZ;
+  v_backfill TIMESTAMPTZ;
+BEGIN
+  SELECT datetime INTO lower_bound
+  FROM monitoring.metric_watermarks WHERE name = i_name AND kind = i_period;
+  SELECT datetime INTO v_archived
+  FROM monitoring.metric_watermarks WHERE name = i_name AND kind = 'archive';
+  -- Claim backfill mark. A backfill committed later is marked again for next
+  -- run. Caller must mark lower_bound again if aggregation fails.
+  DELETE FROM monitoring.metric_watermarks
+  WHERE name = i_name AND kind = 'backfill_'||i_period
+  RETURNING datetime INTO v_backfill;
+  IF v_backfill IS NOT NULL AND lower_bound IS NOT NULL THEN
+    lower_bound := LEAST(lower_bound, monitoring.truncate_time(v_backfill, i_period::INTERVAL));
+  END IF;
+  -- Aggregate only closed buckets.
+  upper_bound := monitoring.truncate_time(NOW(), i_period::INTERVAL);
+  -- Rows since watermark are all in _current if no newer row was archived.
+  -- Backfilled rows may be archived already.
+  current_only := lower_bound IS NOT NULL AND v_archived IS NOT NULL AND v_archived < lower_bound AND v_backfill IS NULL;
+  RETURN NEXT;
+END;
+$$;
+
+GRANT EXECUTE ON ALL FUNCTIONS IN SCHEMA monitoring TO temboard;
@@ -0,0 +1,97 @@
+-- Default partitions of monitoring metric tables.
+--
+-- Partitioning metric tables did not create partitions beyond the legacy one.
+-- Collector inserts failed until partitions_worker created them. Each
+-- partitioned table now has a DEFAULT partition catching rows without a
+-- partition. create_partitions() moves these rows to new partitions.
+--
+-- Purge deletes expired rows of legacy and default partitions, like
+-- unpartitioned tables.
+
+CREATE OR REPLACE FUNCTION monitoring.create_default_partition(i_tablename TEXT) RETURNS VOID
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  PERFORM 1 FROM pg_catalog.pg_inherits AS i
+  JOIN pg_catalog.pg_class AS c ON c.oid = i.inhrelid
+  WHERE i.inhparent = format('monitoring.%I', i_tablename)::REGCLASS
+    AND pg_get_expr(c.relpartbound, c.oid) = 'DEFAULT';
+  IF FOUND THEN
+    RETURN;
+  END IF;
+
+  EXECUTE format(
+    'CREATE TABLE monitoring.%I PARTITION OF monitoring.%I DEFAULT',
+    i_tablename || '_default', i_tablename
+  );
+END;
+$$;
+
+
+CREATE OR REPLACE FUNCTION monitoring.create_partitions(i_tablename TEXT, i_until TIMESTAMPTZ)
+RETURNS SETOF TEXT
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_unit TEXT := monitoring.partition_unit(i_tablename);
+  v_key TEXT := monitoring.partition_key(i_tablename);
+  v_default TEXT := i_tablename || '_default';
+  v_start TIMESTAMPTZ;
+  v_end TIMESTAMPTZ;
+  v_partition TEXT;
+BEGIN
+  PERFORM monitoring.create_default_partition(i_tablename);
+
+  -- Create partitions following the last one, until i_until. Default
+  -- partition has no upper bound.
+  SELECT max(monitoring.partition_upper_bound(inhrelid)) INTO v_start
+  FROM pg_catalog.pg_inherits
+  WHERE inhparent = format('monitoring.%I', i_tablename)::REGCLASS;
+  v_start := COALESCE(v_start, date_trunc(v_unit, NOW()));
+
+  WHILE v_start < i_until LOOP
+    v_end := v_start + ('1 ' || v_unit)::INTERVAL;
+    v_partition := i_tablename || '_p' || to_char(v_start, 'YYYYMMDD');
+    -- Block collector inserts in default partition while moving its rows.
+    EXECUTE format('LOCK TABLE monitoring.%I IN SHARE ROW EXCLUSIVE MODE', v_default);
+    EXECUTE format(
+      'CREATE TABLE monitoring.%I (LIKE monitoring.%I INCLUDING DEFAULTS)',
+      v_partition, i_tablename
+    );
+    EXECUTE format(
+      'WITH moved AS (DELETE FROM monitoring.%I WHERE %s >= %L AND %s < %L RETURNING *) '
+      'INSERT INTO monitoring.%I SELECT * FROM moved',
+      v_default, v_key, v_start, v_key, v_end, v_partition
+    );
+    -- Attaching creates indexes and constraints of partitioned table.
+    EXECUTE format(
+      'ALTER TABLE monitoring.%I ATTACH PARTITION monitoring.%I FOR VALUES FROM (%L) TO (%L)',
+      i_tablename, v_partition, v_start, v_end
+    );
+    RETURN NEXT v_partition;
+    v_start := v_end;
+  END LOOP;
+END;
+$$;
+
+
+DO $$
+DECLARE
+  v_name TEXT;
+BEGIN
+  -- Create partitions ahead like partitions_worker, before collectors insert
+  -- rows.
+  FOR v_name IN
+    SELECT c.relname FROM pg_catalog.pg_class AS c
+    JOIN pg_catalog.pg_namespace AS n ON n.oid = c.relnamespace
+    WHERE n.nspname = 'monitoring' AND c.relkind = 'p'
+  LOOP
+    PERFORM monitoring.create_partitions(
+      v_name, NOW() + 3 * ('1 ' || monitoring.partition_unit(v_name))::INTERVAL
+    );
+  END LOOP;
+END;
+$$;
+
+GRANT EXECUTE ON ALL FUNCTIONS IN SCHEMA monitoring TO temboard;
+GRANT ALL ON ALL TABLES IN SCHEMA monitoring TO temboard;
@@ -0,0 +1,87 @@
+-- Read only charted attributes of columnar history.
+--
+-- Static expand_<metric>(i_range, i_owner_id, i_attributes) functions read
+-- only attribute arrays listed in i_attributes, other attributes of records
+-- are NULL. NULL i_attributes reads all attributes. Aggregation still reads
+-- whole records.
+
+CREATE OR REPLACE FUNCTION monitoring.create_expand_functions()
+RETURNS VOID
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  t JSON;
+  v_owner TEXT;
+  v_columnar TEXT;
+  v_query TEXT;
+BEGIN
+  FOR t IN SELECT value FROM json_each(monitoring.metric_tables_config()) LOOP
+    v_owner := t->'columns'->0->>'name';
+    -- Like expand_template(), unnesting only requested attribute arrays.
+    -- CASE spares detoasting arrays of other attributes. unnest() pads NULL
+    -- arrays with NULLs.
+    v_columnar := format(
+      'SELECT a.datetime, %s, ROW(%s)::monitoring.%I AS record '
+      'FROM monitoring.%I AS h, unnest(%s) AS a(%s) '
+      'WHERE #where_history#',
+      monitoring.format_columns(t, 'h.%1$I'),
+      monitoring.format_attributes(t, 'a.%1$I'),
+      t->>'record_type',
+      (t->>'name') || '_columnar_history',
+      replace(
+        monitoring.format_attributes(t,
+          'CASE WHEN i_attributes IS NULL OR %1$L = ANY(i_attributes) THEN h.%1$I END'
+        ),
+        'CASE WHEN i_attributes IS NULL OR ''datetime'' = ANY(i_attributes) THEN h.datetime END',
+        'h.datetime'
+      ),
+      monitoring.format_attributes(t, '%1$I')
+    );
+    v_query := replace(
+      t->>'expand',
+      ') SELECT * FROM expand WHERE datetime <@ #tstzrange#',
+      ' UNION ' || v_columnar || ') SELECT * FROM expand WHERE datetime <@ #tstzrange#'
+    );
+    v_query := replace(v_query, '#history_table#', 'monitoring.'||quote_ident((t->>'name')||'_history'));
+    v_query := replace(v_query, '#current_table#', 'monitoring.'||quote_ident((t->>'name')||'_current'));
+    v_query := replace(v_query, '#record_type#', 'monitoring.'||quote_ident(t->>'record_type'));
+    -- Redundant btree bounds allow runtime partition pruning, like
+    -- range_pruning().
+    v_query := replace(v_query, '#where_current#', format(
+      '%I = i_owner_id AND datetime <@ i_range'
+      ' AND datetime >= COALESCE(lower(i_range), ''-infinity'')'
+      ' AND datetime <= COALESCE(upper(i_range), ''infinity'')',
+      v_owner
+    ));
+    v_query := replace(v_query, '#where_history#', format(
+      '%I = i_owner_id AND history_range && i_range'
+      ' AND lower(history_range) >= COALESCE(lower(i_range), ''-infinity'') - INTERVAL ''1 day'''
+      ' AND lower(history_range) <= COALESCE(upper(i_range), ''infinity'')',
+      v_owner
+    ));
+    v_query := replace(v_query, '#tstzrange#', 'i_range');
+    -- Drop previous signature, calls would be ambiguous.
+    EXECUTE format('DROP FUNCTION IF EXISTS monitoring.%I(TSTZRANGE, INTEGER)', 'expand_'||(t->>'name'));
+    EXECUTE format($f$
+      CREATE OR REPLACE FUNCTION monitoring.%I(
+        i_range TSTZRANGE,
+        i_owner_id INTEGER,
+        i_attributes TEXT[] DEFAULT NULL
+      )
+      RETURNS SETOF RECORD
+      LANGUAGE plpgsql STABLE
+      AS $body$
+      BEGIN
+        RETURN QUERY %s;
+      END;
+      $body$;
+      $f$,
+      'expand_'||(t->>'name'), v_query
+    );
+  END LOOP;
+END;
+$$;
+
+SELECT monitoring.create_expand_functions();
+
+GRANT EXECUTE ON ALL FUNCTIONS IN SCHEMA monitoring TO temboard;
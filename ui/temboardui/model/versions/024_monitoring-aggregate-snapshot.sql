@@ -0,0 +1,51 @@
+-- Decide aggregation source in the snapshot of aggregation.
+--
+-- aggregate_bounds() tells whether rows since watermark are all in _current
+-- table. Chunks aggregate later, in their own transaction. An archive
+-- committed in between moves these rows to history, and chunks reading only
+-- _current table missed them. aggregate_source() is now STABLE, using the
+-- snapshot of the calling aggregation statement, and checks archive watermark
+-- again in this snapshot.
+
+CREATE OR REPLACE FUNCTION monitoring.aggregate_source(i_name TEXT, i_range TSTZRANGE, i_current_only BOOLEAN, i_owner_ids INTEGER[])
+RETURNS SETOF RECORD
+LANGUAGE plpgsql STABLE
+AS $$
+DECLARE
+  t JSON;
+  v_archived TIMESTAMPTZ;
+  v_filter TEXT := '';
+  v_where_current TEXT;
+  v_query TEXT;
+BEGIN
+  -- Like expand_data(), filtered by owners. Reads only _current table if
+  -- i_current_only is true and no row of range was archived.
+  t := monitoring.metric_tables_config()->i_name;
+  IF i_owner_ids IS NOT NULL THEN
+    v_filter := quote_ident(t->'columns'->0->>'name')||' = ANY('||quote_literal(i_owner_ids)||'::INTEGER[]) AND ';
+  END IF;
+  v_where_current := v_filter||'datetime <@ '||quote_literal(i_range)||'::TSTZRANGE'||monitoring.range_pruning('datetime', i_range, '0');
+
+  IF i_current_only THEN
+    -- Archiving moves rows and watermark in the same transaction.
+    SELECT datetime INTO v_archived
+    FROM monitoring.metric_watermarks WHERE name = i_name AND kind = 'archive';
+    i_current_only := v_archived IS NOT NULL AND v_archived < lower(i_range);
+  END IF;
+
+  IF i_current_only THEN
+    v_query := 'SELECT * FROM monitoring.'||quote_ident((t->>'name')||'_current')||' WHERE '||v_where_current;
+  ELSE
+    v_query := monitoring.expand_template(t);
+    v_query := replace(v_query, '#history_table#', (t->>'name')||'_history');
+    v_query := replace(v_query, '#current_table#', (t->>'name')||'_current');
+    v_query := replace(v_query, '#record_type#', t->>'record_type');
+    v_query := replace(v_query, '#where_current#', v_where_current);
+    v_query := replace(v_query, '#where_history#', v_filter||'history_range && '||quote_literal(i_range)||'::TSTZRANGE'||monitoring.range_pruning('lower(history_range)', i_range, '1 day'));
+    v_query := replace(v_query, '#tstzrange#', quote_literal(i_range)||'::TSTZRANGE');
+  END IF;
+  RETURN QUERY EXECUTE v_query;
+END;
+$$;
+
+GRANT EXECUTE ON ALL FUNCTIONS IN SCHEMA monitoring TO temboard;
@@ -0,0 +1,64 @@
+-- Archive _current tables by batches of owners.
+--
+-- archive_current_batch() moved an arbitrary batch of rows. The rows of a
+-- single day and key of an owner were spread over many batches, each
+-- inserting its own columnar history row. Archiving now lists owners having
+-- rows to archive with archive_owners(), then moves all rows of a batch of
+-- owners at once. Each day and key of an owner gets a single history row.
+
+CREATE OR REPLACE FUNCTION monitoring.archive_owners(i_name TEXT, i_until TIMESTAMPTZ)
+RETURNS TABLE(owner_id INTEGER, nb_rows BIGINT)
+LANGUAGE plpgsql STABLE
+AS $$
+DECLARE
+  t JSON := monitoring.metric_tables_config()->i_name;
+BEGIN
+  RETURN QUERY EXECUTE format(
+    'SELECT %1$I, count(*) FROM monitoring.%2$I WHERE datetime < %3$L GROUP BY 1 ORDER BY 1',
+    t->'columns'->0->>'name', i_name || '_current', i_until
+  );
+END;
+$$;
+
+
+DROP FUNCTION monitoring.archive_current_batch(TEXT, TIMESTAMPTZ, INTEGER);
+
+CREATE FUNCTION monitoring.archive_current_batch(i_name TEXT, i_until TIMESTAMPTZ, i_owner_ids INTEGER[])
+RETURNS TABLE(nb_rows BIGINT, nb_history_rows BIGINT)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  t JSON := monitoring.metric_tables_config()->i_name;
+  v_table_current TEXT := i_name || '_current';
+  v_archived TIMESTAMPTZ;
+BEGIN
+  -- Move all rows of owners older than cutoff. Rows locked by a concurrent
+  -- archiving are skipped. Insert moved rows like a full archiving of
+  -- _current table.
+  EXECUTE format(
+    'WITH moved AS ('
+    ' DELETE FROM monitoring.%1$I WHERE (tableoid, ctid) IN ('
+    '  SELECT tableoid, ctid FROM monitoring.%1$I'
+    '  WHERE %2$I = ANY(%3$L::INTEGER[]) AND datetime < %4$L'
+    '  FOR UPDATE SKIP LOCKED'
+    ' ) RETURNING *'
+    '), inserted AS (%5$s RETURNING 1) '
+    'SELECT (SELECT count(*) FROM moved), (SELECT count(*) FROM inserted), (SELECT max(datetime) FROM moved)',
+    v_table_current, t->'columns'->0->>'name', i_owner_ids, i_until,
+    replace(
+      monitoring.columnar_archive_query(i_name),
+      'FROM monitoring.' || quote_ident(v_table_current), 'FROM moved'
+    )
+  ) INTO nb_rows, nb_history_rows, v_archived;
+
+  -- Track last archived row for incremental aggregation.
+  IF v_archived IS NOT NULL THEN
+    INSERT INTO monitoring.metric_watermarks AS w (name, kind, datetime)
+    VALUES (i_name, 'archive', v_archived)
+    ON CONFLICT (name, kind) DO UPDATE SET datetime = GREATEST(w.datetime, EXCLUDED.datetime);
+  END IF;
+  RETURN NEXT;
+END;
+$$;
+
+GRANT EXECUTE ON ALL FUNCTIONS IN SCHEMA monitoring TO temboard;
@@ -0,0 +1,24 @@
+-- Mark backfill from the oldest inserted row of each metric.
+--
+-- mark_backfill() received datetimes of every inserted row, to keep the oldest
+-- one. Collector now sends only the oldest datetime of each metric.
+
+DROP FUNCTION monitoring.mark_backfill(JSON);
+
+CREATE FUNCTION monitoring.mark_backfill(i_datetimes JSON)
+RETURNS VOID
+LANGUAGE sql
+AS $$
+  -- i_datetimes maps metric names to the oldest datetime of inserted rows.
+  -- Rows are usually newer than watermarks: no row is locked.
+  INSERT INTO monitoring.metric_watermarks AS w (name, kind, datetime)
+  SELECT i.key, 'backfill_'||m.kind, i.value::TIMESTAMPTZ
+  FROM json_each_text(i_datetimes) AS i
+  JOIN monitoring.metric_watermarks AS m
+    ON m.name = i.key AND m.kind IN ('30m', '6h') AND i.value::TIMESTAMPTZ < m.datetime
+  ON CONFLICT (name, kind) DO UPDATE
+  SET datetime = LEAST(w.datetime, EXCLUDED.datetime)
+  WHERE EXCLUDED.datetime < w.datetime;
+$$;
+
+GRANT EXECUTE ON ALL FUNCTIONS IN SCHEMA monitoring TO temboard;
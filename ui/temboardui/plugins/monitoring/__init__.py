@@ -5,7 +5,9 @@
 #
 # - metric_*_current stores metrics one row per metric point
 # - metric_*_30m_current is a compacted COPY of _current by interval
-# - metric_*_history aggregates points per time interavl
+# - metric_*_history aggregates points per time interavl, as arrays of records.
+#   Legacy, replaced by metric_*_columnar_history storing an array per record
+#   attribute.
 #
 # Tasks:
 #
@@ -14,15 +16,20 @@
 # - collector(host, port, key) inserts metrics history in metric_*_current
 #   table.
 # - history_tables_worker() move data from metric_*_current to
-#   metric_*_history, grouped by time range. metric table is truncated
+#   metric_*_columnar_history, grouped by time range, by batches of owners.
+# - migrate_history_worker() moves legacy metric_*_history rows to
+#   metric_*_columnar_history.
 # - aggregate_data_worker() aggregates data in metric_*_30m_current and
 #   metric_*_6h_current.
+# - partitions_worker() creates partitions of metric tables ahead of time.
+#   purge_data_worker() drops expired partitions.
 #
 
 import logging
 import os
 import shutil
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
 
 try:
     from itertools import zip_longest
@@ -33,7 +40,7 @@ from textwrap import dedent
 import tornado.escape
 import tornado.web
 from psycopg2.extensions import AsIs
-from sqlalchemy.exc import DataError, IntegrityError, ProgrammingError
+from sqlalchemy.exc import DataError, IntegrityError, OperationalError, ProgrammingError
 from sqlalchemy.sql import text
 
 from temboardui.agentclient import TemboardAgentClient
@@ -53,8 +60,13 @@ from ...toolkit import validators as v
 from ...toolkit.configuration import OptionSpec
 from ...toolkit.errors import UserError
 from .alerting import check_specs
+from .cache import cache as chart_cache
 from .handlers import blueprint
-from .model.db import insert_availability
+from .model.db import (
+    insert_availability,
+    list_partitioned_tables,
+    list_unbounded_partitions,
+)
 from .model.orm import Check, CollectorStatus, Host, Instance
 from .tools import (
     Stopwatch,
@@ -78,6 +90,11 @@ class MonitoringPlugin:
     prometheus = shutil.which("prometheus")
     options_specs = [
         OptionSpec(s, "collect_max_duration", default=30, validator=int),
+        OptionSpec(s, "collect_concurrency", default=4, validator=int),
+        OptionSpec(s, "collect_timeout", default=30, validator=int),
+        OptionSpec(s, "aggregate_concurrency", default=4, validator=int),
+        OptionSpec(s, "chart_cache_size", default=64, validator=int),
+        OptionSpec(s, "chart_cache_ttl", default=30, validator=int),
         OptionSpec(s, "prometheus", default=prometheus, validator=v.file_),
     ]
 
@@ -87,6 +104,10 @@ class MonitoringPlugin:
 
     def load(self):
         plugin_path = os.path.dirname(os.path.realpath(__file__))
+        config = self.app.config.monitoring
+        chart_cache.configure(
+            config.chart_cache_size * 1024 * 1024, config.chart_cache_ttl
+        )
         # Import Tornado handlers
         __import__(__name__ + ".handlers.alerting")
         __import__(__name__ + ".handlers.monitoring")
@@ -109,38 +130,167 @@ class MonitoringPlugin:
 @workers.schedule(id="aggregate_data", redo_interval=30 * 60)
 @workers.register(pool_size=1)
 def aggregate_data_worker(app):
-    # Worker in charge of aggregate data
+    # Aggregate closed buckets of each metric and period since watermark.
+    # Owners of metric are split in chunks, aggregated concurrently, each in
+    # its own transaction. Watermark moves forward only if all chunks succeed.
+    # A failed chunk is retried on next run, aggregation upserts buckets.
+    concurrency = max(1, app.config.monitoring.aggregate_concurrency)
+    engine = worker_engine(
+        app.config.repository, pool_size=concurrency, max_overflow=concurrency
+    )
+    try:
+        aggregate_data(engine, concurrency)
+    finally:
+        # Don't keep connections of concurrent chunks idle between tasks.
+        engine.dispose()
+
+
+def aggregate_data(engine, concurrency):
     stopwatch = Stopwatch()
-    engine = worker_engine(app.config.repository)
     logger.info("Aggregating data.")
     with engine.connect() as conn:
-        conn.execute("SET search_path TO monitoring")
-        res = conn.execute("SELECT * FROM metric_tables_config()")
+        res = conn.execute("SELECT * FROM monitoring.metric_tables_config()")
         (tables_config,) = res.fetchone()
+        owners = dict(
+            host_id=[
+                row[0]
+                for row in conn.execute(
+                    "SELECT host_id FROM monitoring.hosts ORDER BY 1"
+                )
+            ],
+            instance_id=[
+                row[0]
+                for row in conn.execute(
+                    "SELECT instance_id FROM monitoring.instances ORDER BY 1"
+                )
+            ],
+        )
+
+    nb_buckets = nb_rows = 0
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
         for config in tables_config.values():
-            logger.debug("Aggregating data for metric %s.", config["name"])
-            try:
-                with conn.begin(), stopwatch:
-                    res = conn.execute(
-                        "SELECT * FROM aggregate_data_single(%s, %s, %s)",
-                        (config["name"], config["record_type"], config["aggregate"]),
+            owner_ids = owners[config["columns"][0]["name"]]
+            # Split owners evenly between threads.
+            size = max(1, -(-len(owner_ids) // concurrency))
+            chunks = [owner_ids[i : i + size] for i in range(0, len(owner_ids), size)]
+            for period in ("30m", "6h"):
+                try:
+                    with stopwatch:
+                        buckets, rows = aggregate_metric(
+                            engine, executor, config, period, chunks
+                        )
+                except Exception as e:
+                    logger.error(
+                        "Failed to aggregate %s by %s: %s.", config["name"], period, e
                     )
-                    # Call here pg_sleep() using conn.execute() to fake slow
-                    # aggregation.
-                    table_name, nb_rows = res.fetchone()
+                    continue
+                nb_buckets += buckets
+                nb_rows += rows
                 logger.debug(
-                    "table=%s insert=%s timedelta=%s",
-                    table_name,
-                    nb_rows,
+                    "table=%s_%s_current buckets=%s rows=%s timedelta=%s",
+                    config["name"],
+                    period,
+                    buckets,
+                    rows,
                     stopwatch.last_delta,
                 )
-            except Exception as e:
-                logger.error("Failed to archive data: %s.", e)
-                # search_path is lost on exception. Define it again.
-                conn.execute("SET search_path TO monitoring")
 
-    logger.debug("Monitoring data aggregation done.")
-    logger.debug("Total time in SQL %s.", stopwatch.delta)
+    seconds = max(stopwatch.delta.total_seconds(), 0.001)
+    logger.info(
+        "Aggregated %d rows in %d buckets in %s: %.0f rows/s, %.0f buckets/s.",
+        nb_rows,
+        nb_buckets,
+        stopwatch.delta,
+        nb_rows / seconds,
+        nb_buckets / seconds,
+    )
+
+
+def aggregate_metric(engine, executor, config, period, chunks):
+    # Aggregate a metric for a period, one task per chunk of owners. Returns
+    # the number of buckets upserted and rows aggregated. Bounds include
+    # buckets backfilled by collector since last run.
+    with engine.begin() as conn:
+        # aggregate_bounds() claims backfill mark, commit it.
+        res = conn.execute(
+            text("SELECT * FROM monitoring.aggregate_bounds(:name, :period)"),
+            dict(name=config["name"], period=period),
+        )
+        # current_only is a hint, aggregate_source() checks it again in the
+        # snapshot of each chunk.
+        lower, upper, current_only = res.fetchone()
+
+    if lower is not None and lower >= upper:
+        # No closed bucket since last run.
+        return 0, 0
+
+    futures = [
+        executor.submit(
+            aggregate_chunk, engine, config, period, lower, upper, current_only, chunk
+        )
+        for chunk in chunks
+    ]
+    try:
+        # Raise the first error, after all chunks are done.
+        results = [f.result() for f in futures]
+    except Exception:
+        if lower is not None:
+            # Don't lose claimed backfill mark, retry on next run.
+            with engine.begin() as conn:
+                conn.execute(
+                    text(
+                        dedent("""\
+                        INSERT INTO monitoring.metric_watermarks AS w (name, kind, datetime)
+                        VALUES (:name, 'backfill_' || :period, :lower)
+                        ON CONFLICT (name, kind) DO UPDATE
+                        SET datetime = LEAST(w.datetime, EXCLUDED.datetime)
+                        """)
+                    ),
+                    dict(name=config["name"], period=period, lower=lower),
+                )
+        raise
+
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                dedent("""\
+                INSERT INTO monitoring.metric_watermarks (name, kind, datetime)
+                VALUES (:name, :period, :upper)
+                ON CONFLICT (name, kind) DO UPDATE SET datetime = EXCLUDED.datetime
+                """)
+            ),
+            dict(name=config["name"], period=period, upper=upper),
+        )
+
+    return sum(r[0] for r in results), sum(r[1] for r in results)
+
+
+def aggregate_chunk(engine, config, period, lower, upper, current_only, owner_ids):
+    with engine.begin() as conn:
+        # Aggregate queries use unqualified names.
+        conn.execute("SET LOCAL search_path TO monitoring")
+        res = conn.execute(
+            text(
+                dedent("""\
+                SELECT nb_buckets, nb_rows
+                FROM aggregate_data_chunk(
+                    :name, :record_type, :query, :period,
+                    tstzrange(:lower, :upper), :current_only, :owner_ids
+                )
+                """)
+            ),
+            dict(
+                name=config["name"],
+                record_type=config["record_type"],
+                query=config["aggregate"],
+                period=period,
+                lower=lower,
+                upper=upper,
+                current_only=current_only,
+                owner_ids=owner_ids,
+            ),
+        )
+        return res.fetchone()
 
 
 @workers.schedule(id="history_tables", redo_interval=3 * 60 * 60)  # 3h
@@ -148,44 +298,111 @@ def aggregate_data_worker(app):
 def history_tables_worker(app):
     # Archive monitoring metric tables.
     #
-    # Copy contents of every metric_*_current tables into corresponding
-    # metric_*_history, aggregated. Then truncate _current tables.
+    # Move rows of every metric_*_current tables older than the start of this
+    # run into corresponding metric_*_columnar_history, aggregated. Rows are
+    # moved by batches of owners, a transaction per batch, without locking
+    # tables: collectors keep inserting metrics meanwhile.
     #
     # This task is triggered every 3 hours by monitoring_boostrap() below.
     #
     stopwatch = Stopwatch()
     engine = worker_engine(app.config.repository)
-    logger.info("Archiving metrics.")
+    until = datetime.now(timezone.utc).replace(second=0, microsecond=0)
+    logger.info("Archiving metrics until %s.", until)
     with engine.connect() as conn:
-        conn.execute("SET search_path TO monitoring")
-        res = conn.execute("SELECT * FROM metric_tables_config()")
-        (tables_config,) = res.fetchone()
-        for config in tables_config.values():
-            logger.debug("Archiving data for metric %s.", config["name"])
+        res = conn.execute("SELECT json_object_keys(monitoring.metric_tables_config())")
+        names = [row[0] for row in res]
+        for name in names:
+            logger.debug("Archiving data for metric %s.", name)
             try:
-                with conn.begin(), stopwatch:
-                    res = conn.execute(
-                        "SELECT * FROM archive_current_metrics(%s, %s, %s)",
-                        (config["name"], config["record_type"], config["history"]),
-                    )
-                    # Call here pg_sleep() using conn.execute() to fake slow
-                    # archiving.
-                    table_name, nb_rows = res.fetchone()
+                with stopwatch:
+                    nb_rows, nb_history_rows = archive_metric(conn, name, until)
                 logger.debug(
-                    "table=%s insert=%s timedelta=%s",
-                    table_name,
+                    "table=%s_columnar_history rows=%s insert=%s timedelta=%s",
+                    name,
                     nb_rows,
+                    nb_history_rows,
                     stopwatch.last_delta,
                 )
             except Exception as e:
                 logger.error("Failed to archive data: %s.", e)
-                # search_path is lost on exception. Define it again.
-                conn.execute("SET search_path TO monitoring")
 
     logger.debug("Monitoring data archiving done.")
     logger.debug("Total time in SQL %s.", stopwatch.delta)
 
 
+def archive_metric(conn, name, until, batch=10000):
+    # Move rows of metric _current table before until to columnar history.
+    # Rows are moved by batches of whole owners, an owner may exceed batch.
+    # Thus all rows of a day and key of an owner make a single history row.
+    # Returns the number of rows moved and of history rows inserted.
+    res = conn.execute(
+        text("SELECT * FROM monitoring.archive_owners(:name, :until)"),
+        name=name,
+        until=until,
+    )
+    owners = res.fetchall()
+    nb_rows = nb_history_rows = 0
+    owner_ids = []
+    size = 0
+    for i, (owner_id, count) in enumerate(owners):
+        owner_ids.append(owner_id)
+        size += count
+        if size < batch and i < len(owners) - 1:
+            continue
+
+        with conn.begin():
+            res = conn.execute(
+                text(
+                    "SELECT * FROM monitoring.archive_current_batch("
+                    ":name, :until, :owner_ids)"
+                ),
+                name=name,
+                until=until,
+                owner_ids=owner_ids,
+            )
+            moved, inserted = res.fetchone()
+        nb_rows += moved
+        nb_history_rows += inserted
+        owner_ids = []
+        size = 0
+    return nb_rows, nb_history_rows
+
+
+@workers.schedule(id="migrate_history", redo_interval=10 * 60)
+@workers.register(pool_size=1)
+def migrate_history_worker(app):
+    # Move legacy metric_*_history rows to columnar history, by batches, a
+    # transaction per batch. Stops after a few minutes, next run resumes.
+    # Once legacy history is empty, this is a no-op.
+    batch = 100
+    deadline = datetime.utcnow() + timedelta(minutes=5)
+    engine = worker_engine(app.config.repository)
+    with engine.connect() as conn:
+        res = conn.execute("SELECT json_object_keys(monitoring.metric_tables_config())")
+        names = [row[0] for row in res]
+        for name in names:
+            moved = 0
+            try:
+                while datetime.utcnow() < deadline:
+                    with conn.begin():
+                        res = conn.execute(
+                            text(
+                                "SELECT monitoring.migrate_history_chunk(:name, :batch)"
+                            ),
+                            name=name,
+                            batch=batch,
+                        )
+                        count = res.scalar()
+                    moved += count
+                    if count < batch:
+                        break
+            except Exception as e:
+                logger.error("Failed to migrate history of %s: %s.", name, e)
+            if moved:
+                logger.info("Moved %d rows of %s to columnar history.", moved, name)
+
+
 @workers.register(pool_size=10)
 def check_data_worker(app, host_id, instance_id, data):
     # Worker in charge of checking preprocessed monitoring values
@@ -226,7 +443,7 @@ def purge_data_worker(app):
                         tablename_prefix||'_'||suffix AS tablename
                     FROM
                         json_object_keys(monitoring.metric_tables_config()) AS tablename_prefix,
-                        UNNEST(ARRAY['30m_current', '6h_current', 'current', 'history']) AS suffix
+                        UNNEST(ARRAY['30m_current', '6h_current', 'current', 'history', 'columnar_history']) AS suffix
                 ) AS q
                 WHERE EXISTS (
                     SELECT 1
@@ -241,12 +458,22 @@ def purge_data_worker(app):
         )
         tablenames = [r["tablename"] for r in res.fetchall()]
         tablenames.extend(["state_changes", "check_changes"])
+        partitioned = list_partitioned_tables(conn)
+        for tablename in [t for t in tablenames if t in partitioned]:
+            drop_expired_partitions(conn, tablename, app.config.monitoring)
+            # Legacy partition is dropped once all its rows expire, default
+            # partition is never dropped. Delete their expired rows meanwhile.
+            tablenames.extend(list_unbounded_partitions(conn, tablename))
 
         purge_query_base = "DELETE FROM :tablename WHERE "
 
         for tablename in tablenames:
-            # With history tables, we have to deal with tstzrange
-            if tablename.endswith("_history"):
+            if tablename in partitioned:
+                continue
+
+            # With history tables and their partitions, we have to deal with
+            # tstzrange
+            if "_history" in tablename:
                 query = (
                     purge_query_base
                     + "NOT (history_range && tstzrange(NOW() "
@@ -278,6 +505,63 @@ def purge_data_worker(app):
     logger.debug("End of monitoring data purge worker.")
 
 
+def drop_expired_partitions(conn, tablename, config):
+    # Drop whole partitions, sparing a huge DELETE. Rows are kept until
+    # their partition expires.
+    try:
+        with conn.begin():
+            # Don't block collectors behind a lock queue.
+            conn.execute("SET LOCAL lock_timeout TO '5s'")
+            res = conn.execute(
+                text(
+                    "SELECT * FROM monitoring.drop_partitions("
+                    ":tablename, NOW() - make_interval(days => :nday))"
+                ),
+                tablename=tablename,
+                nday=config.purge_after,
+            )
+            dropped = [r[0] for r in res]
+    except OperationalError as e:
+        logger.error("Could not drop partitions of %s: %s", tablename, e)
+        return
+
+    for partition in dropped:
+        logger.info("Dropped expired partition %s.", partition)
+
+
+@workers.schedule(id="partitions", redo_interval=60 * 60)  # 1h
+@workers.register(pool_size=1)
+def partitions_worker(app):
+    # Create partitions of metric tables three periods ahead: days for
+    # _current tables, months for others. Collectors insert rows without
+    # partition in default partition, moved on next run.
+    engine = worker_engine(app.config.repository)
+    with engine.connect() as conn:
+        for tablename in list_partitioned_tables(conn):
+            try:
+                with conn.begin():
+                    conn.execute("SET LOCAL lock_timeout TO '5s'")
+                    res = conn.execute(
+                        text(
+                            dedent("""\
+                            SELECT * FROM monitoring.create_partitions(
+                                :tablename,
+                                NOW() + 3 * ('1 ' || monitoring.partition_unit(:tablename))::INTERVAL
+                            )
+                            """)  # noqa
+                        ),
+                        tablename=tablename,
+                    )
+                    created = [r[0] for r in res]
+            except OperationalError as e:
+                logger.error("Could not create partitions of %s: %s", tablename, e)
+                logger.error("Retrying in 1 hour.")
+                continue
+
+            for partition in created:
+                logger.info("Created partition %s.", partition)
+
+
 @workers.register(pool_size=1)
 def notify_state_change(app, check_id, key, value, state, prev_state):
     # check if at least one notifications transport is configured
@@ -416,19 +700,38 @@ def schedule_collector(app):
     logger.debug("End of collector scheduler.")
 
 
-@workers.register(pool_size=20)
+@workers.register(pool_size=4)
 def collector_batch(app, batch):
-    # Start new ORM DB session
-    engine = worker_engine(app.config.repository)
-    engine.connect().close()  # Warm pool.
+    # Collect agents of the batch concurrently, each in its own thread, ORM
+    # session and with its own HTTP timeout. A slow agent does not delay the
+    # others.
+    max_concurrency = max(1, app.config.monitoring.collect_concurrency)
+    concurrency = min(len(batch), max_concurrency)
+    # Size pool from configuration to reuse the same engine and its
+    # connections for every batch. Threads never exceed pool size.
+    engine = worker_engine(
+        app.config.repository, pool_size=max_concurrency, max_overflow=0
+    )
+    collect_batch(app, engine, batch, concurrency)
 
-    for address, port in batch:
-        try:
-            collector(app, address, port, engine=engine)
-        except UserError:
-            raise
-        except Exception as e:
-            logger.exception("Failed to collect %s:%s: %s", address, port, e)
+
+def collect_batch(app, engine, batch, concurrency):
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {
+            executor.submit(collector, app, address, port, engine=engine): (
+                address,
+                port,
+            )
+            for address, port in batch
+        }
+        for future in as_completed(futures):
+            address, port = futures[future]
+            try:
+                future.result()
+            except UserError:
+                raise
+            except Exception as e:
+                logger.exception("Failed to collect %s:%s: %s", address, port, e)
 
 
 @workers.register(pool_size=20)
@@ -436,7 +739,9 @@ def collector(app, address, port, engine=None):
     agent_id = f"{address}:{port}"
     logger.info("Collecting metrics. agent=%s", agent_id)
 
-    client = TemboardAgentClient.factory(app.config, address, port)
+    client = TemboardAgentClient.factory(
+        app.config, address, port, timeout=app.config.monitoring.collect_timeout
+    )
     # Start new ORM DB session
     engine = engine or worker_engine(app.config.repository)
     worker_session = Session(bind=engine)
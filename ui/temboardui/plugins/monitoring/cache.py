@@ -0,0 +1,122 @@
+# In-process cache of chart data.
+#
+# Several users watching the same instance refresh the same charts. Chart data
+# is cached by instance, metric, zoom level and range aligned on zoom bucket.
+# Ranges ending before backfill and aggregation horizon are immutable and
+# cached longer than recent ranges. Cache is bounded by the size of cached
+# data. Web process logs hits and misses once per minute in logfmt.
+
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from time import monotonic
+
+from ...toolkit import logfmt
+
+logger = logging.getLogger(__name__)
+
+# Ranges ending before horizon are immutable. Keep them one hour.
+HISTORY_TTL = 3600
+# Agents keep 6 hours of metrics to backfill after a collect failure.
+# aggregate_data worker aggregates closed 30m and 6h buckets every 30 minutes.
+HORIZON = 6 * 3600 + 30 * 60
+
+
+class LRUCache:
+    interval = 60
+
+    def __init__(self, size=64 * 1024 * 1024, ttl=30):
+        # Maximum length of cached data.
+        self.size = size
+        # TTL of ranges ending after horizon.
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.length = 0
+        self.lock = threading.Lock()
+        self.reset_stats()
+
+    def configure(self, size, ttl):
+        with self.lock:
+            self.size = size
+            self.ttl = ttl
+            self.entries.clear()
+            self.length = 0
+
+    def reset_stats(self):
+        self.start = monotonic()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[0] > monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                value = entry[1]
+            else:
+                if entry:
+                    self.pop(key)
+                self.misses += 1
+                value = None
+            record = self.pop_stats()
+        if record:
+            logger.debug("%s", record)
+        return value
+
+    def set(self, key, value, ttl):
+        if self.size <= 0 or ttl <= 0 or len(value) > self.size:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.pop(key)
+            self.entries[key] = (monotonic() + ttl, value)
+            self.length += len(value)
+            while self.length > self.size:
+                self.pop(next(iter(self.entries)))
+
+    def pop(self, key):
+        # Must hold lock.
+        _, value = self.entries.pop(key)
+        self.length -= len(value)
+
+    def pop_stats(self):
+        # Returns logfmt record of stats once per interval. Must hold lock.
+        elapsed = monotonic() - self.start
+        if elapsed < self.interval:
+            return
+        ratio = self.hits / ((self.hits + self.misses) or 1)
+        record = logfmt.format(
+            chart_cache_hits=self.hits,
+            chart_cache_misses=self.misses,
+            chart_cache_hit_ratio="%.2f" % ratio,
+            chart_cache_entries=len(self.entries),
+            chart_cache_size=self.length,
+        )
+        self.reset_stats()
+        return record
+
+    def align_range(self, start, end, bucket, now=None):
+        # Returns start and end aligned on bucket seconds, and TTL of range.
+        if now is None:
+            now = datetime.now(timezone.utc) if start.tzinfo else datetime.utcnow()
+        if end is None:
+            end = now
+        start = align(start, bucket)
+        end = align(end, bucket, ceil=True)
+        horizon = now - timedelta(seconds=bucket + HORIZON)
+        ttl = HISTORY_TTL if end <= horizon else self.ttl
+        return start, end, ttl
+
+
+def align(dt, bucket, ceil=False):
+    epoch = datetime(1970, 1, 1, tzinfo=dt.tzinfo)
+    seconds = (dt - epoch).total_seconds()
+    aligned = seconds // bucket * bucket
+    if ceil and aligned < seconds:
+        aligned += bucket
+    return epoch + timedelta(seconds=aligned)
+
+
+cache = LRUCache()
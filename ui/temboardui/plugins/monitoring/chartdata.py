@@ -1,10 +1,14 @@
+import csv
 import datetime
+import json
+import re
 from io import StringIO
 from textwrap import dedent
 
 from psycopg2.extensions import AsIs
 
-from .pivot import pivot_timeserie
+from .cache import cache
+from .pivot import downsample_rows, drain, pivot_lines
 
 METRICS = dict(
     blocks=dict(
@@ -13,7 +17,7 @@ SELECT
     datetime AS date,
     ROUND(SUM((record).blks_read)/(extract('epoch' from MIN((record).measure_interval)))) AS blks_read_s,
     ROUND(SUM((record).blks_hit)/(extract('epoch' from MIN((record).measure_interval)))) AS blks_hit_s
-FROM expand_data_by_instance_id('metric_blocks', tstzrange(%(start)s, %(end)s), %(instance_id)s)
+FROM expand_metric_blocks(tstzrange(%(start)s, %(end)s), %(instance_id)s, %(attributes)s)
 AS (datetime timestamp with time zone, instance_id integer, dbname text, record metric_blocks_record)
 GROUP BY datetime, instance_id ORDER BY datetime
         """,  # noqa
@@ -36,7 +40,7 @@ SELECT
     (record).checkpoints_req AS req,
     ROUND(((record).checkpoint_write_time/1000)::numeric, 1) AS write_time,
     ROUND(((record).checkpoint_sync_time/1000)::numeric,1) AS sync_time
-FROM expand_data_by_instance_id('metric_bgwriter', tstzrange(%(start)s, %(end)s), %(instance_id)s)
+FROM expand_metric_bgwriter(tstzrange(%(start)s, %(end)s), %(instance_id)s, %(attributes)s)
 AS (datetime timestamp with time zone, instance_id integer, record metric_bgwriter_record)
         """,  # noqa
         sql_zoom="""
@@ -60,7 +64,7 @@ SELECT
     round((SUM((record).time_system)/(SUM((record).time_user)+SUM((record).time_system)+SUM((record).time_idle)+SUM((record).time_iowait)+SUM((record).time_steal))::float*100)::numeric, 1) AS system,
     round((SUM((record).time_iowait)/(SUM((record).time_user)+SUM((record).time_system)+SUM((record).time_idle)+SUM((record).time_iowait)+SUM((record).time_steal))::float*100)::numeric, 1) AS iowait,
     round((SUM((record).time_steal)/(SUM((record).time_user)+SUM((record).time_system)+SUM((record).time_idle)+SUM((record).time_iowait)+SUM((record).time_steal))::float*100)::numeric, 1) AS steal
-FROM expand_data_by_host_id('metric_cpu', tstzrange(%(start)s, %(end)s), %(host_id)s)
+FROM expand_metric_cpu(tstzrange(%(start)s, %(end)s), %(host_id)s, %(attributes)s)
 AS (datetime timestamp with time zone, host_id integer, cpu text, record metric_cpu_record)
 GROUP BY datetime, host_id ORDER BY datetime
         """,  # noqa
@@ -85,7 +89,7 @@ SELECT
     round(((record).time_system/((record).time_user+(record).time_system+(record).time_idle+(record).time_iowait+(record).time_steal)::float*100)::numeric, 1) AS system,
     round(((record).time_iowait/((record).time_user+(record).time_system+(record).time_idle+(record).time_iowait+(record).time_steal)::float*100)::numeric, 1) AS iowait,
     round(((record).time_steal/((record).time_user+(record).time_system+(record).time_idle+(record).time_iowait+(record).time_steal)::float*100)::numeric, 1) AS steal
-FROM expand_data_by_host_id('metric_cpu', tstzrange(%(start)s, %(end)s), %(host_id)s)
+FROM expand_metric_cpu(tstzrange(%(start)s, %(end)s), %(host_id)s, %(attributes)s)
 AS (datetime timestamp with time zone, host_id integer, cpu text, record metric_cpu_record)
 WHERE cpu = %(key)s
 ORDER BY datetime
@@ -109,7 +113,7 @@ SELECT
     datetime AS date,
     round(SUM((record).context_switches)/(extract('epoch' from MIN((record).measure_interval)))) AS context_switches_s,
     round(SUM((record).forks)/(extract('epoch' from MIN((record).measure_interval)))) AS forks_s
-FROM expand_data_by_host_id('metric_process', tstzrange(%(start)s, %(end)s), %(host_id)s)
+FROM expand_metric_process(tstzrange(%(start)s, %(end)s), %(host_id)s, %(attributes)s)
 AS (datetime timestamp with time zone, host_id integer, record metric_process_record)
 GROUP BY datetime ORDER BY datetime
         """,  # noqa
@@ -130,7 +134,7 @@ SELECT
     datetime AS date,
     dbname,
     (record).size
-FROM expand_data_by_instance_id('metric_db_size', tstzrange(%(start)s, %(end)s), %(instance_id))
+FROM expand_metric_db_size(tstzrange(%(start)s, %(end)s), %(instance_id)s, %(attributes)s)
 AS (datetime timestamp with time zone, instance_id integer, dbname text, record metric_db_size_record)
         """,  # noqa
         sql_zoom="""
@@ -151,7 +155,7 @@ SELECT
     datetime AS date,
     mount_point,
     (record).used AS size
-FROM expand_data_by_host_id('metric_filesystems_size', tstzrange(%(start)s, %(end)s), %(host_id)s)
+FROM expand_metric_filesystems_size(tstzrange(%(start)s, %(end)s), %(host_id)s, %(attributes)s)
 AS (datetime timestamp with time zone, host_id integer, mount_point text, record metric_filesystems_size_record)
         """,  # noqa
         sql_zoom="""
@@ -172,7 +176,7 @@ SELECT
     datetime AS date,
     mount_point,
     round((((record).used::FLOAT/(record).total::FLOAT)*100)::numeric, 1) AS usage
-FROM expand_data_by_host_id('metric_filesystems_size', tstzrange(%(start)s, %(end)s), %(host_id)s)
+FROM expand_metric_filesystems_size(tstzrange(%(start)s, %(end)s), %(host_id)s, %(attributes)s)
 AS (datetime timestamp with time zone, host_id integer, mount_point text, record metric_filesystems_size_record)
         """,  # noqa
         sql_zoom="""
@@ -192,7 +196,7 @@ ORDER BY 1,2 ASC
 SELECT
     datetime AS date,
     round((((record).used::FLOAT/(record).total::FLOAT)*100)::numeric, 1) AS usage
-FROM expand_data_by_host_id('metric_filesystems_size', tstzrange(%(start)s, %(end)s), %(host_id)s)
+FROM expand_metric_filesystems_size(tstzrange(%(start)s, %(end)s), %(host_id)s, %(attributes)s)
 AS (datetime timestamp with time zone, host_id integer, mount_point text, record metric_filesystems_size_record)
 WHERE mount_point = %(key)s
         """,  # noqa
@@ -213,7 +217,7 @@ SELECT
     CASE WHEN (SUM((record).blks_hit) + SUM((record).blks_read)) > 0
     THEN ROUND((SUM((record).blks_hit)::FLOAT/(SUM((record).blks_hit) + SUM((record).blks_read)::FLOAT) * 100)::numeric, 2)
     ELSE 100 END AS hit_read_ratio
-FROM expand_data_by_instance_id('metric_blocks', tstzrange(%(start)s, %(end)s), %(instance_id)s)
+FROM expand_metric_blocks(tstzrange(%(start)s, %(end)s), %(instance_id)s, %(attributes)s)
 AS (datetime timestamp with time zone, instance_id integer, dbname text, record metric_blocks_record)
 GROUP BY datetime, instance_id ORDER BY datetime
         """,  # noqa
@@ -236,7 +240,7 @@ SELECT
     CASE WHEN ((record).blks_hit + (record).blks_read) > 0
     THEN ROUND((((record).blks_hit::FLOAT/((record).blks_hit + (record).blks_read)::FLOAT) * 100)::numeric, 2)
     ELSE 100 END AS hit_read_ratio
-FROM expand_data_by_instance_id('metric_blocks', tstzrange(%(start)s, %(end)s), %(instance_id)s)
+FROM expand_metric_blocks(tstzrange(%(start)s, %(end)s), %(instance_id)s, %(attributes)s)
 AS (datetime timestamp with time zone, instance_id integer, dbname text, record metric_blocks_record)
 WHERE dbname = %(key)s
 ORDER BY datetime
@@ -258,7 +262,7 @@ ORDER BY 1,2 ASC
 SELECT
     datetime AS date,
     SUM((record).size) AS size
-FROM expand_data_by_instance_id('metric_db_size', tstzrange(%(start)s, %(end)s), %(instance_id)s)
+FROM expand_metric_db_size(tstzrange(%(start)s, %(end)s), %(instance_id)s, %(attributes)s)
 AS (datetime timestamp with time zone, instance_id integer, dbname text, record metric_db_size_record)
 GROUP BY datetime, instance_id ORDER BY datetime
         """,  # noqa
@@ -279,7 +283,7 @@ SELECT
     (record).load1,
     (record).load5,
     (record).load15
-FROM expand_data_by_host_id( 'metric_loadavg', tstzrange(%(start)s, %(end)s), %(host_id)s)
+FROM expand_metric_loadavg(tstzrange(%(start)s, %(end)s), %(host_id)s, %(attributes)s)
 AS (datetime timestamp with time zone, host_id integer, record metric_loadavg_record)
         """,  # noqa
         sql_zoom="""
@@ -298,7 +302,7 @@ ORDER BY datetime ASC
 SELECT
     datetime AS date,
     (record).load1
-FROM expand_data_by_host_id( 'metric_loadavg', tstzrange(%(start)s, %(end)s), %(host_id)s)
+FROM expand_metric_loadavg(tstzrange(%(start)s, %(end)s), %(host_id)s, %(attributes)s)
 AS (datetime timestamp with time zone, host_id integer, record metric_loadavg_record)
         """,  # noqa
         sql_zoom="""
@@ -323,7 +327,7 @@ SELECT
     SUM((record).exclusive) AS exclusive,
     SUM((record).access_exclusive) AS access_exclusive,
     SUM((record).siread) AS siread
-FROM expand_data_by_instance_id('metric_locks', tstzrange(%(start)s, %(end)s), %(instance_id)s)
+FROM expand_metric_locks(tstzrange(%(start)s, %(end)s), %(instance_id)s, %(attributes)s)
 AS (datetime timestamp with time zone, instance_id integer, dbname text, record metric_locks_record)
 GROUP BY datetime, instance_id ORDER BY datetime
         """,  # noqa
@@ -352,7 +356,7 @@ SELECT
     (record).mem_cached AS cached,
     (record).mem_buffers AS buffers,
     ((record).mem_used - (record).mem_cached - (record).mem_buffers) AS other
-FROM expand_data_by_host_id('metric_memory', tstzrange(%(start)s, %(end)s), %(host_id)s)
+FROM expand_metric_memory(tstzrange(%(start)s, %(end)s), %(host_id)s, %(attributes)s)
 AS (datetime timestamp with time zone, host_id integer, record metric_memory_record)
         """,  # noqa
         sql_zoom="""
@@ -373,7 +377,7 @@ ORDER BY datetime
 SELECT
     datetime AS date,
     round(((((record).mem_total - (record).mem_free - (record).mem_cached)::FLOAT/(record).mem_total::FLOAT)*100)::numeric, 1) AS usage
-FROM expand_data_by_host_id('metric_memory', tstzrange(%(start)s, %(end)s), %(host_id)s)
+FROM expand_metric_memory(tstzrange(%(start)s, %(end)s), %(host_id)s, %(attributes)s)
 AS (datetime timestamp with time zone, host_id integer, record metric_memory_record)
         """,  # noqa
         sql_zoom="""
@@ -391,7 +395,7 @@ ORDER BY datetime
 SELECT
     datetime AS date,
     SUM((record).n_rollback) AS rollback
-FROM expand_data_by_instance_id('metric_xacts', tstzrange(%(start)s, %(end)s), %(instance_id)s)
+FROM expand_metric_xacts(tstzrange(%(start)s, %(end)s), %(instance_id)s, %(attributes)s)
 AS (datetime timestamp with time zone, instance_id integer, dbname text, record metric_xacts_record)
 WHERE dbname = %(key)s
 GROUP BY datetime, instance_id ORDER BY datetime
@@ -417,7 +421,7 @@ SELECT
     SUM((record).idle_in_xact_aborted) AS idle_in_xact_aborted,
     SUM((record).fastpath) AS fastpath,
     SUM((record).disabled) AS disabled
-FROM expand_data_by_instance_id('metric_sessions', tstzrange(%(start)s, %(end)s), %(instance_id)s)
+FROM expand_metric_sessions(tstzrange(%(start)s, %(end)s), %(instance_id)s, %(attributes)s)
 AS (datetime timestamp with time zone, instance_id integer, dbname text, record metric_sessions_record)
 GROUP BY datetime, instance_id ORDER BY datetime
         """,  # noqa
@@ -442,7 +446,7 @@ GROUP BY datetime, instance_id ORDER BY 1,2 ASC
 SELECT
     datetime AS date,
     round(((SUM((record).active + (record).waiting + (record).idle + (record).idle_in_xact + (record).idle_in_xact_aborted + (record).fastpath + (record).disabled)::FLOAT/(SELECT setting FROM pg_settings WHERE name = 'max_connections')::FLOAT)*100)::numeric, 1) AS session_usage
-FROM expand_data_by_instance_id('metric_sessions', tstzrange(%(start)s, %(end)s), %(instance_id)s)
+FROM expand_metric_sessions(tstzrange(%(start)s, %(end)s), %(instance_id)s, %(attributes)s)
 AS (datetime timestamp with time zone, instance_id integer, dbname text, record metric_sessions_record)
 GROUP BY datetime, instance_id ORDER BY datetime
         """,  # noqa
@@ -461,7 +465,7 @@ GROUP BY datetime, instance_id ORDER BY 1,2 ASC
 SELECT
     datetime AS date,
     (record).swap_used AS used
-FROM expand_data_by_host_id('metric_memory', tstzrange(%(start)s, %(end)s), %(host_id)s)
+FROM expand_metric_memory(tstzrange(%(start)s, %(end)s), %(host_id)s, %(attributes)s)
 AS (datetime timestamp with time zone, host_id integer, record metric_memory_record)
         """,  # noqa
         sql_zoom="""
@@ -479,7 +483,7 @@ ORDER BY datetime
 SELECT
     datetime AS date,
     round((((record).swap_used::FLOAT/(record).swap_total::FLOAT)*100)::numeric, 1) AS usage
-FROM expand_data_by_host_id('metric_memory', tstzrange(%(start)s, %(end)s), %(host_id)s)
+FROM expand_metric_memory(tstzrange(%(start)s, %(end)s), %(host_id)s, %(attributes)s)
 AS (datetime timestamp with time zone, host_id integer, record metric_memory_record)
         """,  # noqa
         sql_zoom="""
@@ -498,7 +502,7 @@ SELECT
     datetime AS date,
     spcname,
     (record).size
-FROM expand_data_by_instance_id('metric_tblspc_size', tstzrange(%(start)s, %(end)s), %(instance_id)s)
+FROM expand_metric_tblspc_size(tstzrange(%(start)s, %(end)s), %(instance_id)s, %(attributes)s)
 AS (datetime timestamp with time zone, instance_id integer, spcname text, record metric_tblspc_size_record)
         """,  # noqa
         sql_zoom="""
@@ -519,7 +523,7 @@ SELECT
     datetime AS date,
     round(SUM((record).n_commit)/(extract('epoch' from MIN((record).measure_interval)))) AS commit,
     round(SUM((record).n_rollback)/(extract('epoch' from MIN((record).measure_interval)))) AS rollback
-FROM expand_data_by_instance_id('metric_xacts', tstzrange(%(start)s, %(end)s), %(instance_id)s)
+FROM expand_metric_xacts(tstzrange(%(start)s, %(end)s), %(instance_id)s, %(attributes)s)
 AS (datetime timestamp with time zone, instance_id integer, dbname text, record metric_xacts_record)
 GROUP BY datetime, instance_id ORDER BY datetime
         """,  # noqa
@@ -546,7 +550,7 @@ SELECT
     SUM((record).waiting_share_row_exclusive) AS share_row_exclusive,
     SUM((record).waiting_exclusive) AS exclusive,
     SUM((record).waiting_access_exclusive) AS access_exclusive
-FROM expand_data_by_instance_id('metric_locks', tstzrange(%(start)s, %(end)s), %(instance_id)s)
+FROM expand_metric_locks(tstzrange(%(start)s, %(end)s), %(instance_id)s, %(attributes)s)
 AS (datetime timestamp with time zone, instance_id integer, dbname text, record metric_locks_record)
 GROUP BY datetime, instance_id ORDER BY datetime
         """,  # noqa
@@ -572,7 +576,7 @@ GROUP BY datetime, instance_id ORDER BY 1,2 ASC
 SELECT
     datetime AS date,
     (record).waiting
-FROM expand_data_by_instance_id('metric_sessions', tstzrange(%(start)s, %(end)s), %(instance_id)s)
+FROM expand_metric_sessions(tstzrange(%(start)s, %(end)s), %(instance_id)s, %(attributes)s)
 AS (datetime timestamp with time zone, instance_id integer, dbname text, record metric_sessions_record)
 WHERE dbname = %(key)s
 ORDER BY datetime
@@ -593,7 +597,7 @@ SELECT
     datetime AS date,
     (record).written_size,
     (record).total_size
-FROM expand_data_by_instance_id('metric_wal_files', tstzrange(%(start)s, %(end)s), %(instance_id)s)
+FROM expand_metric_wal_files(tstzrange(%(start)s, %(end)s), %(instance_id)s, %(attributes)s)
 AS (datetime timestamp with time zone, instance_id integer, record metric_wal_files_record)
         """,  # noqa
         sql_zoom="""
@@ -612,7 +616,7 @@ ORDER BY 1,2 ASC
 SELECT
     datetime AS date,
     (record).archive_ready
-FROM expand_data_by_instance_id('metric_wal_files', tstzrange(%(start)s, %(end)s), %(instance_id)s)
+FROM expand_metric_wal_files(tstzrange(%(start)s, %(end)s), %(instance_id)s, %(attributes)s)
 AS (datetime timestamp with time zone, instance_id integer, record metric_wal_files_record)
         """,  # noqa
         sql_zoom="""
@@ -631,7 +635,7 @@ SELECT
     datetime AS date,
     (record).archive_ready,
     (record).total
-FROM expand_data_by_instance_id('metric_wal_files', tstzrange(%(start)s, %(end)s), %(instance_id)s)
+FROM expand_metric_wal_files(tstzrange(%(start)s, %(end)s), %(instance_id)s, %(attributes)s)
 AS (datetime timestamp with time zone, instance_id integer, record metric_wal_files_record)
         """,  # noqa
         sql_zoom="""
@@ -650,7 +654,7 @@ ORDER BY 1,2 ASC
 SELECT
     datetime AS date,
     round(SUM((record).written_size)/(extract('epoch' from MIN((record).measure_interval)))) AS written_size_s
-FROM expand_data_by_instance_id('metric_wal_files', tstzrange(%(start)s, %(end)s), %(instance_id)s)
+FROM expand_metric_wal_files(tstzrange(%(start)s, %(end)s), %(instance_id)s, %(attributes)s)
 AS (datetime timestamp with time zone, instance_id integer, record metric_wal_files_record)
 GROUP BY datetime, instance_id ORDER BY datetime
         """,  # noqa
@@ -669,7 +673,7 @@ GROUP BY datetime, instance_id ORDER BY 1,2 ASC
 SELECT
     datetime AS date,
     (record).total
-FROM expand_data_by_instance_id('metric_wal_files', tstzrange(%(start)s, %(end)s), %(instance_id)s)
+FROM expand_metric_wal_files(tstzrange(%(start)s, %(end)s), %(instance_id)s, %(attributes)s)
 AS (datetime timestamp with time zone, instance_id integer, record metric_wal_files_record)
         """,  # noqa
         sql_zoom="""
@@ -689,7 +693,7 @@ SELECT
     (record).buffers_checkpoint AS checkpoint,
     (record).buffers_clean AS clean,
     (record).buffers_backend AS backend
-FROM expand_data_by_instance_id('metric_bgwriter', tstzrange(%(start)s, %(end)s), %(instance_id)s)
+FROM expand_metric_bgwriter(tstzrange(%(start)s, %(end)s), %(instance_id)s, %(attributes)s)
 AS (datetime timestamp with time zone, instance_id integer, record metric_bgwriter_record)
         """,  # noqa
         sql_zoom="""
@@ -709,7 +713,7 @@ ORDER BY 1,2 ASC
 SELECT
     datetime AS date,
     (record).lag AS lag
-FROM expand_data_by_instance_id('metric_replication_lag', tstzrange(%(start)s, %(end)s), %(instance_id)s)
+FROM expand_metric_replication_lag(tstzrange(%(start)s, %(end)s), %(instance_id)s, %(attributes)s)
 AS (datetime timestamp with time zone, instance_id integer, record metric_replication_lag_record)
 ORDER BY 1
         """,  # noqa
@@ -728,7 +732,7 @@ ORDER BY 1
 SELECT
     datetime AS date,
     (record).connected AS connected
-FROM expand_data_by_instance_id('metric_replication_connection', tstzrange(%(start)s, %(end)s), %(instance_id)s)
+FROM expand_metric_replication_connection(tstzrange(%(start)s, %(end)s), %(instance_id)s, %(attributes)s)
 AS (datetime timestamp with time zone, instance_id integer, upstream text, record metric_replication_connection_record)
 WHERE upstream = %(key)s
 ORDER BY 1
@@ -748,7 +752,7 @@ ORDER BY 1
 SELECT
     datetime AS date,
     (record).size
-FROM expand_data_by_instance_id('metric_temp_files_size_delta', tstzrange(%(start)s, %(end)s), %(instance_id)s)
+FROM expand_metric_temp_files_size_delta(tstzrange(%(start)s, %(end)s), %(instance_id)s, %(attributes)s)
 AS (datetime timestamp with time zone, instance_id integer, dbname text, record metric_temp_files_size_delta_record)
 WHERE dbname = %(key)s
 ORDER BY 1
@@ -768,7 +772,7 @@ ORDER BY 1
 SELECT
     datetime AS date,
     (record).ratio
-FROM expand_data_by_instance_id('metric_heap_bloat', tstzrange(%(start)s, %(end)s), %(instance_id)s)
+FROM expand_metric_heap_bloat(tstzrange(%(start)s, %(end)s), %(instance_id)s, %(attributes)s)
 AS (datetime timestamp with time zone, instance_id integer, dbname text, record metric_bloat_ratio_record)
 WHERE dbname = %(key)s
 ORDER BY 1
@@ -788,7 +792,7 @@ ORDER BY 1
 SELECT
     datetime AS date,
     (record).ratio
-FROM expand_data_by_instance_id('metric_btree_bloat', tstzrange(%(start)s, %(end)s), %(instance_id)s)
+FROM expand_metric_btree_bloat(tstzrange(%(start)s, %(end)s), %(instance_id)s, %(attributes)s)
 AS (datetime timestamp with time zone, instance_id integer, dbname text, record metric_bloat_ratio_record)
 WHERE dbname = %(key)s
 ORDER BY 1
@@ -823,6 +827,14 @@ def zoom_level(start, end):
     return zoom
 
 
+# Seconds between points of each zoom level: raw points are collected each
+# minute.
+ZOOM_BUCKETS = {0: 60, 1: 30 * 60, 2: 6 * 60 * 60}
+
+
+RECORD_ATTRIBUTE_RE = re.compile(r"\(record\)\.(\w+)")
+
+
 def get_tablename(probename, zoom):
     if zoom == 1:
         return "metric_%s_30m_current" % (probename)
@@ -833,26 +845,103 @@ def get_tablename(probename, zoom):
 
 
 def get_metric_data_csv(
-    session, metric_name, start, end, host_id=None, instance_id=None, key=None
+    session,
+    metric_name,
+    start,
+    end,
+    host_id=None,
+    instance_id=None,
+    key=None,
+    points=None,
 ):
     if metric_name not in METRICS:
         raise IndexError("Metric '%s' not found" % metric_name)
 
-    metric = METRICS.get(metric_name)
-    # Instanciate a new string buffer needed by copy_expert()
-    data_buffer = StringIO()
     # Get a new psycopg2 cursor from the current sqlalchemy session
     cur = session.connection().connection.cursor()
     # Change working schema to 'monitoring'
     cur.execute("SET search_path TO monitoring")
-    # Get the "zoom level", depending on the time interval
+    try:
+        return cached_metric_data_csv(
+            cur, metric_name, start, end, host_id, instance_id, key, points
+        )
+    finally:
+        cur.close()
+
+
+def generate_metrics_data_ndjson(
+    session, metric_names, start, end, host_id=None, instance_id=None, points=None
+):
+    # Generate a JSON line per metric, with CSV data of the metric or an error
+    # message. Metrics are read with a single cursor, in the current
+    # transaction. unavailability is accepted as a metric.
+    cur = session.connection().connection.cursor()
+    cur.execute("SET search_path TO monitoring")
+    try:
+        for metric_name in metric_names:
+            if metric_name != "unavailability" and metric_name not in METRICS:
+                # Don't fail other charts of the batch.
+                error = "Metric '%s' not found" % metric_name
+                yield json.dumps(dict(metric=metric_name, error=error)) + "\n"
+                continue
+            if metric_name == "unavailability":
+                data = copy_unavailability_csv(cur, start, end, instance_id)
+            else:
+                data = cached_metric_data_csv(
+                    cur, metric_name, start, end, host_id, instance_id, points=points
+                )
+            yield json.dumps(dict(metric=metric_name, data=data)) + "\n"
+    finally:
+        cur.close()
+
+
+def cached_metric_data_csv(
+    cur, metric_name, start, end, host_id, instance_id, key=None, points=None
+):
+    if start is None:
+        return copy_metric_data_csv(
+            cur, metric_name, start, end, host_id, instance_id, key, points
+        )
+
     level = zoom_level(start, end)
+    # Align range on zoom bucket so that concurrent users share cache entries.
+    start, end, ttl = cache.align_range(start, end, ZOOM_BUCKETS[level])
+    cache_key = (host_id, instance_id, metric_name, key, level, start, end, points)
+    data = cache.get(cache_key)
+    if data is None:
+        data = copy_metric_data_csv(
+            cur, metric_name, start, end, host_id, instance_id, key, points, level
+        )
+        cache.set(cache_key, data, ttl)
+    return data
+
+
+def copy_metric_data_csv(
+    cur,
+    metric_name,
+    start,
+    end,
+    host_id,
+    instance_id,
+    key=None,
+    points=None,
+    level=None,
+):
+    # Query metric data as CSV with cursor. search_path must be monitoring.
+    metric = METRICS[metric_name]
+    # Instanciate a new string buffer needed by copy_expert()
+    data_buffer = StringIO()
+    if level is None:
+        # Get the "zoom level", depending on the time interval
+        level = zoom_level(start, end)
     # Load query template
     q_tpl = metric.get("sql_nozoom") if level == 0 else metric.get("sql_zoom")
     tablename = get_tablename(metric.get("probename"), level)
     query = cur.mogrify(
         q_tpl,
         dict(
+            # Expand functions read only history of these attributes.
+            attributes=sorted(set(RECORD_ATTRIBUTE_RE.findall(q_tpl))),
             host_id=host_id,
             instance_id=instance_id,
             start=start,
@@ -874,32 +963,49 @@ def get_metric_data_csv(
         % (query,),
         data_buffer,
     )
-    cur.close()
 
+    if not metric.get("pivot") and not points:
+        return data_buffer.getvalue()
+
+    data_buffer.seek(0)
+    output = StringIO()
     if metric.get("pivot"):
         # Apply pivot rotation
-        data_pivot = StringIO()
-        pivot_timeserie(
-            data_buffer,
+        lines = pivot_lines(
+            csv.reader(data_buffer),
             index=metric.get("pivot").get("index"),
             key=metric.get("pivot").get("key"),
             value=metric.get("pivot").get("value"),
-            output=data_pivot,
         )
-
-        data = data_pivot.getvalue()
+        # Free raw data before writing output.
         data_buffer.close()
-        data_pivot.close()
+        count = len(lines) - 1
+        if not points:
+            output.writelines(drain(lines))
+            return output.getvalue()
+        rows = csv.reader(drain(lines))
     else:
-        data = data_buffer.getvalue()
-        data_buffer.close()
-    return data
+        count = sum(1 for _ in csv.reader(data_buffer)) - 1
+        data_buffer.seek(0)
+        rows = csv.reader(data_buffer)
+
+    # Limit points per serie, whatever the range.
+    rows = downsample_rows(rows, points, count=count)
+    csv.writer(output, lineterminator="\n").writerows(rows)
+    return output.getvalue()
 
 
 def get_unavailability_csv(session, start, end, host_id, instance_id):
     # Tell when the instance was not available
     cur = session.connection().connection.cursor()
     cur.execute("SET search_path TO monitoring")
+    try:
+        return copy_unavailability_csv(cur, start, end, instance_id)
+    finally:
+        cur.close()
+
+
+def copy_unavailability_csv(cur, start, end, instance_id):
     sql = """
         SELECT datetime FROM instance_availability
         WHERE instance_id = %(instance_id)s
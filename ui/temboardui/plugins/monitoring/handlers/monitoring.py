@@ -1,9 +1,13 @@
 import logging
 
-from temboardui.web.tornado import HTTPError, csvify
+from temboardui.web.tornado import HTTPError, Response, csvify
 
-from ..chartdata import get_metric_data_csv, get_unavailability_csv
-from ..tools import get_request_ids, parse_start_end
+from ..chartdata import (
+    generate_metrics_data_ndjson,
+    get_metric_data_csv,
+    get_unavailability_csv,
+)
+from ..tools import get_request_ids, parse_points, parse_start_end
 from . import blueprint, render_template
 
 logger = logging.getLogger(__name__)
@@ -38,6 +42,7 @@ def unavailability(request):
 @blueprint.instance_route(r"/monitoring/data/([a-z\-_.0-9]{1,64})$")
 def data_metric(request, metric_name):
     key = request.handler.get_argument("key", default=None)
+    points = parse_points(request)
     try:
         host_id, instance_id = get_request_ids(request)
     except NameError as e:
@@ -54,8 +59,42 @@ def data_metric(request, metric_name):
             host_id=host_id,
             instance_id=instance_id,
             key=key,
+            points=points,
         )
     except IndexError:
         raise HTTPError(404, "Unknown metric.")
 
     return csvify(data=data)
+
+
+@blueprint.instance_route(r"/monitoring/data\.ndjson$")
+def data_metrics(request):
+    # Data of several metrics in a single request, one JSON line per metric.
+    metrics = request.handler.get_argument("metrics", default="")
+    metrics = [m for m in metrics.split(",") if m]
+    start, end = parse_start_end(request)
+    points = parse_points(request)
+    try:
+        host_id, instance_id = get_request_ids(request)
+    except NameError as e:
+        logger.info("%s. No data.", e)
+        host_id = instance_id = None
+
+    session = request.db_session
+    # Read all metrics from the same snapshot.
+    session.commit()
+    session.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+    # Unknown metrics have an error line.
+    body = "".join(
+        generate_metrics_data_ndjson(
+            session,
+            metrics,
+            start,
+            end,
+            host_id=host_id,
+            instance_id=instance_id,
+            points=points,
+        )
+    )
+
+    return Response(headers={"Content-Type": "application/x-ndjson"}, body=body)
@@ -1,21 +1,14 @@
-import functools
+import json
 import logging
+import re
+from io import StringIO
 from textwrap import dedent
 
-logger = logging.getLogger(__name__.replace(".db", ""))
-
-
-def handle_keyerror(fun):
-    metric_name = fun.__name__.replace("insert_metric_", "")
+import psycopg2
+from sqlalchemy.exc import DataError
+from sqlalchemy.sql import text
 
-    @functools.wraps(fun)
-    def wrapper(*a, **kw):
-        try:
-            return fun(*a, **kw)
-        except KeyError as e:
-            logger.warning("Missing point %s for %s.", e.args[0], metric_name)
-
-    return wrapper
+logger = logging.getLogger(__name__.replace(".db", ""))
 
 
 def insert_availability(session, dt, instance_id, available):
@@ -31,392 +24,281 @@ def insert_availability(session, dt, instance_id, available):
     )
 
 
-@handle_keyerror
-def insert_metric_sessions(session, instance_id, metric):
+# Layout of monitoring.metric_<name>_current tables. owner is the column
+# referencing host or instance, key is the optional column discriminating
+# points of the same owner, fields are the record attributes following
+# datetime.
+METRICS = dict(
+    sessions=dict(
+        owner="instance_id",
+        key="dbname",
+        fields=[
+            "active",
+            "waiting",
+            "idle",
+            "idle_in_xact",
+            "idle_in_xact_aborted",
+            "fastpath",
+            "disabled",
+            "no_priv",
+        ],
+    ),
+    xacts=dict(
+        owner="instance_id",
+        key="dbname",
+        fields=["measure_interval", "n_commit", "n_rollback"],
+    ),
+    locks=dict(
+        owner="instance_id",
+        key="dbname",
+        fields=[
+            "access_share",
+            "row_share",
+            "row_exclusive",
+            "share_update_exclusive",
+            "share",
+            "share_row_exclusive",
+            "exclusive",
+            "access_exclusive",
+            "siread",
+            "waiting_access_share",
+            "waiting_row_share",
+            "waiting_row_exclusive",
+            "waiting_share_update_exclusive",
+            "waiting_share",
+            "waiting_share_row_exclusive",
+            "waiting_exclusive",
+            "waiting_access_exclusive",
+        ],
+    ),
+    blocks=dict(
+        owner="instance_id",
+        key="dbname",
+        fields=["measure_interval", "blks_read", "blks_hit", "hitmiss_ratio"],
+    ),
+    bgwriter=dict(
+        owner="instance_id",
+        key=None,
+        fields=[
+            "measure_interval",
+            "checkpoints_timed",
+            "checkpoints_req",
+            "checkpoint_write_time",
+            "checkpoint_sync_time",
+            "buffers_checkpoint",
+            "buffers_clean",
+            "maxwritten_clean",
+            "buffers_backend",
+            "buffers_backend_fsync",
+            "buffers_alloc",
+            "stats_reset",
+        ],
+    ),
+    db_size=dict(owner="instance_id", key="dbname", fields=["size"]),
+    tblspc_size=dict(owner="instance_id", key="spcname", fields=["size"]),
+    filesystems_size=dict(
+        owner="host_id", key="mount_point", fields=["used", "total", "device"]
+    ),
+    temp_files_size_delta=dict(
+        owner="instance_id", key="dbname", fields=["measure_interval", "size"]
+    ),
+    wal_files=dict(
+        owner="instance_id",
+        key=None,
+        fields=[
+            "measure_interval",
+            "written_size",
+            "current_location",
+            "total",
+            "archive_ready",
+            "total_size",
+        ],
+    ),
+    cpu=dict(
+        owner="host_id",
+        key="cpu",
+        fields=[
+            "measure_interval",
+            "time_user",
+            "time_system",
+            "time_idle",
+            "time_iowait",
+            "time_steal",
+        ],
+    ),
+    process=dict(
+        owner="host_id",
+        key=None,
+        fields=[
+            "measure_interval",
+            "context_switches",
+            "forks",
+            "procs_running",
+            "procs_blocked",
+            "procs_total",
+        ],
+    ),
+    memory=dict(
+        owner="host_id",
+        key=None,
+        fields=[
+            "mem_total",
+            "mem_used",
+            "mem_free",
+            "mem_buffers",
+            "mem_cached",
+            "swap_total",
+            "swap_used",
+        ],
+    ),
+    loadavg=dict(owner="host_id", key=None, fields=["load1", "load5", "load15"]),
+    vacuum_analyze=dict(
+        owner="instance_id",
+        key="dbname",
+        fields=[
+            "measure_interval",
+            "n_vacuum",
+            "n_analyze",
+            "n_autovacuum",
+            "n_autoanalyze",
+        ],
+    ),
+    replication_lag=dict(owner="instance_id", key=None, fields=["lag"]),
+    replication_connection=dict(
+        owner="instance_id", key="upstream", fields=["connected"]
+    ),
+    heap_bloat=dict(owner="instance_id", key="dbname", fields=["ratio"]),
+    btree_bloat=dict(owner="instance_id", key="dbname", fields=["ratio"]),
+)
+
+
+def format_metric_row(metric_name, owner_id, point):
+    # Returns metric table row for a point from agent. Raises KeyError on
+    # missing field.
+    spec = METRICS[metric_name]
+    row = [point["datetime"], owner_id]
+    if spec["key"]:
+        row.append(point[spec["key"]])
+    # Record datetime is set on archiving, from row datetime.
+    record = [None]
+    for field in spec["fields"]:
+        value = point[field]
+        if field == "measure_interval":
+            value = str(value)
+        record.append(value)
+    row.append(tuple(record))
+    return row
+
+
+def insert_metric(session, metric_name, row):
+    # Insert a single row with a plain INSERT. See copy_metric for bulk insert.
     session.execute(
-        dedent("""
-            INSERT INTO monitoring.metric_sessions_current
-            VALUES (:dt, :instance_id, :dbname, :row)
-        """),
-        dict(
-            dt=metric["datetime"],
-            instance_id=instance_id,
-            dbname=metric["dbname"],
-            row=(
-                None,
-                metric["active"],
-                metric["waiting"],
-                metric["idle"],
-                metric["idle_in_xact"],
-                metric["idle_in_xact_aborted"],
-                metric["fastpath"],
-                metric["disabled"],
-                metric["no_priv"],
-            ),
-        ),
+        "INSERT INTO monitoring.metric_%s_current VALUES (%s)"
+        % (metric_name, ", ".join(":c%d" % i for i in range(len(row)))),
+        dict(("c%d" % i, v) for i, v in enumerate(row)),
     )
 
 
-@handle_keyerror
-def insert_metric_xacts(session, instance_id, metric):
+def copy_metric(session, metric_name, rows):
+    # Bulk insert rows in metric current table using COPY FROM STDIN. This
+    # spares a round-trip per row. Transaction is left to caller.
+    fo = StringIO()
+    for row in rows:
+        fo.write("\t".join(format_copy_field(v) for v in row))
+        fo.write("\n")
+    fo.seek(0)
+
+    cur = session.connection().connection.cursor()
+    sql = "COPY monitoring.metric_%s_current FROM STDIN" % metric_name
+    try:
+        cur.copy_expert(sql, fo)
+    except psycopg2.DataError as e:
+        # Wrap like SQLAlchemy does for execute().
+        raise DataError(sql, None, e) from e
+    finally:
+        cur.close()
+
+
+def mark_backfill(session, datetimes):
+    # Mark metrics inserted in already aggregated buckets for re-aggregation.
+    # datetimes maps metric name to the oldest datetime of inserted rows.
+    # Transaction is left to caller.
     session.execute(
-        dedent("""
-            INSERT INTO monitoring.metric_xacts_current
-            VALUES (:dt, :instance_id, :dbname, :row)
-        """),
-        dict(
-            dt=metric["datetime"],
-            instance_id=instance_id,
-            dbname=metric["dbname"],
-            row=(
-                None,
-                str(metric["measure_interval"]),
-                metric["n_commit"],
-                metric["n_rollback"],
-            ),
-        ),
+        "SELECT monitoring.mark_backfill(CAST(:datetimes AS JSON))",
+        dict(datetimes=json.dumps(datetimes)),
     )
 
 
-@handle_keyerror
-def insert_metric_locks(session, instance_id, metric):
-    session.execute(
-        dedent("""
-            INSERT INTO monitoring.metric_locks_current
-            VALUES (:dt, :instance_id, :dbname, :row)
-        """),
-        dict(
-            dt=metric["datetime"],
-            instance_id=instance_id,
-            dbname=metric["dbname"],
-            row=(
-                None,
-                metric["access_share"],
-                metric["row_share"],
-                metric["row_exclusive"],
-                metric["share_update_exclusive"],
-                metric["share"],
-                metric["share_row_exclusive"],
-                metric["exclusive"],
-                metric["access_exclusive"],
-                metric["siread"],
-                metric["waiting_access_share"],
-                metric["waiting_row_share"],
-                metric["waiting_row_exclusive"],
-                metric["waiting_share_update_exclusive"],
-                metric["waiting_share"],
-                metric["waiting_share_row_exclusive"],
-                metric["waiting_exclusive"],
-                metric["waiting_access_exclusive"],
-            ),
-        ),
-    )
-
-
-@handle_keyerror
-def insert_metric_blocks(session, instance_id, metric):
-    session.execute(
-        dedent("""
-            INSERT INTO monitoring.metric_blocks_current
-            VALUES (:dt, :instance_id, :dbname, :row)
-        """),
-        dict(
-            dt=metric["datetime"],
-            instance_id=instance_id,
-            dbname=metric["dbname"],
-            row=(
-                None,
-                str(metric["measure_interval"]),
-                metric["blks_read"],
-                metric["blks_hit"],
-                metric["hitmiss_ratio"],
-            ),
-        ),
-    )
-
-
-@handle_keyerror
-def insert_metric_bgwriter(session, instance_id, metric):
-    session.execute(
-        dedent("""
-            INSERT INTO monitoring.metric_bgwriter_current
-            VALUES (:dt, :instance_id, :row)
-        """),
-        dict(
-            dt=metric["datetime"],
-            instance_id=instance_id,
-            row=(
-                None,
-                str(metric["measure_interval"]),
-                metric["checkpoints_timed"],
-                metric["checkpoints_req"],
-                metric["checkpoint_write_time"],
-                metric["checkpoint_sync_time"],
-                metric["buffers_checkpoint"],
-                metric["buffers_clean"],
-                metric["maxwritten_clean"],
-                metric["buffers_backend"],
-                metric["buffers_backend_fsync"],
-                metric["buffers_alloc"],
-                metric["stats_reset"],
-            ),
-        ),
-    )
+COPY_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
 
 
-@handle_keyerror
-def insert_metric_db_size(session, instance_id, metric):
-    session.execute(
-        dedent("""
-            INSERT INTO monitoring.metric_db_size_current
-            VALUES (:dt, :instance_id, :dbname, :row)
-        """),
-        dict(
-            dt=metric["datetime"],
-            instance_id=instance_id,
-            dbname=metric["dbname"],
-            row=(None, metric["size"]),
-        ),
-    )
+def format_copy_field(value):
+    # Format value for COPY text format.
+    if value is None:
+        return "\\N"
+    if isinstance(value, tuple):
+        value = format_record(value)
+    else:
+        value = format_scalar(value)
+    return value.translate(COPY_ESCAPES)
 
 
-@handle_keyerror
-def insert_metric_tblspc_size(session, instance_id, metric):
-    session.execute(
-        dedent("""
-            INSERT INTO monitoring.metric_tblspc_size_current
-            VALUES (:dt, :instance_id, :spcname, :row)
-        """),
-        dict(
-            dt=metric["datetime"],
-            instance_id=instance_id,
-            spcname=metric["spcname"],
-            row=(None, metric["size"]),
-        ),
-    )
+# Characters requiring double quoting in record literal.
+RECORD_SPECIAL_RE = re.compile(r'[(),"\\\s]')
 
 
-@handle_keyerror
-def insert_metric_fs_size(session, host_id, metric):
-    session.execute(
-        dedent("""
-            INSERT INTO monitoring.metric_filesystems_size_current
-            VALUES (:dt, :host_id, :mount_point, :row)
-        """),
-        dict(
-            dt=metric["datetime"],
-            host_id=host_id,
-            mount_point=metric["mount_point"],
-            row=(None, metric["used"], metric["total"], metric["device"]),
-        ),
-    )
+def format_record(values):
+    # Format values as a PostgreSQL composite literal: (a,"b c",,d)
+    fields = []
+    for value in values:
+        if value is None:
+            fields.append("")
+            continue
+        value = format_scalar(value)
+        if "" == value or RECORD_SPECIAL_RE.search(value):
+            value = '"%s"' % value.replace("\\", "\\\\").replace('"', '\\"')
+        fields.append(value)
+    return "(%s)" % ",".join(fields)
 
 
-@handle_keyerror
-def insert_metric_temp_files_size_delta(session, instance_id, metric):
-    session.execute(
-        dedent("""
-            INSERT INTO monitoring.metric_temp_files_size_delta_current
-            VALUES (:dt, :instance_id, :dbname, :row)
-        """),
-        dict(
-            dt=metric["datetime"],
-            instance_id=instance_id,
-            dbname=metric["dbname"],
-            row=(None, str(metric["measure_interval"]), metric["size"]),
-        ),
-    )
+def format_scalar(value):
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    return str(value)
 
 
-@handle_keyerror
-def insert_metric_wal_files(session, instance_id, metric):
-    session.execute(
+def list_partitioned_tables(session):
+    # Partitioned metric tables. Always empty on PostgreSQL 9.6.
+    rows = session.execute(
         dedent("""
-            INSERT INTO monitoring.metric_wal_files_current
-            VALUES (:dt, :instance_id, :row)
-        """),
-        dict(
-            dt=metric["datetime"],
-            instance_id=instance_id,
-            row=(
-                None,
-                str(metric["measure_interval"]),
-                metric["written_size"],
-                metric["current_location"],
-                metric["total"],
-                metric["archive_ready"],
-                metric["total_size"],
-            ),
-        ),
+            SELECT c.relname
+            FROM pg_catalog.pg_class AS c
+            JOIN pg_catalog.pg_namespace AS n ON n.oid = c.relnamespace
+            WHERE n.nspname = 'monitoring' AND c.relkind = 'p'
+            ORDER BY 1
+        """)
     )
-
-
-@handle_keyerror
-def insert_metric_cpu(session, host_id, metric):
-    session.execute(
-        dedent("""
-            INSERT INTO monitoring.metric_cpu_current
-            VALUES (:dt, :host_id, :cpu, :row)
-        """),
-        dict(
-            dt=metric["datetime"],
-            host_id=host_id,
-            cpu=metric["cpu"],
-            row=(
-                None,
-                str(metric["measure_interval"]),
-                metric["time_user"],
-                metric["time_system"],
-                metric["time_idle"],
-                metric["time_iowait"],
-                metric["time_steal"],
-            ),
-        ),
-    )
-
-
-@handle_keyerror
-def insert_metric_process(session, host_id, metric):
-    session.execute(
-        dedent("""
-            INSERT INTO monitoring.metric_process_current
-            VALUES (:dt, :host_id, :row)
-        """),
-        dict(
-            dt=metric["datetime"],
-            host_id=host_id,
-            row=(
-                None,
-                str(metric["measure_interval"]),
-                metric["context_switches"],
-                metric["forks"],
-                metric["procs_running"],
-                metric["procs_blocked"],
-                metric["procs_total"],
-            ),
-        ),
-    )
-
-
-@handle_keyerror
-def insert_metric_memory(session, host_id, metric):
-    session.execute(
-        dedent("""
-            INSERT INTO monitoring.metric_memory_current
-            VALUES (:dt, :host_id, :row)
-        """),
-        dict(
-            dt=metric["datetime"],
-            host_id=host_id,
-            row=(
-                None,
-                metric["mem_total"],
-                metric["mem_used"],
-                metric["mem_free"],
-                metric["mem_buffers"],
-                metric["mem_cached"],
-                metric["swap_total"],
-                metric["swap_used"],
-            ),
-        ),
-    )
-
-
-@handle_keyerror
-def insert_metric_loadavg(session, host_id, metric):
-    session.execute(
-        dedent("""
-            INSERT INTO monitoring.metric_loadavg_current
-            VALUES (:dt, :host_id, :row)
-        """),
-        dict(
-            dt=metric["datetime"],
-            host_id=host_id,
-            row=(None, metric["load1"], metric["load5"], metric["load15"]),
-        ),
-    )
-
-
-@handle_keyerror
-def insert_metric_vacuum_analyze(session, instance_id, metric):
-    session.execute(
-        dedent("""
-            INSERT INTO monitoring.metric_vacuum_analyze_current
-            VALUES (:dt, :instance_id, :dbname, :row)
-        """),
-        dict(
-            dt=metric["datetime"],
-            instance_id=instance_id,
-            dbname=metric["dbname"],
-            row=(
-                None,
-                str(metric["measure_interval"]),
-                metric["n_vacuum"],
-                metric["n_analyze"],
-                metric["n_autovacuum"],
-                metric["n_autoanalyze"],
-            ),
-        ),
-    )
-
-
-@handle_keyerror
-def insert_metric_replication_lag(session, instance_id, metric):
-    session.execute(
-        dedent("""
-            INSERT INTO monitoring.metric_replication_lag_current
-            VALUES (:dt, :instance_id, :row)
-        """),
-        dict(dt=metric["datetime"], instance_id=instance_id, row=(None, metric["lag"])),
-    )
-
-
-@handle_keyerror
-def insert_metric_replication_connection(session, instance_id, metric):
-    session.execute(
-        dedent("""
-            INSERT INTO monitoring.metric_replication_connection_current
-            VALUES (:dt, :instance_id, :upstream, :row)
-        """),
-        dict(
-            dt=metric["datetime"],
-            instance_id=instance_id,
-            upstream=metric["upstream"],
-            row=(None, metric["connected"]),
-        ),
-    )
-
-
-@handle_keyerror
-def insert_metric_heap_bloat(session, instance_id, metric):
-    session.execute(
-        dedent("""
-            INSERT INTO monitoring.metric_heap_bloat_current
-            VALUES (:dt, :instance_id, :dbname, :row)
-        """),
-        dict(
-            dt=metric["datetime"],
-            instance_id=instance_id,
-            dbname=metric["dbname"],
-            row=(None, metric["ratio"]),
-        ),
-    )
-
-
-@handle_keyerror
-def insert_metric_btree_bloat(session, instance_id, metric):
-    session.execute(
-        dedent("""
-            INSERT INTO monitoring.metric_btree_bloat_current
-            VALUES (:dt, :instance_id, :dbname, :row)
-        """),
-        dict(
-            dt=metric["datetime"],
-            instance_id=instance_id,
-            dbname=metric["dbname"],
-            row=(None, metric["ratio"]),
+    return [row[0] for row in rows]
+
+
+def list_unbounded_partitions(session, tablename):
+    # Legacy and default partitions of a partitioned metric table. Purge drops
+    # them late or never.
+    rows = session.execute(
+        text(
+            dedent("""
+            SELECT c.relname
+            FROM pg_catalog.pg_inherits AS i
+            JOIN pg_catalog.pg_class AS c ON c.oid = i.inhrelid
+            WHERE i.inhparent = CAST(:tablename AS REGCLASS)
+              AND (pg_get_expr(c.relpartbound, c.oid) = 'DEFAULT'
+                OR pg_get_expr(c.relpartbound, c.oid) LIKE 'FOR VALUES FROM (MINVALUE)%')
+            ORDER BY 1
+            """)
         ),
+        dict(tablename="monitoring.%s" % tablename),
     )
+    return [row[0] for row in rows]
 
 
 def get_host_id(session, hostname):
@@ -1,39 +1,125 @@
 import csv
 import operator
-
-
-def get_csv_data(fd):
-    # CSV parser as generator
-    yield from csv.DictReader(fd)
+from collections import deque
+from io import StringIO
 
 
 def pivot_timeserie(fd, index, key, value, output):
-    # Simple pivot table implementation.
-    # Beware, input data *MUST* be ordered by index value.
     fd.seek(0)
+    output.writelines(drain(pivot_lines(csv.reader(fd), index, key, value)))
+
+
+def pivot_lines(rows, index, key, value):
+    # Single pass pivot of CSV rows, header first. Returns a deque of CSV
+    # lines: a header with index and keys in order of appearance, then a line
+    # per index value with a value per key. Lines are formatted as soon as
+    # complete, lines missing keys appearing later are padded at the end.
+    # Beware, input rows *MUST* be ordered by index value.
+    rows = iter(rows)
+    header = next(rows, None)
+    lines = deque()
+    if header is None:
+        return lines
+    i_index, i_key, i_value = (header.index(c) for c in (index, key, value))
+    fo = StringIO()
+    writer = csv.writer(fo, lineterminator="\n")
+
+    def format_line(line):
+        fo.seek(0)
+        fo.truncate()
+        writer.writerow(line)
+        return fo.getvalue()
+
+    # Position of each key in output lines.
     keys = {}
-    p = 1
-    # We need to get the keys first
-    for r in get_csv_data(fd):
-        if r[key] not in keys:
-            keys[r[key]] = p
-            p += 1
-    sk = sorted(list(keys.items()), key=operator.itemgetter(1))
-    # CSV Header
-    line = [index] + [x[0] for x in sk]
-    p_index = ""
-    fd.seek(0)
-    for r in get_csv_data(fd):
-        if r[index] != p_index:
+    lines.append(None)
+    # Line number and width of lines formatted before all keys are known.
+    short = []
+    line = None
+    for row in rows:
+        if line is None or row[i_index] != line[0]:
             # As data are ordered if we meet a new index value then the current
             # line is complete.
-            output.write(",".join(line) + "\n")
-            # And start a new line
-            line = [""] * (len(keys) + 1)
-            line[0] = r[index]
-        # Append value to the current line
-        line[keys[r[key]]] = r[value]
-        # Keep a track of the index value
-        p_index = r[index]
-    # Write the last line
-    output.write(",".join(line) + "\n")
+            if line:
+                lines.append(format_line(line))
+                short.append((len(lines) - 1, len(line)))
+            line = [row[i_index]] + [""] * len(keys)
+        pos = keys.get(row[i_key])
+        if pos is None:
+            pos = keys[row[i_key]] = len(keys) + 1
+            line.append("")
+        line[pos] = row[i_value]
+    if line:
+        lines.append(format_line(line))
+
+    width = len(keys) + 1
+    for lineno, line_width in short:
+        if line_width < width:
+            lines[lineno] = lines[lineno][:-1] + "," * (width - line_width) + "\n"
+    lines[0] = format_line([index] + list(keys))
+    return lines
+
+
+def drain(lines):
+    # Generate lines of a deque, freeing each line once consumed.
+    while lines:
+        yield lines.popleft()
+
+
+def downsample_timeserie(fd, points, output):
+    fd.seek(0)
+    writer = csv.writer(output, lineterminator="\n")
+    writer.writerows(downsample_rows(csv.reader(fd), points))
+
+
+def downsample_rows(rows, points, count=None):
+    # Min/max bucketing of CSV rows, header first, to at most points rows.
+    # First column is the index, others are series. Rows are split in points /
+    # 2 buckets. Each bucket is replaced by two rows at first and last index of
+    # the bucket, holding min and max of each series in time order. Peaks
+    # remain visible whatever the range. Given the count of rows, only a
+    # bucket is kept in memory.
+    rows = iter(rows)
+    header = next(rows, None)
+    if header is None:
+        return
+    yield header
+    if count is None:
+        rows = list(rows)
+        count = len(rows)
+    if count <= points:
+        yield from rows
+        return
+    # Ceil division.
+    size = -(-count // max(1, points // 2))
+    bucket = []
+    for row in rows:
+        bucket.append(row)
+        if len(bucket) == size:
+            yield from minmax_bucket(bucket)
+            bucket = []
+    if bucket:
+        yield from minmax_bucket(bucket)
+
+
+def minmax_bucket(rows):
+    if len(rows) < 3:
+        return rows
+    first, last = list(rows[0]), list(rows[-1])
+    for col in range(1, len(first)):
+        lo = hi = None
+        for pos, row in enumerate(rows):
+            try:
+                value = float(row[col])
+            except (IndexError, ValueError):
+                # Missing point or label column.
+                continue
+            if lo is None or value < lo[0]:
+                lo = (value, pos, row[col])
+            if hi is None or value > hi[0]:
+                hi = (value, pos, row[col])
+        if lo is None:
+            continue
+        a, b = sorted((lo, hi), key=operator.itemgetter(1))
+        first[col], last[col] = a[2], b[2]
+    return [first, last]
@@ -96,14 +96,30 @@ def parse_start_end(request):
     return start, end
 
 
+def parse_points(request):
+    points = request.handler.get_argument("points", default=None)
+    if points is None:
+        return None
+    try:
+        points = int(points)
+    except ValueError:
+        points = 0
+    if points < 2:
+        raise HTTPError(406, "points must be an integer greater than 1.")
+    return points
+
+
 class TimeoutError(UserError):
     pass
 
 
 def insert_metrics(session, host_id, instance_id, data, labels=None, max_duration=30):
+    # Stage rows of each metric in memory and flush them with a single COPY
+    # per metric table. Commit once all metrics are inserted.
     start = datetime.utcnow()
     max_duration = timedelta(seconds=max_duration)
     labels = labels or {}
+    datetimes = {}
 
     for metric_name in list(data.keys()):
         call_duration = datetime.utcnow() - start
@@ -123,6 +139,10 @@ def insert_metrics(session, host_id, instance_id, data, labels=None, max_duratio
         if len(data[metric_name]) == 0:
             continue
 
+        if metric_name not in db.METRICS:
+            logger.debug("Ignoring unknown metric %s.", metric_name)
+            continue
+
         for record in generate_logfmt_records(metric_name, data[metric_name]):
             try:
                 logger.debug(
@@ -133,53 +153,32 @@ def insert_metrics(session, host_id, instance_id, data, labels=None, max_duratio
             except Exception:
                 logger.exception("Failed to format logfmt.")
 
-        # Insert data
-        for metric_data in data[metric_name]:
-            logger.debug("Inserting data for metric %s.", metric_name)
-            if metric_name == "sessions":
-                db.insert_metric_sessions(session, instance_id, metric_data)
-            elif metric_name == "xacts":
-                db.insert_metric_xacts(session, instance_id, metric_data)
-            elif metric_name == "locks":
-                db.insert_metric_locks(session, instance_id, metric_data)
-            elif metric_name == "blocks":
-                db.insert_metric_blocks(session, instance_id, metric_data)
-            elif metric_name == "bgwriter":
-                db.insert_metric_bgwriter(session, instance_id, metric_data)
-            elif metric_name == "db_size":
-                db.insert_metric_db_size(session, instance_id, metric_data)
-            elif metric_name == "tblspc_size":
-                db.insert_metric_tblspc_size(session, instance_id, metric_data)
-            elif metric_name == "filesystems_size":
-                db.insert_metric_fs_size(session, host_id, metric_data)
-            elif metric_name == "temp_files_size_delta":
-                db.insert_metric_temp_files_size_delta(
-                    session, instance_id, metric_data
-                )
-            elif metric_name == "wal_files":
-                db.insert_metric_wal_files(session, instance_id, metric_data)
-            elif metric_name == "cpu":
-                db.insert_metric_cpu(session, host_id, metric_data)
-            elif metric_name == "process":
-                db.insert_metric_process(session, host_id, metric_data)
-            elif metric_name == "memory":
-                db.insert_metric_memory(session, host_id, metric_data)
-            elif metric_name == "loadavg":
-                db.insert_metric_loadavg(session, host_id, metric_data)
-            elif metric_name == "vacuum_analyze":
-                db.insert_metric_vacuum_analyze(session, instance_id, metric_data)
-            elif metric_name == "replication_lag":
-                db.insert_metric_replication_lag(session, instance_id, metric_data)
-            elif metric_name == "replication_connection":
-                db.insert_metric_replication_connection(
-                    session, instance_id, metric_data
-                )
-            elif metric_name == "heap_bloat":
-                db.insert_metric_heap_bloat(session, instance_id, metric_data)
-            elif metric_name == "btree_bloat":
-                db.insert_metric_btree_bloat(session, instance_id, metric_data)
+        if "host_id" == db.METRICS[metric_name]["owner"]:
+            owner_id = host_id
+        else:
+            owner_id = instance_id
 
-            session.commit()
+        rows = list(generate_metric_rows(metric_name, owner_id, data[metric_name]))
+        if not rows:
+            continue
+
+        logger.debug("Inserting %d rows for metric %s.", len(rows), metric_name)
+        db.copy_metric(session, metric_name, rows)
+        # Agent sends UTC datetimes of a single format, ordered like strings.
+        datetimes[metric_name] = min(str(row[0]) for row in rows)
+
+    if datetimes:
+        # Agent may send history older than aggregation watermarks.
+        db.mark_backfill(session, datetimes)
+    session.commit()
+
+
+def generate_metric_rows(metric_name, owner_id, points):
+    for point in points:
+        try:
+            yield db.format_metric_row(metric_name, owner_id, point)
+        except KeyError as e:
+            logger.warning("Missing point %s for %s.", e.args[0], metric_name)
 
 
 def generate_logfmt_records(metric, points):
@@ -1,7 +1,12 @@
 import json
 import logging
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
 from decimal import Decimal
+from io import StringIO
 from os import path
+from time import monotonic
 
 import tornado.web
 from past.utils import old_div
@@ -14,14 +19,14 @@ from temboardui.model.orm import (
     Biggest,
     Biggestsum,
     Instances,
-    diff,
     to_epoch,
     total_hit,
     total_read,
 )
+from temboardui.plugins.monitoring.model.db import format_copy_field
 from temboardui.plugins.monitoring.tools import parse_start_end
 from temboardui.toolkit import taskmanager
-from temboardui.web.tornado import Blueprint, TemplateRenderer, jsonify
+from temboardui.web.tornado import Blueprint, HTTPError, TemplateRenderer, jsonify
 
 from ...application import get_instance
 
@@ -60,54 +65,175 @@ METAS_QUERY = text("""
 """)
 
 
-BASE_QUERY_STATDATA = text("""
-    (
-        SELECT dbid, datname, (record).*
-        FROM (
-          SELECT psh.dbid, psh.datname, unnest(records) AS record
-          FROM statements.statements_history_db psh
-          WHERE coalesce_range && tstzrange(:start, :end,'[]')
-          AND    agent_address = :agent_address
-          AND    agent_port = :agent_port
-        ) AS unnested
-        WHERE tstzrange((record).ts, (record).ts, '[]')
-              <@ tstzrange(:start, :end, '[]')
+# Deltas of statements are summed from hourly and daily rollups, raw snapshots
+# are diffed only at range edges. See statements.statements_deltas().
+DELTAS_COLUMNS = """
+    sum(d.calls)::bigint AS calls,
+    sum(d.total_exec_time) AS total_exec_time,
+    sum(d.total_exec_time) / sum(d.calls) AS mean_time,
+    sum(d.shared_blks_read)::bigint AS shared_blks_read,
+    sum(d.shared_blks_hit)::bigint AS shared_blks_hit,
+    sum(d.shared_blks_dirtied)::bigint AS shared_blks_dirtied,
+    sum(d.shared_blks_written)::bigint AS shared_blks_written,
+    sum(d.local_blks_read)::bigint AS local_blks_read,
+    sum(d.local_blks_hit)::bigint AS local_blks_hit,
+    sum(d.local_blks_dirtied)::bigint AS local_blks_dirtied,
+    sum(d.local_blks_written)::bigint AS local_blks_written,
+    sum(d.temp_blks_read)::bigint AS temp_blks_read,
+    sum(d.temp_blks_written)::bigint AS temp_blks_written,
+    sum(d.blk_read_time) AS blk_read_time,
+    sum(d.blk_write_time) AS blk_write_time
+"""
 
-        UNION ALL
 
-        SELECT dbid, datname, (record).*
-        FROM statements.statements_history_current_db
-        WHERE agent_address = :agent_address
-        AND agent_port = :agent_port
-        AND tstzrange((record).ts, (record).ts, '[]')
-          <@ tstzrange(:start, :end, '[]')
-    ) h
-""")
+QUERY_STATDATA_INSTANCE = (
+    """
+    SELECT s.datname, d.dbid,
+    """
+    + DELTAS_COLUMNS
+    + """
+    FROM statements.statements_deltas(
+      :agent_address, :agent_port, :start, :end
+    ) AS d
+    JOIN statements.statements AS s
+      ON s.agent_address = :agent_address
+      AND s.agent_port = :agent_port
+      AND s.queryid = d.queryid
+      AND s.dbid = d.dbid
+      AND s.userid = d.userid
+    GROUP BY d.dbid, s.datname
+    HAVING sum(d.calls) > 0
+"""
+)
+
+
+# Statements data endpoints sort, filter and paginate in SQL. Totals of
+# filtered statements are computed with window functions before LIMIT.
+ORDER_COLUMNS = [
+    "query",
+    "datname",
+    "rolname",
+    "calls",
+    "total_exec_time",
+    "mean_time",
+    "shared_blks_read",
+    "shared_blks_hit",
+    "shared_blks_dirtied",
+    "shared_blks_written",
+    "local_blks_read",
+    "local_blks_hit",
+    "local_blks_dirtied",
+    "local_blks_written",
+    "temp_blks_read",
+    "temp_blks_written",
+    "blk_read_time",
+    "blk_write_time",
+]
+# mean_time total is computed from total_exec_time and calls totals.
+TOTALS_COLUMNS = [
+    c for c in ORDER_COLUMNS if c not in ("query", "datname", "rolname", "mean_time")
+]
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+PAGE_QUERY = """
+    SELECT *,
+      count(*) OVER () AS totals_count,
+      {totals}
+    FROM ({query}) AS statements
+    WHERE {filter}
+    ORDER BY {order_by} {order} NULLS LAST, {keys}
+    LIMIT :limit OFFSET :offset
+"""
+
+
+def parse_page(request):
+    # Returns ordering, pagination and filter pattern of statements data
+    # request.
+    get = request.handler.get_argument
+    order_by = get("order_by", default="total_exec_time")
+    if order_by not in ORDER_COLUMNS:
+        raise HTTPError(400, "Unknown order_by column %s." % order_by)
+    order = get("order", default="desc").lower()
+    if order not in ("asc", "desc"):
+        raise HTTPError(400, "order must be asc or desc.")
+    try:
+        limit = int(get("limit", default=DEFAULT_LIMIT))
+        offset = int(get("offset", default=0))
+    except ValueError:
+        raise HTTPError(400, "limit and offset must be integers.")
+    if not 0 < limit <= MAX_LIMIT:
+        raise HTTPError(400, "limit must be between 1 and %d." % MAX_LIMIT)
+    if offset < 0:
+        raise HTTPError(400, "offset must be positive or zero.")
+    filter_ = get("filter", default="")
+    if filter_:
+        filter_ = "%%%s%%" % re.sub(r"([\\%_])", r"\\\1", filter_)
+    return dict(
+        order_by=order_by, order=order, limit=limit, offset=offset, filter=filter_
+    )
+
+
+def fetch_page(session, query, params, page, filter_columns, keys):
+    # Returns a page of statements and totals of all filtered statements.
+    # page comes from parse_page(), which validates ordering.
+    if page["filter"]:
+        filter_ = " OR ".join("%s ILIKE :filter" % c for c in filter_columns)
+    else:
+        filter_ = "true"
+    if page["order_by"] not in filter_columns + TOTALS_COLUMNS + ["mean_time"]:
+        # Sort column not in this mode, like query for databases.
+        page = dict(page, order_by=keys[0])
+    sql = PAGE_QUERY.format(
+        query=query,
+        totals=",\n      ".join(
+            "sum(%s) OVER () AS totals_%s" % (c, c) for c in TOTALS_COLUMNS
+        ),
+        filter=filter_,
+        order_by=page["order_by"],
+        order=page["order"],
+        keys=", ".join(keys),
+    )
+    params = dict(
+        params, filter=page["filter"], limit=page["limit"], offset=page["offset"]
+    )
+    rows = session.execute(text(sql), params).fetchall()
+
+    statements = []
+    totals = dict(count=0)
+    for row in rows:
+        statement = dict(row)
+        for k in list(statement):
+            if k.startswith("totals_"):
+                totals[k[len("totals_") :]] = statement.pop(k)
+        statements.append(statement)
+    # sum() of bigint is numeric.
+    totals = convert_decimal_to_float(totals)
+    if totals.get("calls"):
+        totals["mean_time"] = totals["total_exec_time"] / totals["calls"]
+    else:
+        totals["mean_time"] = 0
+    return statements, totals
 
 
 @blueprint.instance_route(r"/statements/data", json=True)
 def json_data_instance(request):
     start, end = parse_start_end(request)
+    page = parse_page(request)
 
-    base_query = BASE_QUERY_STATDATA
-    diffs = get_diffs_forstatdata()
-    query = (
-        select([column("datname"), column("dbid")] + diffs)
-        .select_from(base_query)
-        .group_by(column("dbid"), column("datname"))
-        .having(func.max(column("calls")) - func.min(column("calls")) > 0)
-    )
-
-    statements = request.db_session.execute(
-        query,
+    statements, totals = fetch_page(
+        request.db_session,
+        QUERY_STATDATA_INSTANCE,
         dict(
             agent_address=request.instance.agent_address,
             agent_port=request.instance.agent_port,
-            start=start,
-            end=end,
+            start=start or None,
+            end=end or None,
         ),
-    ).fetchall()
-    statements = [dict(statement) for statement in statements]
+        page,
+        filter_columns=["datname"],
+        keys=["dbid"],
+    )
 
     metas = request.db_session.execute(
         METAS_QUERY,
@@ -117,272 +243,33 @@ def json_data_instance(request):
         ),
     ).fetchone()
     metas = dict(metas) if metas is not None else None
-    return jsonify(dict(data=statements, metas=metas))
-
-
-BASE_QUERY_STATDATA_DATABASE = """
-WITH first_occurence AS (
-  -- first occurence for each statement
-  SELECT
-    distinct on (queryid, userid)
-    queryid,
-    userid,
-    ts,
-    calls,
-    total_exec_time,
-    shared_blks_read,
-    shared_blks_hit,
-    shared_blks_dirtied,
-    shared_blks_written,
-    local_blks_read,
-    local_blks_hit,
-    local_blks_dirtied,
-    local_blks_written,
-    temp_blks_read,
-    temp_blks_written,
-    blk_read_time,
-    blk_write_time
-  FROM
-    (
-      (
-        SELECT
-          distinct on (queryid, userid)
-          queryid,
-          userid,
-          (record).*
-        FROM
-          (
-            SELECT
-              distinct on (queryid, userid)
-              queryid,
-              userid,
-              unnest(records) AS record
-            FROM
-              statements.statements_history psh
-            WHERE
-              coalesce_range && tstzrange(
-                (:start) :: timestamptz,
-                (:end) :: timestamptz,
-                '[]'
-              )
-              AND agent_address = :agent_address
-              AND agent_port = :agent_port
-              AND dbid = :dbid
-              {queryidfilter}
-            order by
-              queryid,
-              userid,
-              coalesce_range
-          ) AS unnested
-        WHERE
-          tstzrange(
-            (record).ts,
-            (record).ts,
-            '[]'
-          ) <@ tstzrange(
-            (:start) :: timestamptz,
-            (:end) :: timestamptz,
-            '[]'
-          )
-        order by
-          queryid,
-          userid,
-          ts
-      )
-      UNION ALL
-        (
-          SELECT
-            distinct on (queryid, userid)
-            queryid,
-            userid,
-            (record).*
-          FROM
-            statements.statements_history_current
-          WHERE
-            agent_address = :agent_address
-            AND agent_port = :agent_port
-            AND dbid = :dbid
-            AND tstzrange(
-              (record).ts,
-              (record).ts,
-              '[]'
-            ) <@ tstzrange(
-              (:start) :: timestamptz,
-              (:end) :: timestamptz,
-              '[]'
-            )
-            {queryidfilter}
-          order by
-            queryid,
-            userid,
-            ts
-        )
-    ) as h
-  order by
-    queryid,
-    userid,
-    ts
-),
-last_occurence AS (
-  -- last occurence for each statement
-  SELECT
-    distinct on (queryid, userid)
-    queryid,
-    userid,
-    ts,
-    calls,
-    total_exec_time,
-    shared_blks_read,
-    shared_blks_hit,
-    shared_blks_dirtied,
-    shared_blks_written,
-    local_blks_read,
-    local_blks_hit,
-    local_blks_dirtied,
-    local_blks_written,
-    temp_blks_read,
-    temp_blks_written,
-    blk_read_time,
-    blk_write_time
-  FROM
-    (
-      (
-        SELECT
-          distinct on (queryid, userid)
-          queryid,
-          userid,
-          (record).*
-        FROM
-          (
-            SELECT
-              distinct on (queryid, userid)
-              queryid,
-              userid,
-              unnest(records) AS record
-            FROM
-              statements.statements_history psh
-            WHERE
-              coalesce_range && tstzrange(
-                (:start) :: timestamptz,
-                (:end) :: timestamptz,
-                '[]'
-              )
-              AND agent_address = :agent_address
-              AND agent_port = :agent_port
-              AND dbid = :dbid
-              {queryidfilter}
-            order by
-              queryid,
-              userid,
-              coalesce_range desc
-          ) AS unnested
-        WHERE
-          tstzrange(
-            (record).ts,
-            (record).ts,
-            '[]'
-          ) <@ tstzrange(
-            (:start) :: timestamptz,
-            (:end) :: timestamptz,
-            '[]'
-          )
-        order by
-          queryid,
-          userid,
-          ts desc
-      )
-      UNION ALL
-        (
-          SELECT
-            distinct on (queryid, userid)
-            queryid,
-            userid,
-            (record).*
-          FROM
-            statements.statements_history_current
-          WHERE
-            agent_address = :agent_address
-            AND agent_port = :agent_port
-            AND dbid = :dbid
-            AND tstzrange(
-              (record).ts,
-              (record).ts,
-              '[]'
-            ) <@ tstzrange(
-              (:start) :: timestamptz,
-              (:end) :: timestamptz,
-              '[]'
-            )
-            {queryidfilter}
-          order by
-            queryid,
-            userid,
-            ts desc
-        )
-    ) as h
-  order by
-    queryid,
-    userid,
-    ts desc
-)
-SELECT
-  query,
-  statements.queryid::text,
-  rolname,
-  statements.userid::text,
-  (lo.calls - fo.calls) AS calls,
-  (lo.total_exec_time - fo.total_exec_time) AS total_exec_time,
-  (lo.total_exec_time - fo.total_exec_time) /
-    (lo.calls - fo.calls) AS mean_time,
-  (
-    lo.shared_blks_read - fo.shared_blks_read
-  ) AS shared_blks_read,
-  (
-    lo.shared_blks_hit - fo.shared_blks_hit
-  ) AS shared_blks_hit,
-  (
-    lo.shared_blks_dirtied - fo.shared_blks_dirtied
-  ) AS shared_blks_dirtied,
-  (
-    lo.shared_blks_written - fo.shared_blks_written
-  ) AS shared_blks_written,
-  (
-    lo.local_blks_read - fo.local_blks_read
-  ) AS local_blks_read,
-  (
-    lo.local_blks_hit - fo.local_blks_hit
-  ) AS local_blks_hit,
-  (
-    lo.local_blks_dirtied - fo.local_blks_dirtied
-  ) AS local_blks_dirtied,
-  (
-    lo.local_blks_written - fo.local_blks_written
-  ) AS local_blks_written,
-  (
-    lo.temp_blks_read - fo.temp_blks_read
-  ) AS temp_blks_read,
-  (
-    lo.temp_blks_written - fo.temp_blks_written
-  ) AS temp_blks_written,
-  (
-    lo.blk_read_time - fo.blk_read_time
-  ) AS blk_read_time,
-  (
-    lo.blk_write_time - fo.blk_write_time
-  ) AS blk_write_time
-FROM
-  first_occurence AS fo
-  JOIN last_occurence AS lo
-    ON fo.queryid = lo.queryid
-    AND fo.userid = lo.userid
-  JOIN statements.statements
-    ON statements.queryid = fo.queryid
-    AND statements.userid = fo.userid
-  AND agent_address = :agent_address
-  AND agent_port = :agent_port
-  AND dbid = :dbid
-WHERE (lo.calls - fo.calls) > 0;
+    return jsonify(dict(data=statements, totals=totals, metas=metas))
+
+
+QUERY_STATDATA_DATABASE = (
+    """
+    SELECT
+      s.query,
+      d.queryid::text AS queryid,
+      s.rolname,
+      d.userid::text AS userid,
+    """
+    + DELTAS_COLUMNS
+    + """
+    FROM statements.statements_deltas(
+      :agent_address, :agent_port, :start, :end,
+      CAST(:dbid AS oid), CAST(:queryid AS bigint), CAST(:userid AS oid)
+    ) AS d
+    JOIN statements.statements AS s
+      ON s.agent_address = :agent_address
+      AND s.agent_port = :agent_port
+      AND s.queryid = d.queryid
+      AND s.dbid = d.dbid
+      AND s.userid = d.userid
+    GROUP BY d.queryid, d.userid, s.query, s.rolname
+    HAVING sum(d.calls) > 0
 """
+)
 
 
 @blueprint.instance_route(r"/statements/data/([0-9]*)/([-]?[0-9]*)/([0-9]*)", json=True)
@@ -397,6 +284,7 @@ def json_data_database(request, dbid):
 
 def json_data(request, dbid, queryid=None, userid=None):
     start, end = parse_start_end(request)
+    page = parse_page(request)
 
     query = text("""
         SELECT DISTINCT(datname)
@@ -418,40 +306,23 @@ def json_data(request, dbid, queryid=None, userid=None):
         agent_address=request.instance.agent_address,
         agent_port=request.instance.agent_port,
         dbid=dbid,
-        start=start,
-        end=end,
+        queryid=None,
+        userid=None,
+        start=start or None,
+        end=end or None,
     )
-
-    query = BASE_QUERY_STATDATA_DATABASE
-    queryidfilter = ""
     if queryid is not None and userid is not None:
-        queryidfilter = "AND queryid = :queryid AND userid = :userid"
         params.update(dict(queryid=queryid, userid=userid))
-    query = query.format(**dict(queryidfilter=queryidfilter))
 
-    statements = request.db_session.execute(query, params).fetchall()
-    statements = [dict(statement) for statement in statements]
-    return jsonify(dict(datname=datname, data=statements))
-
-
-def get_diffs_forstatdata():
-    return [
-        diff("calls"),
-        diff("total_exec_time").label("total_exec_time"),
-        (old_div(diff("total_exec_time"), diff("calls"))).label("mean_time"),
-        diff("shared_blks_read"),
-        diff("shared_blks_hit"),
-        diff("shared_blks_dirtied"),
-        diff("shared_blks_written"),
-        diff("local_blks_read"),
-        diff("local_blks_hit"),
-        diff("local_blks_dirtied"),
-        diff("local_blks_written"),
-        diff("temp_blks_read"),
-        diff("temp_blks_written"),
-        diff("blk_read_time"),
-        diff("blk_write_time"),
-    ]
+    statements, totals = fetch_page(
+        request.db_session,
+        QUERY_STATDATA_DATABASE,
+        params,
+        page,
+        filter_columns=["query", "rolname"],
+        keys=["queryid", "userid"],
+    )
+    return jsonify(dict(datname=datname, data=statements, totals=totals))
 
 
 BASE_QUERY_STATDATA_SAMPLE_INSTANCE = text("""
@@ -698,15 +569,87 @@ def json_chart_data_instance(request):
     return jsonify(dict(data=data))
 
 
+# Charts of a statement over long ranges use rollups of complete buckets.
+# Raw snapshots are sampled only before first bucket and after last bucket.
+ROLLUP_CHART_MIN_RANGE = timedelta(days=1)
+ROLLUP_CHART_DAILY_RANGE = timedelta(days=14)
+QUERY_STATDATA_ROLLUPS = text("""
+    SELECT
+      extract(epoch FROM bucket) + :seconds AS ts,
+      calls / CAST(:seconds AS float) AS calls,
+      total_exec_time / greatest(calls, 1) AS avg_runtime,
+      total_exec_time / :seconds AS load,
+      (shared_blks_read + local_blks_read + temp_blks_read)
+        / CAST(:seconds AS float) AS total_blks_read,
+      (shared_blks_hit + local_blks_hit) / CAST(:seconds AS float) AS total_blks_hit
+    FROM statements.statements_rollups AS r
+    JOIN statements.metas AS m USING (agent_address, agent_port)
+    WHERE agent_address = :agent_address
+    AND agent_port = :agent_port
+    AND queryid = :queryid
+    AND dbid = :dbid
+    AND userid = :userid
+    AND period = :period
+    AND bucket >= greatest(CAST(:start AS timestamptz), m.rollup_since)
+    AND bucket + :seconds * interval '1 second' <= least(
+      CAST(:end AS timestamptz), m.rollupts
+    )
+    ORDER BY bucket
+""")
+
+
+def rollup_period(start, end):
+    # Returns rollup period and its duration in seconds for a chart range.
+    if end - start > ROLLUP_CHART_DAILY_RANGE:
+        return "day", 86400
+    return "hour", 3600
+
+
+def getstatdata_rollups(request, start, end, dbid, queryid, userid):
+    period, seconds = rollup_period(start, end)
+    rows = request.db_session.execute(
+        QUERY_STATDATA_ROLLUPS,
+        dict(
+            agent_address=request.instance.agent_address,
+            agent_port=request.instance.agent_port,
+            dbid=dbid,
+            queryid=queryid,
+            userid=userid,
+            period=period,
+            seconds=seconds,
+            start=start,
+            end=end,
+        ),
+    ).fetchall()
+    data = [dict(row) for row in rows]
+    if not data:
+        return getstatdata_sample(
+            request, "query", start, end, dbid=dbid, queryid=queryid, userid=userid
+        )
+
+    first = datetime.fromtimestamp(float(data[0]["ts"]) - seconds, timezone.utc)
+    last = datetime.fromtimestamp(float(data[-1]["ts"]), timezone.utc)
+    head = getstatdata_sample(
+        request, "query", start, first, dbid=dbid, queryid=queryid, userid=userid
+    )
+    tail = getstatdata_sample(
+        request, "query", last, end, dbid=dbid, queryid=queryid, userid=userid
+    )
+    return head + data + tail
+
+
 @blueprint.instance_route(
     r"/statements/chart/([0-9]*)/([-]?[0-9]*)/([0-9]*)", json=True
 )
 def json_chart_data_query(request, dbid, queryid, userid):
     start, end = parse_start_end(request)
 
-    data = getstatdata_sample(
-        request, "query", start, end, dbid=dbid, queryid=queryid, userid=userid
-    )
+    if start and end and end - start > ROLLUP_CHART_MIN_RANGE:
+        data = getstatdata_rollups(request, start, end, dbid, queryid, userid)
+    else:
+        data = getstatdata_sample(
+            request, "query", start, end, dbid=dbid, queryid=queryid, userid=userid
+        )
     data = convert_decimal_to_float(data)
     return jsonify(dict(data=data))
 
@@ -733,92 +676,215 @@ def statements(request):
     )
 
 
-def add_statement(session, instance, data):
+def add_statement(session, instance, data, client=None):
     agent_id = f"{instance.agent_address}:{instance.agent_port}"
-    if not data.get("data"):
+    # Agents supporting incremental snapshots send snapshot_seq. An
+    # incremental snapshot without data still carries unchanged statements.
+    if not data.get("data") and "snapshot_seq" not in data:
         logger.info("No statement data from %s.", agent_id)
         return
 
     conn = session.connection().connection
     cur = conn.cursor()
     cur.execute("SET search_path TO statements")
-    for statement in data.get("data"):
-        query = """
-            INSERT INTO statements_src_tmp
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s,
-                    %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        """
+    rows = (
+        format_statement_row(instance, data["snapshot_datetime"], statement)
+        for statement in data["data"]
+    )
+    copy_statements(cur, rows)
+    if "snapshot_seq" in data:
+        fill_query_texts(cur, instance, client)
+        logger.debug(
+            "Processing %s snapshot of %d statements from %s.",
+            "incremental" if data["incremental"] else "full",
+            len(data["data"]),
+            agent_id,
+        )
         cur.execute(
-            query,
+            "SELECT process_statements_snapshot(%s, %s, %s, %s, %s, %s)",
             (
                 instance.agent_address,
                 instance.agent_port,
                 data["snapshot_datetime"],
-                statement["userid"],
-                statement["rolname"],
-                statement["dbid"],
-                statement["datname"],
-                statement["queryid"],
-                statement["query"],
-                statement["calls"],
-                statement["total_exec_time"]
-                if "total_exec_time" in statement
-                else statement["total_time"],
-                statement["rows"],
-                statement["shared_blks_hit"],
-                statement["shared_blks_read"],
-                statement["shared_blks_dirtied"],
-                statement["shared_blks_written"],
-                statement["local_blks_hit"],
-                statement["local_blks_read"],
-                statement["local_blks_dirtied"],
-                statement["local_blks_written"],
-                statement["temp_blks_read"],
-                statement["temp_blks_written"],
-                statement["blk_read_time"],
-                statement["blk_write_time"],
-                statement["total_plan_time"]
-                if "total_plan_time" in statement
-                else None,
-                statement["wal_records"] if "wal_records" in statement else None,
-                statement["wal_fpi"] if "wal_fpi" in statement else None,
-                statement["wal_bytes"] if "wal_bytes" in statement else None,
+                data["snapshot_seq"],
+                data["incremental"],
+                json.dumps(data["removed"]),
             ),
         )
-    query = """SELECT process_statements(%s, %s)"""
-    cur.execute(query, (instance.agent_address, instance.agent_port))
+    else:
+        query = """SELECT process_statements(%s, %s)"""
+        cur.execute(query, (instance.agent_address, instance.agent_port))
     conn.commit()
 
 
+def fill_query_texts(cur, instance, client=None):
+    # Agent omits query text of statements it already sent. Copy them from
+    # statements table, else fetch them from agent.
+    params = dict(agent_address=instance.agent_address, agent_port=instance.agent_port)
+    cur.execute(
+        """
+        UPDATE statements_src_tmp AS s
+        SET query = st.query
+        FROM statements AS st
+        WHERE s.agent_address = %(agent_address)s
+        AND s.agent_port = %(agent_port)s
+        AND s.query IS NULL
+        AND st.agent_address = s.agent_address
+        AND st.agent_port = s.agent_port
+        AND st.queryid = s.queryid
+        AND st.dbid = s.dbid
+        AND st.userid = s.userid
+        """,
+        params,
+    )
+    cur.execute(
+        """
+        SELECT DISTINCT queryid, dbid, userid
+        FROM statements_src_tmp
+        WHERE agent_address = %(agent_address)s
+        AND agent_port = %(agent_port)s
+        AND query IS NULL
+        """,
+        params,
+    )
+    keys = [list(row) for row in cur.fetchall()]
+    if not keys:
+        return
+
+    if client:
+        logger.debug("Fetching %d query texts from agent.", len(keys))
+        response = client.post("/statements/queries", body=dict(keys=keys))
+        response.raise_for_status()
+        cur.execute(
+            """
+            UPDATE statements_src_tmp AS s
+            SET query = t.query
+            FROM json_to_recordset(%(texts)s)
+              AS t(queryid BIGINT, dbid OID, userid OID, query TEXT)
+            WHERE s.agent_address = %(agent_address)s
+            AND s.agent_port = %(agent_port)s
+            AND s.query IS NULL
+            AND (s.queryid, s.dbid, s.userid) = (t.queryid, t.dbid, t.userid)
+            """,
+            dict(params, texts=json.dumps(response.json()["data"])),
+        )
+    # Statement evicted from pg_stat_statements meanwhile.
+    cur.execute(
+        """
+        UPDATE statements_src_tmp
+        SET query = '/* query text unavailable */'
+        WHERE agent_address = %(agent_address)s
+        AND agent_port = %(agent_port)s
+        AND query IS NULL
+        """,
+        params,
+    )
+
+
+# Optional fields, depending on PostgreSQL version of the instance.
+OPTIONAL_FIELDS = ["total_plan_time", "wal_records", "wal_fpi", "wal_bytes"]
+
+
+def format_statement_row(instance, snapshot_datetime, statement):
+    # Returns statements_src_tmp row for a statement from agent.
+    return [
+        instance.agent_address,
+        instance.agent_port,
+        snapshot_datetime,
+        statement["userid"],
+        statement["rolname"],
+        statement["dbid"],
+        statement["datname"],
+        statement["queryid"],
+        statement["query"],
+        statement["calls"],
+        statement["total_exec_time"]
+        if "total_exec_time" in statement
+        else statement["total_time"],
+        statement["rows"],
+        statement["shared_blks_hit"],
+        statement["shared_blks_read"],
+        statement["shared_blks_dirtied"],
+        statement["shared_blks_written"],
+        statement["local_blks_hit"],
+        statement["local_blks_read"],
+        statement["local_blks_dirtied"],
+        statement["local_blks_written"],
+        statement["temp_blks_read"],
+        statement["temp_blks_written"],
+        statement["blk_read_time"],
+        statement["blk_write_time"],
+    ] + [statement.get(field) for field in OPTIONAL_FIELDS]
+
+
+def copy_statements(cur, rows):
+    # Bulk load statements in statements_src_tmp with COPY FROM STDIN. This
+    # spares a round-trip per statement.
+    fo = StringIO()
+    for row in rows:
+        fo.write("\t".join(format_copy_field(v) for v in row))
+        fo.write("\n")
+    fo.seek(0)
+    cur.copy_expert("COPY statements.statements_src_tmp FROM STDIN", fo)
+
+
 @workers.schedule(id="statements_pull_data", redo_interval=60)  # 1m
 @workers.register(pool_size=1)
 def pull_data_worker(app):
-    engine = worker_engine(app.config.repository)
-    session_factory = sessionmaker(bind=engine)
-    Session = scoped_session(session_factory)
-    worker_session = Session()
-    instances = worker_session.query(Instances)
+    # Pull agents concurrently, each in its own thread, ORM session and
+    # transaction. A pull cycle lasts as long as the slowest agent.
+    concurrency = max(1, app.config.statements.pull_concurrency)
+    engine = worker_engine(
+        app.config.repository, pool_size=concurrency, max_overflow=concurrency
+    )
+    try:
+        pull_instances(app, engine, concurrency)
+    finally:
+        # Don't keep connections of concurrent pulls idle between tasks.
+        engine.dispose()
+
+
+def pull_instances(app, engine, concurrency):
+    session = sessionmaker(bind=engine)()
+    try:
+        instances = [
+            (instance.agent_address, instance.agent_port)
+            for instance in session.query(Instances)
+            if "statements" in [plugin.plugin_name for plugin in instance.plugins]
+        ]
+    finally:
+        session.close()
 
     if not instances:
         logger.info("No instances to pull data from.")
         return
 
-    for instance in instances:
-        plugin_names = [plugin.plugin_name for plugin in instance.plugins]
+    start = monotonic()
+    with ThreadPoolExecutor(max_workers=min(concurrency, len(instances))) as executor:
+        futures = {
+            executor.submit(pull_instance, app, engine, address, port): (address, port)
+            for address, port in instances
+        }
+        for future in as_completed(futures):
+            address, port = futures[future]
+            try:
+                future.result()
+            except Exception:
+                logger.exception("Failed to pull data from %s:%s", address, port)
+    logger.info(
+        "Pulled statements from %d instances in %.3fs.",
+        len(instances),
+        monotonic() - start,
+    )
 
-        if "statements" not in plugin_names:
-            logger.debug("Skipping instance %s. Plugin disabled.", instance)
-            continue
 
-        # FIXME should be done in parallel
-        try:
-            pull_data_for_instance(app, worker_session, instance)
-        except Exception:
-            logger.exception(
-                "Failed to pull data from %s:%s",
-                instance.agent_address,
-                instance.agent_port,
-            )
+def pull_instance(app, engine, address, port):
+    session = sessionmaker(bind=engine)()
+    try:
+        instance = get_instance(session, address, port)
+        pull_data_for_instance(app, session, instance)
+    finally:
+        session.close()
 
 
 @workers.register(pool_size=1)
@@ -845,12 +911,18 @@ def pull_data_for_instance(app, session, instance):
     client = TemboardAgentClient.factory(
         app.config, instance.agent_address, instance.agent_port
     )
+    start = monotonic()
     try:
-        response = client.get("/statements")
+        response = client.get(snapshot_path(session, instance))
         response.raise_for_status()
-        add_statement(session, instance, response.json())
-        logger.debug("Successfully pulled statements data for %s.", agent_id)
+        data = response.json()
+        duration = monotonic() - start
+        add_statement(session, instance, data, client)
+        logger.debug(
+            "Successfully pulled statements data for %s in %.3fs.", agent_id, duration
+        )
     except Exception as e:
+        duration = monotonic() - start
         error = "Error while fetching statements from instance: "
         if hasattr(e, "read"):
             error += json.loads(e.read())["error"]
@@ -866,6 +938,7 @@ def pull_data_for_instance(app, session, instance):
 
         # If statements data cannot be retrieved store the error in the
         # statements metas table
+        session.rollback()
         cur = session.connection().connection.cursor()
         cur.execute("SET search_path TO statements")
         query = """
@@ -884,6 +957,35 @@ def pull_data_for_instance(app, session, instance):
         cur.execute(query, (error, instance.agent_address, instance.agent_port))
         session.connection().connection.commit()
 
+    record_pull_duration(session, instance, duration)
+
+
+def snapshot_path(session, instance):
+    # Request statements changed since last snapshot, if any.
+    seq = session.execute(
+        text("""
+            SELECT snapshot_seq
+            FROM statements.metas
+            WHERE agent_address = :agent_address AND agent_port = :agent_port
+        """),
+        dict(agent_address=instance.agent_address, agent_port=instance.agent_port),
+    ).scalar()
+    return "/statements?since=%d" % seq if seq else "/statements"
+
+
+def record_pull_duration(session, instance, duration):
+    # Duration of agent request, excluding snapshot processing.
+    cur = session.connection().connection.cursor()
+    cur.execute(
+        """
+        UPDATE statements.metas
+        SET pull_duration = %s
+        WHERE agent_address = %s AND agent_port = %s;
+        """,
+        (duration, instance.agent_address, instance.agent_port),
+    )
+    session.connection().connection.commit()
+
 
 @workers.schedule(id="statements_purge", redo_interval=24 * 60 * 60)  # 24h
 @workers.register(pool_size=1)
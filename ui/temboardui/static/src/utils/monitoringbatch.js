@@ -0,0 +1,47 @@
+import $ from "jquery";
+
+// Charts loading data in the same tick share a single request to
+// /monitoring/data.ndjson. Requests are grouped by range and points.
+const pending = {};
+
+function fetchMetricData(metric, start, end, points) {
+  const key = [start, end, points].join("|");
+  let batch = pending[key];
+  if (!batch) {
+    batch = pending[key] = { metrics: {}, params: { start: start, end: end, points: points, noerror: 1 } };
+    setTimeout(function () {
+      delete pending[key];
+      sendBatch(batch);
+    }, 0);
+  }
+  if (!batch.metrics[metric]) {
+    batch.metrics[metric] = $.Deferred();
+  }
+  return batch.metrics[metric].promise();
+}
+
+function sendBatch(batch) {
+  const params = $.extend({ metrics: Object.keys(batch.metrics).join(",") }, batch.params);
+  $.ajax({ url: apiUrl + ".ndjson", data: params, dataType: "text" })
+    .done(function (body) {
+      body.split("\n").forEach(function (line) {
+        if (!line) return;
+        const result = JSON.parse(line);
+        const deferred = batch.metrics[result.metric];
+        if (result.error) {
+          // Reject only the chart of this metric.
+          deferred.reject(result.error);
+        } else {
+          deferred.resolve(result.data);
+        }
+      });
+      Object.values(batch.metrics).forEach(function (deferred) {
+        if (deferred.state() === "pending") deferred.reject("No data.");
+      });
+    })
+    .fail(function (xhr) {
+      Object.values(batch.metrics).forEach((deferred) => deferred.reject(xhr));
+    });
+}
+
+export { fetchMetricData };
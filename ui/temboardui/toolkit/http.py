@@ -1,9 +1,12 @@
+import gzip
 import http.client
 import json
 import logging
+import os
 import ssl
+import threading
 from datetime import datetime, timezone
-from time import time
+from time import monotonic, time
 from urllib.error import HTTPError
 
 from .errors import TemboardError
@@ -35,24 +38,142 @@ class TemboardHTTPError(TemboardError):
         return f"<{self.__class__.__name__} {self}>"
 
 
+# SSL contexts by CA file and TLS sessions by CA file, host and port, shared
+# by all clients of the process. Resuming a TLS session spares a full
+# handshake on each connection.
+_ssl_contexts = dict()
+_tls_sessions = dict()
+
+
+def get_ssl_context(ca_cert_file=None):
+    context = _ssl_contexts.get(ca_cert_file)
+    if context is None:
+        context = ssl.create_default_context(cafile=ca_cert_file)
+        if ca_cert_file:
+            context.verify_mode = ssl.CERT_REQUIRED
+        else:
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+        _ssl_contexts[ca_cert_file] = context
+    return context
+
+
+class TLSSessionHTTPSConnection(http.client.HTTPSConnection):
+    # HTTPS connection resuming TLS session of previous connection to the
+    # same server.
+
+    def __init__(self, *a, ca_cert_file=None, **kw):
+        super().__init__(*a, **kw)
+        self.session_key = ca_cert_file, self.host, self.port
+
+    def connect(self):
+        http.client.HTTPConnection.connect(self)
+        self.sock = self._context.wrap_socket(
+            self.sock,
+            server_hostname=self.host,
+            session=_tls_sessions.get(self.session_key),
+        )
+
+    def getresponse(self):
+        response = super().getresponse()
+        # With TLS 1.3, session ticket is received after handshake. Save
+        # session once server has responded.
+        if self.sock:
+            _tls_sessions[self.session_key] = self.sock.session
+        return response
+
+
+class ConnectionPool:
+    # Idle keep-alive connections by scheme, host, port, CA file and timeout,
+    # shared by all clients of the process. A connection is released in pool once its
+    # response is completely read, unless server asked to close it.
+
+    def __init__(self, max_per_host=4, idle_timeout=30):
+        self.max_per_host = max_per_host
+        self.idle_timeout = idle_timeout
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+        self.idle = dict()
+
+    def configure(self, max_per_host, idle_timeout=None):
+        self.max_per_host = max_per_host
+        if idle_timeout is not None:
+            self.idle_timeout = idle_timeout
+        self.clear()
+
+    def acquire(self, key):
+        # Returns most recently released idle connection or None.
+        with self.lock:
+            self._check_pid()
+            conns = self.idle.get(key, [])
+            deadline = monotonic() - self.idle_timeout
+            while conns:
+                conn, released_at = conns.pop()
+                if released_at > deadline:
+                    return conn
+                logger.debug("Closing idle connection to %s:%s.", *key[1:3])
+                conn.close()
+        return None
+
+    def release(self, key, conn):
+        with self.lock:
+            self._check_pid()
+            conns = self.idle.setdefault(key, [])
+            if len(conns) >= self.max_per_host:
+                conn.close()
+            else:
+                conns.append((conn, monotonic()))
+
+    def clear(self):
+        with self.lock:
+            for conns in self.idle.values():
+                for conn, _ in conns:
+                    conn.close()
+            self.idle.clear()
+
+    def _check_pid(self):
+        # Don't share sockets with parent process. Just forget them.
+        pid = os.getpid()
+        if pid != self.pid:
+            self.pid = pid
+            self.idle = dict()
+
+
+pool = ConnectionPool()
+
+
+def configure_pool(max_per_host, idle_timeout=None):
+    pool.configure(max_per_host, idle_timeout)
+
+
+# Errors of a connection closed by server while idle in pool.
+STALE_ERRORS = (BrokenPipeError, ConnectionResetError, http.client.RemoteDisconnected)
+# Methods safe to send again once server may have processed them.
+IDEMPOTENT_METHODS = ("GET", "HEAD")
+
+
 class TemboardClient:
     Error = TemboardHTTPError
 
     log_headers = False
 
     @classmethod
-    def factory(cls, config, host, port, scheme="https"):
+    def factory(cls, config, host, port, scheme="https", timeout=30):
         return cls(
-            host, port, scheme=scheme, ca_cert_file=config.temboard.ssl_ca_cert_file
+            host,
+            port,
+            scheme=scheme,
+            ca_cert_file=config.temboard.ssl_ca_cert_file,
+            timeout=timeout,
         )
 
-    def __init__(self, host, port, ca_cert_file=None, scheme="https"):
+    def __init__(self, host, port, ca_cert_file=None, scheme="https", timeout=30):
         """If ca_cert_file is None, HTTPS connection is unverified."""
         self.scheme = scheme
         self.host = host
         self.port = port
         self.ca_cert_file = ca_cert_file
-        self._ssl_context = None
+        self.timeout = timeout
         self._cookies = set()
 
     def __repr__(self):
@@ -66,14 +187,12 @@ class TemboardClient:
 
     @property
     def ssl_context(self):
-        if self._ssl_context is None:
-            self._ssl_context = ssl.create_default_context(cafile=self.ca_cert_file)
-            if self.ca_cert_file:
-                self._ssl_context.verify_mode = ssl.CERT_REQUIRED
-            else:
-                self._ssl_context.check_hostname = False
-                self._ssl_context.verify_mode = ssl.CERT_NONE
-        return self._ssl_context
+        return get_ssl_context(self.ca_cert_file)
+
+    @property
+    def pool_key(self):
+        # A reused connection keeps socket timeout of the client opening it.
+        return self.scheme, self.host, self.port, self.ca_cert_file, self.timeout
 
     def request(self, method, path, headers=None, body=None):
         hostport = f"{self.host}:{self.port}"
@@ -82,6 +201,8 @@ class TemboardClient:
         logger.debug("Requesting %s %s.", method, fullurl)
 
         headers = headers or {}
+        # TemboardResponse decompresses body transparently.
+        headers.setdefault("Accept-Encoding", "gzip")
         if self._cookies:
             headers.setdefault("Cookie", "\n".join(self._cookies))
 
@@ -94,21 +215,31 @@ class TemboardClient:
         if body is not None:
             body = ensure_bytes(body)
 
-        if "https" == self.scheme:
-            conn = http.client.HTTPSConnection(
-                self.host, self.port, context=self.ssl_context, timeout=30
-            )
-        else:
-            conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
-        conn.response_class = TemboardResponse
-
         if self.log_headers:
             for name, value in sorted(headers.items()):
                 logger.debug(">>> %s: %s", name, value)
 
         start_time = time()
-        conn.request(method, path, body, headers)
-        response = conn.getresponse()
+        conn = pool.acquire(self.pool_key)
+        if conn:
+            sent = False
+            try:
+                conn.request(method, path, body, headers)
+                sent = True
+                response = self._getresponse(conn)
+            except STALE_ERRORS as e:
+                conn.close()
+                # Server may have processed request before closing
+                # connection. Don't send a non-idempotent request twice.
+                if sent and method not in IDEMPOTENT_METHODS:
+                    raise
+                # Server closed idle connection. Retry once on a new one.
+                logger.debug("Reused connection to %s is stale: %s.", hostport, e)
+                conn = None
+        if not conn:
+            conn = self.connect()
+            conn.request(method, path, body, headers)
+            response = self._getresponse(conn)
         duration = time() - start_time
         response.path = path
 
@@ -125,6 +256,29 @@ class TemboardClient:
 
         return response
 
+    def connect(self):
+        if "https" == self.scheme:
+            conn = TLSSessionHTTPSConnection(
+                self.host,
+                self.port,
+                context=self.ssl_context,
+                timeout=self.timeout,
+                ca_cert_file=self.ca_cert_file,
+            )
+        else:
+            conn = http.client.HTTPConnection(
+                self.host, self.port, timeout=self.timeout
+            )
+        conn.response_class = TemboardResponse
+        return conn
+
+    def _getresponse(self, conn):
+        response = conn.getresponse()
+        if not response.will_close:
+            key = self.pool_key
+            response.release = lambda: pool.release(key, conn)
+        return response
+
     def get(self, path, headers=None):
         return self.request("GET", path, headers)
 
@@ -135,6 +289,9 @@ class TemboardClient:
 class TemboardResponse(http.client.HTTPResponse):
     # Extensions to HTTPResponse, inspired by httpx
 
+    # Callback returning keep-alive connection to pool.
+    release = None
+
     def __str__(self):
         return f"{self.status} {self.reason}"
 
@@ -148,6 +305,25 @@ class TemboardResponse(http.client.HTTPResponse):
             "closed" if self.isclosed() else "opened",
         )
 
+    def read(self, amt=None):
+        data = super().read(amt)
+        # Decompress only whole body.
+        if amt is None and "gzip" == self.headers.get("Content-Encoding"):
+            data = gzip.decompress(data)
+        return data
+
+    def close(self):
+        # Don't reuse connection with unread body.
+        self.release = None
+        super().close()
+
+    def _close_conn(self):
+        # Called by HTTPResponse once body is completely read.
+        super()._close_conn()
+        release, self.release = self.release, None
+        if release:
+            release()
+
     def raise_for_status(self):
         if self.status >= 400:
             raise TemboardHTTPError(self)
@@ -530,22 +530,25 @@ class SchedulerService(syncio.Service):
 class WorkerPool:
     trace = False
 
-    def __init__(self, task_queue, event_queue):
+    def __init__(self, task_queue, event_queue, max_tasks_per_child=1):
         self.thread = None
         self.task_queue = task_queue
         self.event_queue = event_queue
         self.workers = {}
+        # Number of tasks a child process executes before exiting. 1 means
+        # forking a new process for each task. 0 means no limit.
+        self.max_tasks_per_child = max_tasks_per_child
         # For service.run()
         self.perf = None
 
     def _abort_job(self, task_id):
         for workername in self.workers:
-            for job in self.workers[workername]["pool"]:
-                if job["id"] == task_id:
+            for child in self.workers[workername]["pool"]:
+                if child["id"] == task_id:
                     logger.debug(
-                        "Process pid=%s is going to be killed" % job["process"]
+                        "Process pid=%s is going to be killed" % child["process"]
                     )
-                    job["process"].terminate()
+                    child["process"].terminate()
                     return True
         return False
 
@@ -611,14 +614,37 @@ class WorkerPool:
                 # If not aborted, task has been queued
                 self._rm_task_worker_queue(t.id)
 
+    def run_child(self, module, function, inbox, out, max_tasks):
+        # Main loop of a child process executing tasks of a single worker.
+        # Reset signal handlers.
+        signal.signal(signal.SIGABRT, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+        ppid = os.getppid()
+        done = 0
+        while not max_tasks or done < max_tasks:
+            try:
+                item = inbox.get(timeout=1)
+            except Empty:
+                if os.getppid() != ppid:
+                    logger.debug("Worker pool exited. Exiting.")
+                    break
+                continue
+
+            if item is None:  # Retire order.
+                break
+
+            _, options = item
+            if not self.exec_worker(module, function, out, **options):
+                break
+            done += 1
+
     def exec_worker(self, module, function, out, *args, **kws):
-        # Function wrapper around worker function
+        # Function wrapper around worker function. Returns False if child
+        # must exit.
+        perf = None
         try:
-            # Reset signal handlers.
-            signal.signal(signal.SIGABRT, signal.SIG_DFL)
-            signal.signal(signal.SIGINT, signal.SIG_DFL)
-            signal.signal(signal.SIGTERM, signal.SIG_DFL)
-
             fun = getattr(sys.modules[module], function)
 
             modfun = f"{module}.{fun.__name__}"
@@ -633,6 +659,7 @@ class WorkerPool:
             out.put(Message(MSG_TYPE_RESP, res))
             logger.debug("Job done. task=%s", modfun)
         except UserError as e:
+            out.put(Message(MSG_TYPE_ERROR, None))
             logger.critical("%s. task=%s", e, modfun)
         except Exception as e:
             e = Exception(f"{type(e)}: {e}")
@@ -640,108 +667,155 @@ class WorkerPool:
             logger.exception("%s. task=%s", e, modfun)
         except KeyboardInterrupt:
             logger.info("Interrupted. task=%s", modfun)
+            return False
         if perf:
             perf.run()
+        return True
+
+    def start_child(self, worker):
+        # Fork a long-lived process executing tasks sent through inbox.
+        inbox = Queue()
+        # Queue used to get worker function return
+        out = Queue()
+        p = Process(
+            target=self.run_child,
+            args=(
+                worker["module"],
+                worker["function"],
+                inbox,
+                out,
+                self.max_tasks_per_child,
+            ),
+        )
+        p.start()
+
+        if self.perf:
+            self.perf["fork"] += 1
+
+        child = {"id": None, "process": p, "inbox": inbox, "out": out, "tasks": 0}
+        worker["pool"].append(child)
+        return child
 
     def start_jobs(self):
         # Execute Tasks
         for name, worker in self.workers.items():
-            while len(self.workers[name]["pool"]) < worker["pool_size"]:
-                try:
-                    t = worker["queue"].pop()
-                    # Queue used to get worker function return
-                    out = Queue()
-                    p = Process(
-                        target=self.exec_worker,
-                        args=(worker["module"], worker["function"], out),
-                        kwargs=t.options,
+            while worker["queue"]:
+                for child in worker["pool"]:
+                    if child["id"] is None and not child.get("retired"):
+                        break
+                else:
+                    if len(worker["pool"]) >= worker["pool_size"]:
+                        break
+                    child = self.start_child(worker)
+
+                t = worker["queue"].pop()
+                child["id"] = t.id
+                child["tasks"] += 1
+                child["inbox"].put((t.id, t.options or {}))
+                if self.max_tasks_per_child == child["tasks"]:
+                    # Child exits after this task. Don't send it more tasks.
+                    child["retired"] = True
+
+                # Update task status
+                self.event_queue.put(
+                    Message(
+                        MSG_TYPE_TASK_STATUS,
+                        {"task_id": t.id, "status": TASK_STATUS_DOING},
                     )
-                    p.start()
-
-                    if self.perf:
-                        self.perf["fork"] += 1
-
-                    self.workers[name]["pool"].append(
-                        {"id": t.id, "process": p, "out": out}
-                    )
-                    # Update task status
-                    self.event_queue.put(
-                        Message(
-                            MSG_TYPE_TASK_STATUS,
-                            {"task_id": t.id, "status": TASK_STATUS_DOING},
-                        )
-                    )
-                except IndexError:
-                    break
+                )
 
     def check_jobs(self):
         # Check jobs process state for each worker
         for name, worker in self.workers.items():
-            for job in worker["pool"]:
-                if not job["process"].is_alive():
-                    # Dead process case
-                    if self.trace:
-                        logger.debug("Job %s terminated.", job["id"])
+            for child in worker["pool"][:]:
+                alive = child["process"].is_alive()
+                if child["id"] is None:
+                    message_out = None
+                else:
                     try:
                         # Fetch the message from job's output queue
-                        message_out = job["out"].get(False)
+                        message_out = child["out"].get(False)
                     except Empty:
                         message_out = None
+
+                if message_out or (child["id"] and not alive):
                     if self.trace:
+                        logger.debug("Job %s terminated.", child["id"])
                         logger.debug("Job output : %s" % message_out)
-                    # Close job's output queue
-                    job["out"].close()
-                    # join the process
-                    job["process"].join()
-
-                    # Let's build the message we'll have to send to scheduler
-                    # for the update of task's status.
-                    task_stop_dt = datetime.utcnow()
-                    if job["process"].exitcode == 0:
-                        if message_out and message_out.type[0] == MSG_TYPE_RESP:
-                            task_status = TASK_STATUS_DONE
-                        else:
-                            # when an exception is raised from the worker
-                            # function
-                            task_status = TASK_STATUS_FAILED
-                    elif job["process"].exitcode < 0:
-                        # process killed
-                        task_status = TASK_STATUS_ABORTED
-                    else:
-                        task_status = TASK_STATUS_FAILED
-                    task_output = None
-                    if message_out:
-                        task_output = message_out.content
-
-                    # Update task status
-                    self.event_queue.put(
-                        Message(
-                            MSG_TYPE_TASK_STATUS,
-                            {
-                                "task_id": job["id"],
-                                "status": task_status,
-                                "output": task_output,
-                                "stop_datetime": task_stop_dt,
-                            },
-                        )
-                    )
-
-                    # Finally, remove the job from the pool
-                    self.workers[name]["pool"].remove(job)
+                    self.end_job(child, message_out)
+
+                if not alive:
+                    self.stop_child(child)
+                    # Finally, remove the child from the pool
+                    worker["pool"].remove(child)
+                elif child.get("retired") and child["id"] is None:
+                    # Child is about to exit. Let start_jobs spawn a new
+                    # one.
+                    child["process"].join()
+                    self.stop_child(child)
+                    worker["pool"].remove(child)
+
+    def end_job(self, child, message_out):
+        # Let's build the message we'll have to send to scheduler for the
+        # update of task's status.
+        task_stop_dt = datetime.utcnow()
+        if message_out:
+            if message_out.type[0] == MSG_TYPE_RESP:
+                task_status = TASK_STATUS_DONE
+            else:
+                # when an exception is raised from the worker function
+                task_status = TASK_STATUS_FAILED
+        elif child["process"].exitcode is not None and child["process"].exitcode < 0:
+            # process killed
+            task_status = TASK_STATUS_ABORTED
+        else:
+            task_status = TASK_STATUS_FAILED
+        task_output = None
+        if message_out:
+            task_output = message_out.content
+
+        # Update task status
+        self.event_queue.put(
+            Message(
+                MSG_TYPE_TASK_STATUS,
+                {
+                    "task_id": child["id"],
+                    "status": task_status,
+                    "output": task_output,
+                    "stop_datetime": task_stop_dt,
+                },
+            )
+        )
+        child["id"] = None
+
+    def stop_child(self, child):
+        # Close child's queues
+        child["inbox"].close()
+        child["out"].close()
+        # join the process
+        child["process"].join()
+
+    def retire_children(self):
+        # Ask idle children to exit, e.g. to load new configuration. Busy
+        # children exit after their current task.
+        for worker in self.workers.values():
+            for child in worker["pool"]:
+                if child.get("retired"):
+                    continue
+                child["retired"] = True
+                child["inbox"].put(None)
 
     def abort_jobs(self):
-        # abort all running jobs
+        # abort all running jobs and stop idle children.
         for name, worker in self.workers.items():
-            for job in worker["pool"]:
-                process = job.get("process")
+            for child in worker["pool"][:]:
+                process = child.get("process")
                 if process.is_alive():
                     process.terminate()
-                    logger.debug("Job %s has been terminated" % job["id"])
-                    # Close job's output queue
-                    job["out"].close()
-                    # join the process
-                    process.join()
-                    self.workers[name]["pool"].remove(job)
+                    if child["id"]:
+                        logger.debug("Job %s has been terminated" % child["id"])
+                self.stop_child(child)
+                self.workers[name]["pool"].remove(child)
 
 
 class WorkerSet(list):
@@ -811,7 +885,11 @@ class WorkerPoolService(syncio.Service):
 
     # interface for toolkit.app
     def apply_config(self):
-        pass
+        # Only UI defines worker_max_tasks. Agent forks a process per task.
+        max_tasks = self.app.config.temboard.get("worker_max_tasks", 1)
+        self.worker_pool.max_tasks_per_child = max_tasks
+        # Ensure children execute tasks with up to date configuration.
+        self.worker_pool.retire_children()
 
     def create_task_function_app_wrapper(self, function):
         @functools.wraps(function)
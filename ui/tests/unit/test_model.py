@@ -54,3 +54,50 @@ def test_configure(mocker):
 
     configure(dsn="sqlite://")  # LOL
     assert Session.configure.called is True
+
+
+def test_instrumented_pool(caplog):
+    from sqlalchemy import create_engine
+    from temboardui.model.pool import InstrumentedQueuePool
+
+    engine = create_engine(
+        "sqlite://", poolclass=InstrumentedQueuePool, pool_size=1, pool_pre_ping=True
+    )
+    stats = engine.pool.stats
+    for _ in range(3):
+        with engine.connect() as conn:
+            conn.execute("SELECT 1")
+
+    assert 1 == stats.connects
+    assert 3 == stats.checkouts
+
+    stats.interval = 0
+    with caplog.at_level("DEBUG", logger="temboardui.model.pool"):
+        engine.connect().close()
+    assert "pool_connects_per_minute=" in caplog.text
+    assert 0 == stats.checkouts
+
+    stats.interval = 60
+    engine.dispose()
+    assert engine.pool.stats is stats
+    engine.connect().close()
+    assert 1 == stats.connects
+
+
+def test_worker_engine_pool(mocker):
+    create_engine = mocker.patch("temboardui.model.create_engine")
+    from temboardui.model import worker_engine
+
+    dbconf = dict(
+        host="/tmp", port=5432, user="temboard", password="x", dbname="temboard"
+    )
+    engine = worker_engine(dbconf)
+    # Workers keep a single idle connection between tasks.
+    assert 1 == create_engine.call_args.kwargs["pool_size"]
+    assert 10 == create_engine.call_args.kwargs["max_overflow"]
+    assert engine is worker_engine(dbconf)
+    assert 1 == create_engine.call_count
+
+    worker_engine(dbconf, pool_size=8, max_overflow=8)
+    assert 8 == create_engine.call_args.kwargs["pool_size"]
+    assert 2 == create_engine.call_count
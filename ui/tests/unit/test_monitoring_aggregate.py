@@ -0,0 +1,141 @@
+# Tests archiving and aggregation against a repository. Set
+# TEMBOARD_REPOSITORY_DSN to a development repository to run them. Tests
+# archive all instances.
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.sql import text
+
+DSN = os.environ.get("TEMBOARD_REPOSITORY_DSN")
+pytestmark = pytest.mark.skipif(not DSN, reason="TEMBOARD_REPOSITORY_DSN not set.")
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine(DSN)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def instance_id(engine):
+    with engine.begin() as conn:
+        host_id = conn.execute(
+            "INSERT INTO monitoring.hosts (hostname, os, os_version)"
+            " VALUES ('test-aggregate.invalid', 'Linux', '6.1') RETURNING host_id"
+        ).scalar()
+        instance_id = conn.execute(
+            text(
+                "INSERT INTO monitoring.instances"
+                " (host_id, port, local_name, version, version_num, data_directory)"
+                " VALUES (:host_id, 5432, 'main', '16.2', 160002, '/var/lib/pgsql')"
+                " RETURNING instance_id"
+            ),
+            host_id=host_id,
+        ).scalar()
+
+    yield instance_id
+
+    with engine.begin() as conn:
+        # Aggregate tables have no foreign key.
+        for period in ("30m", "6h"):
+            conn.execute(
+                text(
+                    "DELETE FROM monitoring.metric_xacts_%s_current"
+                    " WHERE instance_id = :instance_id" % period
+                ),
+                instance_id=instance_id,
+            )
+        # Cascades to metrics.
+        conn.execute(
+            text("DELETE FROM monitoring.instances WHERE instance_id = :instance_id"),
+            instance_id=instance_id,
+        )
+        conn.execute(
+            text("DELETE FROM monitoring.hosts WHERE host_id = :host_id"),
+            host_id=host_id,
+        )
+        conn.execute(
+            "DELETE FROM monitoring.metric_watermarks WHERE name = 'metric_xacts'"
+        )
+
+
+def test_aggregate_archive_between_bounds_and_chunks(engine, instance_id, mocker):
+    from temboardui.plugins.monitoring import (
+        aggregate_chunk,
+        aggregate_metric,
+        archive_metric,
+    )
+
+    with engine.begin() as conn:
+        config = conn.execute(
+            "SELECT monitoring.metric_tables_config()->'metric_xacts'"
+        ).scalar()
+        # An hour of points a day ago, in _current table only.
+        conn.execute(
+            text(
+                "INSERT INTO monitoring.metric_xacts_current"
+                " SELECT date_trunc('hour', NOW() - INTERVAL '1 day') + i * INTERVAL '1 minute',"
+                "  :instance_id, 'postgres', ROW(NULL, '1 minute', i, 0)::monitoring.metric_xacts_record"
+                " FROM generate_series(0, 59) AS i"
+            ),
+            instance_id=instance_id,
+        )
+        # Nothing archived since watermark, bounds tell to read only _current.
+        conn.execute(
+            "INSERT INTO monitoring.metric_watermarks (name, kind, datetime)"
+            " SELECT 'metric_xacts', kind, date_trunc('hour', NOW() - INTERVAL '1 day') - d"
+            " FROM (VALUES ('30m', INTERVAL '0'), ('archive', INTERVAL '1 hour')) AS w(kind, d)"
+            " ON CONFLICT (name, kind) DO UPDATE SET datetime = EXCLUDED.datetime"
+        )
+
+    def archive_then_aggregate(*a):
+        # Archive commits after bounds, before chunk reads.
+        with engine.connect() as conn:
+            archive_metric(conn, "metric_xacts", datetime.now(timezone.utc))
+        return aggregate_chunk(*a)
+
+    mocker.patch(
+        "temboardui.plugins.monitoring.aggregate_chunk",
+        side_effect=archive_then_aggregate,
+    )
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        buckets, rows = aggregate_metric(
+            engine, executor, config, "30m", [[instance_id]]
+        )
+
+    assert (2, 60) == (buckets, rows)
+
+
+def test_archive_metric_owner_days(engine, instance_id):
+    from temboardui.plugins.monitoring import archive_metric
+
+    with engine.begin() as conn:
+        # An hour of points of two databases, more than a batch.
+        conn.execute(
+            text(
+                "INSERT INTO monitoring.metric_xacts_current"
+                " SELECT date_trunc('hour', NOW() - INTERVAL '1 day') + i * INTERVAL '1 minute',"
+                "  :instance_id, dbname, ROW(NULL, '1 minute', i, 0)::monitoring.metric_xacts_record"
+                " FROM generate_series(0, 59) AS i, unnest(ARRAY['postgres', 'app']) AS dbname"
+            ),
+            instance_id=instance_id,
+        )
+
+    with engine.connect() as conn:
+        archive_metric(conn, "metric_xacts", datetime.now(timezone.utc), batch=10)
+
+    with engine.connect() as conn:
+        res = conn.execute(
+            text(
+                "SELECT dbname, cardinality(n_commit)"
+                " FROM monitoring.metric_xacts_columnar_history"
+                " WHERE instance_id = :instance_id ORDER BY 1"
+            ),
+            instance_id=instance_id,
+        )
+        assert [("app", 60), ("postgres", 60)] == res.fetchall()
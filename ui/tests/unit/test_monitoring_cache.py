@@ -0,0 +1,62 @@
+from datetime import datetime, timezone
+
+
+def test_lru_cache(mocker):
+    from temboardui.plugins.monitoring.cache import LRUCache
+
+    monotonic = mocker.patch(
+        "temboardui.plugins.monitoring.cache.monotonic", return_value=0
+    )
+    cache = LRUCache(size=2)
+    assert cache.get("a") is None
+    cache.set("a", "A", ttl=10)
+    cache.set("b", "B", ttl=20)
+    assert "A" == cache.get("a")
+    # b is the least recently used.
+    cache.set("c", "C", ttl=10)
+    assert cache.get("b") is None
+    assert (1, 2) == (cache.hits, cache.misses)
+
+    monotonic.return_value = 11
+    assert cache.get("a") is None
+    assert ["c"] == list(cache.entries)
+
+
+def test_lru_cache_size():
+    from temboardui.plugins.monitoring.cache import LRUCache
+
+    cache = LRUCache(size=10)
+    cache.set("a", "AAAA", ttl=10)
+    cache.set("b", "BBBB", ttl=10)
+    cache.set("a", "AA", ttl=10)
+    assert 6 == cache.length
+    # Evicts b, then a.
+    cache.set("c", "C" * 9, ttl=10)
+    assert ["c"] == list(cache.entries)
+    assert 9 == cache.length
+    # Larger than cache.
+    cache.set("d", "D" * 11, ttl=10)
+    assert ["c"] == list(cache.entries)
+
+
+def test_align_range():
+    from temboardui.plugins.monitoring.cache import HISTORY_TTL, LRUCache
+
+    cache = LRUCache(ttl=30)
+    now = datetime(2024, 1, 2, 12, 10, 30, tzinfo=timezone.utc)
+    start = datetime(2024, 1, 1, 12, 10, 30, tzinfo=timezone.utc)
+
+    start_, end, ttl = cache.align_range(start, None, 1800, now=now)
+    assert datetime(2024, 1, 1, 12, 0, tzinfo=timezone.utc) == start_
+    assert datetime(2024, 1, 2, 12, 30, tzinfo=timezone.utc) == end
+    assert 30 == ttl
+
+    end = datetime(2024, 1, 2, 0, 0, tzinfo=timezone.utc)
+    _, end_, ttl = cache.align_range(start, end, 1800, now=now)
+    assert end == end_
+    assert HISTORY_TTL == ttl
+
+    # Before backfill horizon, late metrics may still be aggregated.
+    end = datetime(2024, 1, 2, 8, 0, tzinfo=timezone.utc)
+    _, _, ttl = cache.align_range(start, end, 1800, now=now)
+    assert 30 == ttl
@@ -0,0 +1,103 @@
+import json
+
+import pytest
+
+
+def test_generate_metrics_data_ndjson(mocker):
+    from temboardui.plugins.monitoring.chartdata import generate_metrics_data_ndjson
+
+    cached = mocker.patch(
+        "temboardui.plugins.monitoring.chartdata.cached_metric_data_csv",
+        autospec=True,
+        return_value="date,tps\n",
+    )
+    unavailability = mocker.patch(
+        "temboardui.plugins.monitoring.chartdata.copy_unavailability_csv",
+        autospec=True,
+        return_value="2023-01-01\n",
+    )
+    session = mocker.Mock(name="session")
+    cur = session.connection.return_value.connection.cursor.return_value
+
+    lines = list(
+        generate_metrics_data_ndjson(
+            session,
+            ["tps", "unavailability", "pouet"],
+            "start",
+            "end",
+            host_id=1,
+            instance_id=2,
+            points=100,
+        )
+    )
+
+    assert all(line.endswith("\n") for line in lines)
+    assert [
+        dict(metric="tps", data="date,tps\n"),
+        dict(metric="unavailability", data="2023-01-01\n"),
+        dict(metric="pouet", error="Metric 'pouet' not found"),
+    ] == [json.loads(line) for line in lines]
+    cached.assert_called_once_with(cur, "tps", "start", "end", 1, 2, points=100)
+    unavailability.assert_called_once_with(cur, "start", "end", 2)
+    # A single cursor for all metrics.
+    assert 1 == session.connection.return_value.connection.cursor.call_count
+    assert cur.close.called
+
+
+def test_parse_points(mocker):
+    from temboardui.plugins.monitoring.tools import parse_points
+    from temboardui.web.tornado import HTTPError
+
+    def make_request(**args):
+        request = mocker.Mock()
+        request.handler.get_argument.side_effect = lambda k, default: args.get(
+            k, default
+        )
+        return request
+
+    assert parse_points(make_request()) is None
+    assert 800 == parse_points(make_request(points="800"))
+    assert 2 == parse_points(make_request(points="2"))
+
+    for points in ("1", "-5", "pouet", ""):
+        with pytest.raises(HTTPError):
+            parse_points(make_request(points=points))
+
+
+def test_copy_metric_data_csv_attributes(mocker):
+    from temboardui.plugins.monitoring.chartdata import METRICS, copy_metric_data_csv
+
+    cur = mocker.Mock(name="cursor")
+    cur.mogrify.return_value = b"SELECT 1"
+    copy_metric_data_csv(cur, "blocks", "start", "end", None, 2, level=0)
+
+    sql, params = cur.mogrify.call_args[0]
+    assert sql == METRICS["blocks"]["sql_nozoom"]
+    assert ["blks_hit", "blks_read", "measure_interval"] == params["attributes"]
+    assert cur.copy_expert.called
+
+    # Every expand call reads only attributes of the chart.
+    for name, metric in METRICS.items():
+        sql = metric["sql_nozoom"]
+        assert sql.count("FROM expand_") == sql.count("%(attributes)s)"), name
+
+
+def test_copy_metric_data_csv_pivot(mocker):
+    from temboardui.plugins.monitoring.chartdata import copy_metric_data_csv
+
+    cur = mocker.Mock(name="cursor")
+    cur.mogrify.return_value = b"SELECT 1"
+    cur.copy_expert.side_effect = lambda sql, fo: fo.write(
+        "date,dbname,size\n"
+        + "".join("%d,db%d,%d\n" % (i // 2, i % 2, i) for i in range(8))
+        + '4,"db,2",9\n'
+    )
+
+    data = copy_metric_data_csv(cur, "db_size", "start", "end", None, 2, level=0)
+    assert 'date,db0,db1,"db,2"\n0,0,1,\n1,2,3,\n' == data[:34]
+    assert data.endswith("4,,,9\n")
+
+    data = copy_metric_data_csv(
+        cur, "db_size", "start", "end", None, 2, level=0, points=2
+    )
+    assert 'date,db0,db1,"db,2"\n0,0,1,9\n4,6,7,9\n' == data
@@ -0,0 +1,88 @@
+def test_format_metric_row():
+    from temboardui.plugins.monitoring.model.db import format_metric_row
+
+    point = dict(
+        datetime="2023-01-01 00:00:00 +0000",
+        dbname="postgres",
+        measure_interval=60.0,
+        n_commit=10,
+        n_rollback=0,
+    )
+    row = format_metric_row("xacts", 1, point)
+    assert row == ["2023-01-01 00:00:00 +0000", 1, "postgres", (None, "60.0", 10, 0)]
+
+    row = format_metric_row("replication_lag", 2, dict(datetime="dt", lag=0))
+    assert row == ["dt", 2, (None, 0)]
+
+
+def test_format_copy_field():
+    from temboardui.plugins.monitoring.model.db import format_copy_field
+
+    assert "\\N" == format_copy_field(None)
+    assert "1" == format_copy_field(1)
+    assert "tab\\there" == format_copy_field("tab\there")
+    assert '(,t,1.5,"a b","q\\\\"u",)' == format_copy_field(
+        (None, True, 1.5, "a b", 'q"u', None)
+    )
+    assert '(,"")' == format_copy_field((None, ""))
+
+
+def test_insert_metrics_marks_backfill(mocker):
+    from temboardui.plugins.monitoring.tools import insert_metrics
+
+    copy_metric = mocker.patch(
+        "temboardui.plugins.monitoring.tools.db.copy_metric", autospec=True
+    )
+    mark_backfill = mocker.patch(
+        "temboardui.plugins.monitoring.tools.db.mark_backfill", autospec=True
+    )
+    session = mocker.Mock(name="session")
+    points = [
+        dict(datetime="2023-01-01 00:01:00 +0000", lag=0),
+        dict(datetime="2023-01-01 00:00:00 +0000", lag=1),
+    ]
+    insert_metrics(session, 1, 2, dict(replication_lag=points, xacts=[]))
+
+    assert copy_metric.called
+    mark_backfill.assert_called_once_with(
+        session, dict(replication_lag="2023-01-01 00:00:00 +0000")
+    )
+    assert session.commit.called
+
+
+def test_aggregate_metric_restores_backfill(mocker):
+    from concurrent.futures import ThreadPoolExecutor
+    from datetime import datetime, timezone
+
+    import pytest
+    from temboardui.plugins.monitoring import aggregate_metric
+
+    lower = datetime(2023, 1, 1, tzinfo=timezone.utc)
+    upper = datetime(2023, 1, 2, tzinfo=timezone.utc)
+    aggregate_chunk = mocker.patch(
+        "temboardui.plugins.monitoring.aggregate_chunk", autospec=True
+    )
+    engine = mocker.MagicMock(name="engine")
+    conn = engine.begin.return_value.__enter__.return_value
+    conn.execute.return_value.fetchone.return_value = (lower, upper, False)
+    config = dict(name="xacts")
+
+    aggregate_chunk.return_value = (2, 10)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        assert (4, 20) == aggregate_metric(engine, executor, config, "30m", [[1], [2]])
+    # Bounds, then watermark.
+    assert 2 == conn.execute.call_count
+    assert (
+        dict(name="xacts", period="30m", upper=upper) == (conn.execute.call_args[0][1])
+    )
+
+    conn.execute.reset_mock()
+    aggregate_chunk.side_effect = Exception("Pouet")
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        with pytest.raises(Exception, match="Pouet"):
+            aggregate_metric(engine, executor, config, "30m", [[1], [2]])
+    # Bounds, then backfill mark restored from lower bound.
+    assert 2 == conn.execute.call_count
+    sql, params = conn.execute.call_args[0]
+    assert "backfill_" in str(sql)
+    assert dict(name="xacts", period="30m", lower=lower) == params
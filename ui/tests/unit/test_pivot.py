@@ -1,4 +1,5 @@
 from io import StringIO
+from itertools import islice
 
 
 def test_pivot():
@@ -9,3 +10,37 @@ def test_pivot():
     out_ = StringIO()
     pivot_timeserie(in_, index="i", key="k", value="v", output=out_)
     assert out_.getvalue() == expected
+
+
+def test_downsample():
+    from temboardui.plugins.monitoring.pivot import downsample_timeserie
+
+    in_ = StringIO("i,a,b\n1,1,\n2,9,\n3,5,4\n4,0,2\n5,3,3\n6,4,\n7,2,8\n")
+    out_ = StringIO()
+    downsample_timeserie(in_, points=4, output=out_)
+    # Two buckets of 4 and 3 rows. Series keep min and max in time order.
+    assert out_.getvalue() == "i,a,b\n1,9,4\n4,0,2\n5,4,3\n7,2,8\n"
+
+    out_ = StringIO()
+    downsample_timeserie(in_, points=10, output=out_)
+    assert out_.getvalue() == in_.getvalue()
+
+
+def test_pivot_lines():
+    from temboardui.plugins.monitoring.pivot import drain, pivot_lines
+
+    rows = [
+        ["i", "k", "v"],
+        ["1", "a", "1"],
+        ["2", "b,c", "2"],
+        ["2", "a", "3"],
+        ["3", "a", 'x,"y"'],
+    ]
+    lines = pivot_lines(iter(rows), index="i", key="k", value="v")
+    # Line formatted before b,c key is padded. Values are quoted like keys.
+    assert ['i,a,"b,c"\n', "1,1,\n", "2,3,2\n", '3,"x,""y""",\n'] == list(lines)
+    assert 4 == len(lines)
+    assert ['i,a,"b,c"\n'] == list(islice(drain(lines), 1))
+    assert 3 == len(lines)
+
+    assert [] == list(pivot_lines(iter([]), index="i", key="k", value="v"))
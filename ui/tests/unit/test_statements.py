@@ -0,0 +1,256 @@
+import pytest
+
+
+def test_copy_statements():
+    from temboardui.plugins.statements import copy_statements, format_statement_row
+
+    class Instance:
+        agent_address = "0.0.0.0"
+        agent_port = 2345
+
+    statement = dict(
+        userid=10,
+        rolname="postgres",
+        dbid=5,
+        datname="postgres",
+        queryid=-42,
+        query="SELECT 1\n\tFROM t",
+        calls=3,
+        total_time=1.5,
+        rows=3,
+        shared_blks_hit=1,
+        shared_blks_read=0,
+        shared_blks_dirtied=0,
+        shared_blks_written=0,
+        local_blks_hit=0,
+        local_blks_read=0,
+        local_blks_dirtied=0,
+        local_blks_written=0,
+        temp_blks_read=0,
+        temp_blks_written=0,
+        blk_read_time=0.0,
+        blk_write_time=0.0,
+        wal_bytes="1024",
+    )
+    row = format_statement_row(Instance, "2023-01-01T00:00:00Z", statement)
+    assert 28 == len(row)
+    assert 1.5 == row[10]
+    assert [None, None, None, "1024"] == row[-4:]
+
+    class Cursor:
+        def copy_expert(self, sql, fo):
+            self.sql = sql
+            self.data = fo.read()
+
+    cur = Cursor()
+    copy_statements(cur, [row])
+    assert "COPY statements.statements_src_tmp FROM STDIN" == cur.sql
+    fields = cur.data.split("\t")
+    assert 28 == len(fields)
+    assert "SELECT 1\\n\\tFROM t" == fields[8]
+    assert ["\\N", "\\N", "\\N", "1024\n"] == fields[-4:]
+
+
+def test_parse_page(mocker):
+    from temboardui.plugins.statements import parse_page
+    from temboardui.web.tornado import HTTPError
+
+    def make_request(**args):
+        request = mocker.Mock()
+        request.handler.get_argument.side_effect = lambda k, default: args.get(
+            k, default
+        )
+        return request
+
+    page = parse_page(make_request())
+    assert "total_exec_time" == page["order_by"]
+    assert "desc" == page["order"]
+    assert 100 == page["limit"]
+    assert 0 == page["offset"]
+    assert "" == page["filter"]
+
+    page = parse_page(
+        make_request(
+            order_by="calls", order="ASC", limit="20", offset="40", filter="50%_"
+        )
+    )
+    assert "calls" == page["order_by"]
+    assert "asc" == page["order"]
+    assert 20 == page["limit"]
+    assert 40 == page["offset"]
+    assert "%50\\%\\_%" == page["filter"]
+
+    for args, message in (
+        (dict(order_by="calls; DROP TABLE statements"), "Unknown order_by"),
+        (dict(order="sideways"), "order must"),
+        (dict(limit="all"), "limit and offset"),
+        (dict(limit="0"), "limit must"),
+        (dict(limit="100000"), "limit must"),
+        (dict(offset="-1"), "offset must"),
+    ):
+        with pytest.raises(HTTPError) as ei:
+            parse_page(make_request(**args))
+        assert 400 == ei.value.status_code
+        assert ei.value.log_message.startswith(message)
+
+
+def test_fetch_page():
+    from decimal import Decimal
+
+    from temboardui.plugins.statements import fetch_page
+
+    class Session:
+        def execute(self, query, params):
+            self.sql = str(query)
+            self.params = params
+            return self
+
+        def fetchall(self):
+            return [
+                dict(
+                    datname="db%d" % i,
+                    dbid=i,
+                    calls=10,
+                    total_exec_time=1.0,
+                    totals_count=2,
+                    totals_calls=Decimal(20),
+                    totals_total_exec_time=2.0,
+                )
+                for i in range(2)
+            ]
+
+    session = Session()
+    page = dict(order_by="query", order="asc", limit=20, offset=0, filter="%db%")
+    statements, totals = fetch_page(
+        session, "SELECT 1", dict(), page, filter_columns=["datname"], keys=["dbid"]
+    )
+    assert "datname ILIKE :filter" in session.sql
+    # query is not a column of databases.
+    assert "ORDER BY dbid asc NULLS LAST, dbid" in session.sql
+    assert 20 == session.params["limit"]
+    assert 2 == len(statements)
+    assert "totals_calls" not in statements[0]
+    assert 2 == totals["count"]
+    assert 20.0 == totals["calls"]
+    assert 0.1 == totals["mean_time"]
+
+
+def test_pull_data_worker_isolates_failures(mocker):
+    from temboardui.plugins.statements import pull_data_worker
+
+    engine = mocker.patch("temboardui.plugins.statements.worker_engine")
+    sessionmaker = mocker.patch("temboardui.plugins.statements.sessionmaker")
+    plugin = mocker.Mock(plugin_name="statements")
+    instances = [
+        mocker.Mock(agent_address="0.0.0.%d" % i, agent_port=2345, plugins=[plugin])
+        for i in range(4)
+    ]
+    instances.append(mocker.Mock(agent_address="nostatements", plugins=[]))
+    sessionmaker.return_value.return_value.query.return_value = instances
+
+    def pull(app, engine, address, port):
+        if "0.0.0.1" == address:
+            raise Exception("Pouet")
+
+    pull_instance = mocker.patch(
+        "temboardui.plugins.statements.pull_instance", side_effect=pull
+    )
+    app = mocker.Mock()
+    # Invalid concurrency is clamped.
+    app.config.statements.pull_concurrency = 0
+
+    pull_data_worker(app)
+
+    engine.assert_called_once_with(app.config.repository, pool_size=1, max_overflow=1)
+    pulled = sorted(c.args[2] for c in pull_instance.call_args_list)
+    assert ["0.0.0.0", "0.0.0.1", "0.0.0.2", "0.0.0.3"] == pulled
+
+
+def test_pull_data_for_instance_records_duration_on_error(mocker):
+    from temboardui.plugins.statements import pull_data_for_instance
+
+    client = mocker.patch("temboardui.plugins.statements.TemboardAgentClient")
+    client.factory.return_value.Error = Exception
+    client.factory.return_value.get.side_effect = OSError("Connection refused")
+    record = mocker.patch("temboardui.plugins.statements.record_pull_duration")
+    instance = mocker.Mock(agent_address="0.0.0.0", agent_port=2345)
+    session = mocker.Mock()
+    # No previous snapshot.
+    session.execute.return_value.scalar.return_value = None
+
+    pull_data_for_instance(mocker.Mock(), session, instance)
+
+    # Error is stored in metas after rollback of pending snapshot.
+    session.rollback.assert_called_once_with()
+    cur = session.connection.return_value.connection.cursor.return_value
+    error = cur.execute.call_args_list[-1].args[1][0]
+    assert "Connection refused" in error
+    assert record.call_args.args[:2] == (session, instance)
+    assert record.call_args.args[2] >= 0
+
+
+def test_rollup_period():
+    from datetime import datetime, timedelta
+
+    from temboardui.plugins.statements import rollup_period
+
+    end = datetime(2024, 1, 31)
+    assert ("hour", 3600) == rollup_period(end - timedelta(days=2), end)
+    assert ("hour", 3600) == rollup_period(end - timedelta(days=14), end)
+    assert ("day", 86400) == rollup_period(end - timedelta(days=15), end)
+
+
+def test_getstatdata_rollups(mocker):
+    from datetime import datetime, timedelta, timezone
+
+    from temboardui.plugins.statements import getstatdata_rollups
+
+    start = datetime(2024, 1, 1, 10, 30, tzinfo=timezone.utc)
+    end = start + timedelta(days=2)
+    # Hourly buckets from 11:00 to 13:00, ts is end of bucket.
+    first = datetime(2024, 1, 1, 11, tzinfo=timezone.utc).timestamp()
+    buckets = [dict(ts=first + 3600 * (i + 1), calls=1.0) for i in range(2)]
+    request = mocker.Mock()
+    request.db_session.execute.return_value.fetchall.return_value = buckets
+
+    sample = mocker.patch(
+        "temboardui.plugins.statements.getstatdata_sample",
+        side_effect=lambda r, mode, s, e, **kw: [dict(ts=s.timestamp(), edge=True)],
+    )
+
+    data = getstatdata_rollups(request, start, end, "5", "-42", "10")
+
+    params = request.db_session.execute.call_args.args[1]
+    assert "hour" == params["period"]
+    assert 3600 == params["seconds"]
+    # Raw snapshots are sampled before first bucket and after last one.
+    assert 2 == sample.call_count
+    head, tail = sample.call_args_list
+    assert (start, datetime(2024, 1, 1, 11, tzinfo=timezone.utc)) == head.args[2:4]
+    assert (datetime(2024, 1, 1, 13, tzinfo=timezone.utc), end) == tail.args[2:4]
+    assert "query" == head.args[1]
+    assert dict(dbid="5", queryid="-42", userid="10") == head.kwargs
+    assert [True, None, None, True] == [d.get("edge") for d in data]
+    assert sorted(d["ts"] for d in data) == [d["ts"] for d in data]
+
+
+def test_getstatdata_rollups_without_buckets(mocker):
+    from datetime import datetime, timedelta, timezone
+
+    from temboardui.plugins.statements import getstatdata_rollups
+
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    end = start + timedelta(days=30)
+    request = mocker.Mock()
+    request.db_session.execute.return_value.fetchall.return_value = []
+    sample = mocker.patch(
+        "temboardui.plugins.statements.getstatdata_sample", return_value=[]
+    )
+
+    assert [] == getstatdata_rollups(request, start, end, "5", "-42", "10")
+
+    assert "day" == request.db_session.execute.call_args.args[1]["period"]
+    # Falls back to raw snapshots over the whole range.
+    sample.assert_called_once_with(
+        request, "query", start, end, dbid="5", queryid="-42", userid="10"
+    )
@@ -0,0 +1,116 @@
+import pytest
+
+
+def test_ssl_context_shared():
+    from temboardui.toolkit.http import TemboardClient
+
+    client0 = TemboardClient("agent0", 2345)
+    client1 = TemboardClient("agent1", 2345)
+    assert client0.ssl_context is client1.ssl_context
+    assert not client0.ssl_context.check_hostname
+
+
+def test_pool_reuse_keepalive():
+    import threading
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+
+    from temboardui.toolkit.http import TemboardClient, pool
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            body = b'{"port": %d}' % self.client_address[1]
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *a):
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.handle_request)
+    thread.start()
+    try:
+        client = TemboardClient("127.0.0.1", server.server_port, scheme="http")
+        first = client.get("/").json()
+        # Second request is served on the same connection by the same
+        # handle_request() call.
+        second = client.get("/").json()
+        assert first == second
+        key = "http", "127.0.0.1", server.server_port, None, 30
+        assert 1 == len(pool.idle[key])
+    finally:
+        pool.clear()
+        thread.join(5)
+        server.server_close()
+
+
+def test_pool_max_per_host():
+    from temboardui.toolkit.http import ConnectionPool
+
+    class FakeConnection:
+        closed = False
+
+        def close(self):
+            self.closed = True
+
+    pool = ConnectionPool(max_per_host=1)
+    conn0, conn1 = FakeConnection(), FakeConnection()
+    pool.release("key", conn0)
+    pool.release("key", conn1)
+    assert conn1.closed
+    assert conn0 is pool.acquire("key")
+    assert pool.acquire("key") is None
+
+    pool.idle_timeout = 0
+    pool.release("key", conn0)
+    assert pool.acquire("key") is None
+    assert conn0.closed
+
+
+def test_retry_stale_connection(mocker):
+    import http.client
+
+    from temboardui.toolkit.http import TemboardClient, pool
+
+    class StaleConnection:
+        closed = False
+
+        def request(self, *a):
+            pass
+
+        def getresponse(self):
+            raise http.client.RemoteDisconnected("Closed")
+
+        def close(self):
+            self.closed = True
+
+    client = TemboardClient("agent0", 2345, timeout=5)
+    fresh = mocker.Mock()
+    fresh.getresponse.return_value.will_close = True
+    fresh.getresponse.return_value.headers = {"set-cookie": None}
+    mocker.patch.object(client, "connect", return_value=fresh)
+    try:
+        # GET is retried on a new connection.
+        stale = StaleConnection()
+        pool.release(client.pool_key, stale)
+        client.get("/")
+        assert stale.closed
+        assert fresh.request.called
+
+        # POST may have been processed by agent, don't send it twice.
+        fresh.reset_mock()
+        stale = StaleConnection()
+        pool.release(client.pool_key, stale)
+        with pytest.raises(http.client.RemoteDisconnected):
+            client.post("/restart", body={})
+        assert stale.closed
+        assert not fresh.request.called
+
+        # Connection of a client with another timeout is not reused.
+        pool.release(client.pool_key, stale)
+        assert pool.acquire(TemboardClient("agent0", 2345, timeout=1).pool_key) is None
+    finally:
+        pool.clear()
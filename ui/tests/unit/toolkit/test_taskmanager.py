@@ -0,0 +1,54 @@
+import os
+
+
+def getpid_worker():
+    return os.getpid()
+
+
+def test_worker_pool_reuse_child(mocker):
+    from multiprocessing import Queue
+
+    from temboardui.toolkit.taskmanager import (
+        MSG_TYPE_TASK_STATUS,
+        TASK_STATUS_DONE,
+        TASK_STATUS_SCHEDULED,
+        Task,
+        WorkerPool,
+        make_worker_definition,
+    )
+
+    mocker.patch("temboardui.toolkit.taskmanager.proctitle.set")
+
+    task_queue, event_queue = Queue(), Queue()
+    pool = WorkerPool(task_queue, event_queue, max_tasks_per_child=2)
+    pool.perf = dict(fork=0)
+    pool.add(make_worker_definition(getpid_worker, pool_size=1))
+
+    for i in range(3):
+        task_queue.put(
+            Task(
+                id="task%d" % i,
+                worker_name="getpid_worker",
+                options={},
+                status=TASK_STATUS_SCHEDULED,
+            )
+        )
+
+    outputs = {}
+    try:
+        for _ in range(200):
+            pool.serve1()
+            while not event_queue.empty():
+                message = event_queue.get()
+                assert MSG_TYPE_TASK_STATUS == message.type[0]
+                if TASK_STATUS_DONE == message.content["status"]:
+                    outputs[message.content["task_id"]] = message.content["output"]
+            if len(outputs) == 3:
+                break
+    finally:
+        pool.abort_jobs()
+
+    # Two first tasks share the same process. Third one runs in a new child.
+    assert outputs["task0"] == outputs["task1"]
+    assert outputs["task1"] != outputs["task2"]
+    assert 2 == pool.perf["fork"]